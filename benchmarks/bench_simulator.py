@@ -0,0 +1,271 @@
+"""
+Benchmarks for the protocol simulator.
+
+Runs the blockchain protocols over a matrix of parameters, each case in a fresh process,
+and reports throughput, peak memory and per-round latency as JSON.
+Typical use, from the repository root:
+
+    python -m benchmarks.bench_simulator --save-baseline baseline.json
+    python -m benchmarks.bench_simulator --baseline baseline.json    # exits with status 1 on regressions
+    python -m benchmarks.bench_simulator --shards 2 4    # also report the speedup of simulate_sharded
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import traceback
+from typing import List, Dict, Any, Optional
+
+from protocol_api.net import Network, PartiallySynchronousNetwork, NetworkClient, IO
+from protocol_api.protocol import simulate_protocol
+from protocol_api.shard import simulate_sharded
+from protocol_api.blockchain import TotallyNaiveBlockchain, ByzantineBroadcastBlockchain
+from protocol_api.broadcast import ByzantineBroadcast
+
+PROTOCOLS = ['naive', 'bb']
+BACKENDS = ['network', 'shared']
+
+
+class CountingClient(NetworkClient):
+    """
+    A network client that counts the messages its node sends (a broadcast counts as one message per target).
+    Targets that aren't a node id or ``NetworkClient.ALL`` must be sized (e.g., lists).
+    """
+    sent = 0
+
+    def send(self, instance: str, target, msg) -> None:
+        CountingClient.sent += self.n if target is NetworkClient.ALL else 1 if type(target) is int else len(target)
+        super().send(instance, target, msg)
+
+    def send_batch(self, instance: str, sends) -> None:
+        sends = list(sends)
+        n = self.n
+        CountingClient.sent += sum(n if target is NetworkClient.ALL else 1 if type(target) is int else len(target)
+                                   for (target, msg) in sends)
+        super().send_batch(instance, sends)
+
+
+class NodeFactory:
+    """
+    Creates the nodes of a case (a class at module level, so that ``simulate_sharded`` can pickle it).
+    """
+    def __init__(self, protocol: str):
+        self.protocol = protocol
+
+    def __call__(self, id: int, n: int, net: Network):
+        if self.protocol == 'naive':
+            return TotallyNaiveBlockchain('bench', id, None, n, CountingClient(id, n, net), IO())
+        return ByzantineBroadcastBlockchain(ByzantineBroadcast, 'bench', id, None, n, CountingClient(id, n, net), IO())
+
+
+class RateInputs:
+    """
+    Every node gets ``rate`` inputs per round on average.
+    """
+    def __init__(self, rate: float):
+        self.rate = rate
+
+    def __call__(self, id: int, r: int):
+        count = int((r + 1) * self.rate) - int(r * self.rate)
+        return ["tx{}-{}-{}".format(id, r, k) for k in range(count)] or None
+
+
+def make_network(backend: str, Delta: Optional[int]) -> Network:
+    if Delta is not None:
+        return PartiallySynchronousNetwork(Delta)
+    if backend == 'shared':
+        return Network(shared_broadcasts=True)
+    return Network()
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def peak_rss_kb() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss  # macOS reports bytes, Linux kilobytes
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    n, rounds = case['n'], case['rounds']
+    node_factory = NodeFactory(case['protocol'])
+    get_inputs = RateInputs(case['input_rate'])
+    if case.get('shards'):
+        return run_sharded_case(case, node_factory, get_inputs)
+
+    net = make_network(case['backend'], case['Delta'])
+    nodes = [node_factory(i, n, net) for i in range(n)]
+
+    CountingClient.sent = 0
+    round_times: List[float] = []
+    last = [time.perf_counter()]
+    def time_round(r, nodes, terminated):
+        now = time.perf_counter()
+        round_times.append(now - last[0])
+        last[0] = now
+
+    start = time.perf_counter()
+    simulate_protocol(rounds, nodes, net, get_inputs, time_round)
+    elapsed = time.perf_counter() - start
+
+    round_times.sort()
+    result = dict(case)
+    result.update({
+        'seconds': elapsed,
+        'rounds_per_sec': rounds / elapsed,
+        'messages': CountingClient.sent,
+        'messages_per_sec': CountingClient.sent / elapsed,
+        'peak_rss_kb': peak_rss_kb(),
+        'round_latency_ms': {'p50': percentile(round_times, 50) * 1000,
+                             'p90': percentile(round_times, 90) * 1000,
+                             'p99': percentile(round_times, 99) * 1000,
+                             'max': round_times[-1] * 1000 if round_times else 0.0},
+    })
+    return result
+
+
+def run_sharded_case(case: Dict[str, Any], node_factory: NodeFactory, get_inputs: RateInputs) -> Dict[str, Any]:
+    """
+    Run a case with ``simulate_sharded``. Only the total time is measured: the messages are counted, and the
+    rounds timed, in the worker processes, whose memory isn't included in ``peak_rss_kb`` either.
+    """
+    start = time.perf_counter()
+    simulate_sharded(case['rounds'], case['n'], node_factory, get_inputs, case['shards'])
+    elapsed = time.perf_counter() - start
+
+    result = dict(case)
+    result.update({
+        'seconds': elapsed,
+        'rounds_per_sec': case['rounds'] / elapsed,
+        'peak_rss_kb': peak_rss_kb(),
+    })
+    return result
+
+
+def send_result(conn, case: Dict[str, Any]) -> None:
+    try:
+        conn.send((run_case(case), None))
+    except BaseException:
+        conn.send((None, traceback.format_exc()))
+    conn.close()
+
+
+def run_in_process(case: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run a case in a fresh process, so that peak RSS is measured per case. Unlike the workers of a
+    ``multiprocessing.Pool``, the process isn't a daemon, so that sharded cases can start their own workers.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=send_result, args=(sender, case))
+    process.start()
+    sender.close()
+    try:
+        result, error = receiver.recv()
+    except EOFError:
+        error = "The process exited with code {}".format(process.exitcode)
+    process.join()
+    if error is not None:
+        raise RuntimeError("Case {} failed:\n{}".format(case_key(case), error))
+    return result
+
+
+def case_key(case: Dict[str, Any]) -> str:
+    key = "{protocol}/{backend}/n={n}/rounds={rounds}/rate={input_rate}/Delta={Delta}".format(**case)
+    if case.get('shards'):
+        key += "/shards={}".format(case['shards'])
+    return key
+
+
+def add_speedups(results: List[Dict[str, Any]]) -> None:
+    """
+    Set the ``speedup`` of every sharded result: its throughput relative to the same case run in-process.
+    """
+    inprocess = {case_key(result): result for result in results if not result.get('shards')}
+    for result in results:
+        if result.get('shards'):
+            base = inprocess.get(case_key(dict(result, shards=None)))
+            if base is not None:
+                result['speedup'] = result['rounds_per_sec'] / base['rounds_per_sec']
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """
+    Return a description of every case that is slower, or uses more memory, than its baseline by more than
+    ``tolerance`` (a fraction).
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(case_key(result))
+        if base is None:
+            continue
+        if result['rounds_per_sec'] < base['rounds_per_sec'] * (1 - tolerance):
+            regressions.append("{}: {:.1f} rounds/sec, baseline {:.1f}".format(case_key(result),
+                                                                               result['rounds_per_sec'],
+                                                                               base['rounds_per_sec']))
+        if result['peak_rss_kb'] > base['peak_rss_kb'] * (1 + tolerance):
+            regressions.append("{}: peak RSS {} kB, baseline {} kB".format(case_key(result), result['peak_rss_kb'],
+                                                                           base['peak_rss_kb']))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--protocols', nargs='+', choices=PROTOCOLS, default=PROTOCOLS)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=['network'])
+    parser.add_argument('--n', nargs='+', type=int, default=[4, 16])
+    parser.add_argument('--rounds', nargs='+', type=int, default=[200])
+    parser.add_argument('--input-rate', nargs='+', type=float, default=[0.1, 1.0])
+    parser.add_argument('--delta', nargs='+', type=int, default=[],
+                        help="also run on a PartiallySynchronousNetwork with each of these Deltas")
+    parser.add_argument('--shards', nargs='+', type=int, default=[],
+                        help="also run the synchronous cases with simulate_sharded with each of these numbers of "
+                             "worker processes, and report the speedup over the in-process 'network' backend")
+    parser.add_argument('--output', help="write the JSON report to this file (default: stdout)")
+    parser.add_argument('--baseline', help="compare against a saved baseline, and fail on regressions")
+    parser.add_argument('--save-baseline', help="save the results as a baseline file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown / memory growth relative to the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    cases = []
+    for protocol, n, rounds, rate, Delta in itertools.product(args.protocols, args.n, args.rounds, args.input_rate,
+                                                              [None] + args.delta):
+        for backend in (args.backends if Delta is None else ['network']):
+            cases.append({'protocol': protocol, 'backend': backend, 'n': n, 'rounds': rounds, 'input_rate': rate,
+                          'Delta': Delta})
+        if Delta is None:
+            for shards in args.shards:
+                cases.append({'protocol': protocol, 'backend': 'network', 'n': n, 'rounds': rounds,
+                              'input_rate': rate, 'Delta': Delta, 'shards': shards})
+
+    results = [run_in_process(case) for case in cases]
+    add_speedups(results)
+
+    report: Dict[str, Any] = {'python': sys.version.split()[0], 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({case_key(result): result for result in results}, f, indent=2)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
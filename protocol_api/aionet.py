@@ -0,0 +1,165 @@
+import asyncio
+import statistics
+from typing import List, Set, Dict, Tuple, Iterable, Callable, Union, Any, Optional
+
+from .net import Network
+from .protocol import Node
+
+
+class AsyncNetwork(Network):
+    """
+    A ``Network`` for nodes running on an asyncio event loop in real time.
+    A message is stored in the round it was sent in, but only after a (wall-clock) delay, so it is missed by
+    receivers that read that round before it arrives, as on a real network whose delays exceed the tick.
+    Messages with a zero delay are stored when they are sent, so a run with no delays is deterministic.
+    Messages are evicted as on a ``Network``; a message that arrives after its instance was reclaimed,
+    or after its round was evicted, is dropped.
+    """
+    delivers_on_send = False
+
+    def __init__(self, delay: Union[float, Callable[[int, int], float]] = 0.0, horizon: Optional[int] = None):
+        """
+        :param delay: delay of every message in seconds, or a function from (src, target) to a delay.
+        :param horizon: see ``Network``
+        """
+        self.delay = delay if callable(delay) else (lambda src, target: delay)
+        self.in_flight = 0  # Messages sent but not delivered yet
+        self.dropped = 0  # Messages that arrived too late to be stored
+        super().__init__(horizon)
+
+    def send(self, instance: str, src: int, targets: Iterable[int], msg) -> None:
+        if self.observers:
+            if not isinstance(targets, range):
+                targets = list(targets)
+            for observer in self.observers:
+                observer.on_send(self.round, instance, src, targets, msg)
+
+        if instance not in self.baserounds:
+            self.baserounds[instance] = 0  # As in ``get_bucket``, so that ``arrive`` knows the instance
+        loop = asyncio.get_running_loop()
+        for target in targets:
+            self.in_flight += 1
+            delay = self.delay(src, target)
+            if delay <= 0:
+                # Stored right away, as on a ``Network``: a timer could fire after the next round started
+                self.arrive(self.round, instance, src, target, msg)
+            else:
+                loop.call_later(delay, self.arrive, self.round, instance, src, target, msg)
+
+    def send_batch(self, src: int, n: int, outbox: Iterable[Tuple[str, Any, Any]]) -> None:
+        self.send_outbox(src, n, outbox)
+
+    def arrive(self, round: int, instance: str, src: int, target: int, msg) -> None:
+        """
+        Store a message that was sent in ``round`` and has just arrived.
+        """
+        self.in_flight -= 1
+        if self.is_evicted(instance, round):
+            # Storing it would create a bucket that is never evicted
+            self.dropped += 1
+            return
+        for observer in self.observers:
+            observer.on_deliver(self.round, instance, src, target, msg)
+
+        bucket = self.get_bucket(instance, round)
+        if target not in bucket:
+            bucket[target] = {}
+        if src not in bucket[target]:
+            bucket[target][src] = []
+        bucket[target][src].append(msg)
+
+
+class AsyncSimulation:
+    """
+    Runs every node as an asyncio task, with rounds driven by a wall-clock tick,
+    and measures the confirmation latency of every input.
+    """
+    def __init__(self, nodes: Iterable[Node], net: AsyncNetwork, get_inputs: Callable[[int, int], Any],
+                 tick: float = 0.01, corrupted_ids: Iterable[int] = ()):
+        """
+        :param tick: duration of a round in seconds
+        :param corrupted_ids: nodes whose outputs don't count towards confirmation
+        """
+        self.nodes = list(nodes)
+        self.net = net
+        self.get_inputs = get_inputs
+        self.tick = tick
+        self.corrupted_ids = set(corrupted_ids)
+        self.confirmers = len([node for node in self.nodes if node.id not in self.corrupted_ids])
+
+        self.terminated: Set[int] = set()
+        self.late_rounds = 0  # Rounds that started more than a tick late, because nodes took too long
+        self.ticks: Dict[int, asyncio.Future] = {}
+
+        self.submitted: Dict[Any, float] = {}  # Time every input item was first given to a node
+        self.output_counts: Dict[Any, int] = {}  # Number of honest nodes that output each item
+        self.latencies: Dict[Any, float] = {}  # Confirmation latency (in seconds) of every confirmed item
+
+    def get_tick(self, round: int) -> asyncio.Future:
+        if round not in self.ticks:
+            self.ticks[round] = asyncio.get_running_loop().create_future()
+        return self.ticks[round]
+
+    async def run(self, rounds: int) -> Set[int]:
+        """
+        Run the nodes for ``rounds`` rounds.
+        :return: the ids of the nodes that terminated
+        """
+        tasks = [asyncio.ensure_future(self.run_node(node, rounds)) for node in self.nodes]
+        await self.clock(rounds)
+        await asyncio.gather(*tasks)
+        return self.terminated
+
+    def run_sync(self, rounds: int) -> Set[int]:
+        return asyncio.run(self.run(rounds))
+
+    async def clock(self, rounds: int) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for r in range(rounds):
+            deadline = start + r * self.tick
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            if loop.time() - deadline > self.tick:
+                self.late_rounds += 1
+            self.net.setround(r)
+            self.get_tick(r).set_result(None)
+
+    async def run_node(self, node: Node, rounds: int) -> None:
+        loop = asyncio.get_running_loop()
+        seen = 0  # Number of outputs of the node that were already counted
+        for r in range(rounds):
+            await self.get_tick(r)
+
+            inputs = self.get_inputs(node.id, r)
+            node.io.set_input(r, inputs)
+            if inputs is not None:
+                for item in (inputs if isinstance(inputs, (list, tuple)) else [inputs]):
+                    self.submitted.setdefault(item, loop.time())
+
+            done = node.protocol(r)
+
+            if node.id not in self.corrupted_ids:
+                now = loop.time()
+                for item in node.io.out[seen:]:
+                    self.output_counts[item] = self.output_counts.get(item, 0) + 1
+                    if self.output_counts[item] == self.confirmers and item in self.submitted:
+                        self.latencies[item] = now - self.submitted[item]
+                seen = len(node.io.out)
+
+            if done:
+                self.terminated.add(node.id)
+                return
+
+    def latency_stats(self) -> Dict[str, float]:
+        """
+        Summary of the confirmation latencies, in seconds: an input is confirmed when all the honest nodes output it.
+        """
+        latencies: List[float] = sorted(self.latencies.values())
+        if not latencies:
+            return {'submitted': len(self.submitted), 'confirmed': 0}
+        return {'submitted': len(self.submitted),
+                'confirmed': len(latencies),
+                'mean': statistics.mean(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+                'max': latencies[-1]}
@@ -1,46 +1,95 @@
-from typing import Union, Type
+from typing import List, Dict, Tuple, Union, Type, Iterable
 
 from .broadcast import ByzantineBroadcast, InconsistentByzantineBroadcast, InvalidByzantineBroadcast
+from .codec import BatchCodec, PipeBatchCodec
+from .mempool import Mempool, PendingInputs, OutputItems
 from .net import IO, SingleInputIO
-from .protocol import Node
+from .protocol import Node, NodePool
 
 
-class TotallyNaiveBlockchain(Node):
-    def protocol(self, round: int) -> bool:
-        if round == 0:
-            # Initialization
-            self.pending_inputs = set()
-            self.outputs = set()
+class MempoolSets:
+    """
+    The ``pending_inputs`` and ``outputs`` sets that the blockchains had before they kept their inputs
+    in ``self.mempool``, as views of the mempool; kept for subclasses (e.g., adversaries) that use them.
+    """
+    __slots__ = ()
+
+    @property
+    def pending_inputs(self) -> PendingInputs:
+        return PendingInputs(self.mempool)
+
+    @pending_inputs.setter
+    def pending_inputs(self, items: Iterable) -> None:
+        pending = PendingInputs(self.mempool)
+        pending.clear()
+        pending.update(items)
+
+    @property
+    def outputs(self) -> OutputItems:
+        return OutputItems(self.mempool)
+
+    @outputs.setter
+    def outputs(self, items: Iterable) -> None:
+        outputs = OutputItems(self.mempool)
+        outputs.clear()
+        outputs.update(items)
+
+
+class TotallyNaiveBlockchain(MempoolSets, Node):
+    __slots__ = ('mempool',)
+
+    def __init__(self, *args, mempool: Mempool = None, **kwargs):
+        """
+        :param mempool: holds the pending inputs (default: an unlimited FIFO ``Mempool``)
+        """
+        super().__init__(*args, **kwargs)
+        self.mempool = mempool if mempool is not None else Mempool()
 
+    @classmethod
+    def get_horizon(cls):
+        return 1  # We only read the messages of the previous round
+
+    def protocol(self, round: int) -> bool:
         if round > 0:
             received = self.get_messages(round - 1, (round - 1) % self.n)
             for msg in received:
                 self.output(msg)
-            self.outputs.update(received)
-            self.pending_inputs.difference_update(received)
+            self.mempool.mark_output(received)
 
         inputs = self.get_input(round)
         if inputs:
-            self.pending_inputs.update(set(inputs).difference(self.outputs))  # Add inputs that weren't output yet
+            self.mempool.update(inputs)  # Add inputs that weren't output yet
         if round % self.n == self.id:
             # I'm the sender. Send my inputs to everyone.
-            for inp in self.pending_inputs:
-                self.send(self.net.ALL, inp)
+            self.send_batch((self.net.ALL, inp) for inp in self.mempool)
+
+        if self.event_driven:
+            # Nothing to do until my next turn as a sender, unless I receive messages or inputs.
+            turn = (self.id - round) % self.n
+            self.set_wakeup(round + (turn if turn > 0 else self.n), on_message=True, on_input=True)
 
         return False  # Blockchain never dies!
 
 
-class ByzantineBroadcastBlockchain(Node):
-    def __init__(self, bbclass: Type[ByzantineBroadcast], *args, **kwargs):
+class ByzantineBroadcastBlockchain(MempoolSets, Node):
+    __slots__ = ('bbclass', 'bbfactory', 'R', 'codec', 'mempool', 'bbnode', 'bbio', 'bbbaseround')
+
+    def __init__(self, bbclass: Type[ByzantineBroadcast], *args, codec: BatchCodec = None, mempool: Mempool = None,
+                 recycle: bool = False, **kwargs):
+        """
+        :param bbclass: the BB protocol used to agree on every batch
+        :param codec: serializes batches of inputs into a BB input (default: ``PipeBatchCodec``).
+            If the codec has a ``max_size``, inputs that don't fit wait for a later batch.
+        :param mempool: holds the inputs I've received that haven't been output yet, and filters out
+            inputs that were already output (default: an unlimited FIFO ``Mempool``)
+        :param recycle: reuse the node and IO client of the previous BB instance for the next one
+        """
         super().__init__(*args, **kwargs)
         self.bbclass = bbclass
+        self.bbfactory = NodePool(bbclass, 1) if recycle else bbclass
         self.R = bbclass.get_maxrounds()
-
-        # Set of inputs I've received that haven't been output yet
-        self.pending_inputs = set()
-
-        # Set of outputs
-        self.outputs = set()
+        self.codec = codec if codec is not None else PipeBatchCodec()
+        self.mempool = mempool if mempool is not None else Mempool()
 
         # The node for the current BB instance
         self.bbnode: Union[Node, None] = None
@@ -54,52 +103,150 @@ class ByzantineBroadcastBlockchain(Node):
         # Update any inputs received in this round.
         round_inputs = self.get_input(round)
         if round_inputs:
-            inputs = set(round_inputs)
-            inputs.difference_update(self.outputs)
-            self.pending_inputs.update(inputs)
+            self.mempool.update(round_inputs)
 
         if round % self.R == 0:
             # Start new BB instance
             sender = k % self.n
             if sender == self.id:
                 # I'm the sender in this BB instance.
-                # BB expects a single string as input, so we serialize the pending inputs.
-                bbinputs = "|".join(self.pending_inputs)
+                # BB expects a single input, so we serialize (as many as fit of) the pending inputs.
+                bbinputs = self.codec.encode(self.codec.take_batch(self.mempool))
             else:
                 # I'm not the sender in this BB instance, so don't my BB node won't have inputs
                 bbinputs = None
 
             # Create an IO client for the BB instance.
             # the SingleInputIO is a subclass of IO that sends input only in the first round.
-            self.bbio = SingleInputIO((sender, bbinputs))
+            if isinstance(self.bbfactory, NodePool) and self.bbio is not None:
+                self.bbio.reset((sender, bbinputs))
+                self.bbfactory.release(self.bbnode)
+            else:
+                self.bbio = SingleInputIO((sender, bbinputs))
 
             # Start a new subprotocol for the BB isntance.
-            self.bbnode = self.start_subprotocol(self.bbclass, "BB" + str(k), self.bbio)
+            self.bbnode = self.start_subprotocol(self.bbfactory, "BB" + str(k), self.bbio)
 
             # The BB-instance's round 0 is the current round.
             self.bbbaseround = round
 
-        # Execute a protocol round in the BB subprotocol
-        self.bbnode.protocol(round - self.bbbaseround)
+        # Execute a protocol round in the BB subprotocol (if it's still running)
+        self.run_subprotocol(self.bbnode, round - self.bbbaseround)
 
         # Read any output from the BB instance.
         outputstrs = self.bbio.read_outputs()
         for out in outputstrs:
-            # We actually only expect a single, string output, which we deserialze.
-            outputs = str(out).split("|")
+            # We actually only expect a single output, which we deserialize.
+            outputs = self.codec.decode(out)
             for single_output in outputs:
                 self.output(single_output)
-            self.pending_inputs.difference_update(outputs)
-            self.outputs.update(outputs)
+            self.mempool.mark_output(outputs)
+
+        if self.event_driven:
+            # Nothing to do until the next BB instance starts, or until the current one has work
+            # (as declared by its own wakeup), unless I receive inputs.
+            next_start = round - round % self.R + self.R
+            if self.bbnode.has_terminated:
+                self.set_wakeup(next_start, on_input=True)
+            elif self.bbnode.next_wakeup is not None:
+                wakeup = self.bbnode.next_wakeup
+                if wakeup.round is not None:
+                    next_start = min(next_start, self.bbbaseround + wakeup.round)
+                self.set_wakeup(next_start, on_message=wakeup.on_message, on_input=True)
+
+        return False  # Blockchain never dies!
+
+
+class PipelinedBroadcastBlockchain(MempoolSets, Node):
+    """
+    Like ``ByzantineBroadcastBlockchain``, but starts a new BB instance every round instead of every R rounds,
+    so up to R instances are running at the same time.
+    Batches are output in instance order, skipping inputs that were already output.
+    """
+    __slots__ = ('bbclass', 'bbfactory', 'R', 'codec', 'mempool', 'empty_batch', 'in_flight', 'proposed', 'completed',
+                 'next_output')
+
+    def __init__(self, bbclass: Type[ByzantineBroadcast], *args, codec: BatchCodec = None, mempool: Mempool = None,
+                 recycle: bool = False, **kwargs):
+        """
+        :param bbclass: the BB protocol used to agree on every batch
+        :param codec: serializes batches of inputs into a BB input (default: ``PipeBatchCodec``).
+        :param mempool: see ``ByzantineBroadcastBlockchain``
+        :param recycle: reuse the nodes of terminated BB instances for new ones
+        """
+        super().__init__(*args, **kwargs)
+        self.bbclass = bbclass
+        self.bbfactory = NodePool(bbclass) if recycle else bbclass
+        self.R = bbclass.get_maxrounds()
+        self.codec = codec if codec is not None else PipeBatchCodec()
+        self.mempool = mempool if mempool is not None else Mempool()
+        self.empty_batch = self.codec.encode([])
+
+        # Running BB instances: index -> (node, IO client, base round)
+        self.in_flight: Dict[int, Tuple[Node, IO, int]] = {}
+
+        # The inputs I proposed in every BB instance that wasn't output yet (they aren't proposed again meanwhile)
+        self.proposed: Dict[int, List] = {}
+
+        # Outputs of the BB instances that terminated but can't be output yet, since an earlier instance is running
+        self.completed: Dict[int, List] = {}
+
+        # Index of the next BB instance to output
+        self.next_output = 0
+
+    def protocol(self, round: int) -> bool:
+        round_inputs = self.get_input(round)
+        if round_inputs:
+            self.mempool.update(round_inputs)
+
+        # Start a new BB instance every round
+        k = round
+        sender = k % self.n
+        if sender == self.id:
+            proposed = set().union(*self.proposed.values())
+            batch = self.codec.take_batch(inp for inp in self.mempool if inp not in proposed)
+            self.proposed[k] = batch
+            bbinputs = self.codec.encode(batch)
+        else:
+            bbinputs = None
+        bbio = SingleInputIO((sender, bbinputs))
+        self.in_flight[k] = (self.start_subprotocol(self.bbfactory, "BB" + str(k), bbio), bbio, round)
+
+        # Execute a round in every running instance
+        for index, (bbnode, bbio, baseround) in list(self.in_flight.items()):
+            terminated = self.run_subprotocol(bbnode, round - baseround)
+            self.completed.setdefault(index, []).extend(bbio.read_outputs())
+            if terminated:
+                del self.in_flight[index]
+                if isinstance(self.bbfactory, NodePool):
+                    self.bbfactory.release(bbnode)
+            elif not self.completed[index]:
+                del self.completed[index]
+
+        # Output the batches of terminated instances, in instance order
+        while self.next_output in self.completed and self.next_output not in self.in_flight:
+            for out in self.completed.pop(self.next_output):
+                if out == self.empty_batch:
+                    continue
+                for single_output in self.codec.decode(out):
+                    if not self.mempool.is_output(single_output):
+                        self.output(single_output)
+                        self.mempool.mark_output([single_output])
+            self.proposed.pop(self.next_output, None)
+            self.next_output += 1
 
         return False  # Blockchain never dies!
 
 
 class InconsistentBroadcastBlockchain(ByzantineBroadcastBlockchain):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(InconsistentByzantineBroadcast, *args, **kwargs)
 
 
 class InvalidBroadcastBlockchain(ByzantineBroadcastBlockchain):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(InvalidByzantineBroadcast, *args, **kwargs)
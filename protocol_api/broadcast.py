@@ -2,6 +2,8 @@ from typing import List
 from .protocol import Node
 
 class ByzantineBroadcast(Node):
+    __slots__ = ('outval', 'sender_id')
+
     @classmethod
     def get_maxrounds(cls):
         return 4
@@ -24,9 +26,14 @@ class ByzantineBroadcast(Node):
                 self.output(0)
             return True
 
+        if self.event_driven:
+            # Nothing to do until the output round, unless the sender's message arrives.
+            self.set_wakeup(self.get_maxrounds() - 1, on_message=self.outval is None)
         return False
 
 class InconsistentByzantineBroadcast(ByzantineBroadcast):
+    __slots__ = ('inconsistent_outputs',)
+
     def adversary_set_outputs(self, outputs: List[str]) -> None:
         """
         The adversary can call this method to set the outputs *for all parties*.
@@ -38,11 +45,11 @@ class InconsistentByzantineBroadcast(ByzantineBroadcast):
 
     def protocol(self, round: int) -> bool:
         retval = super().protocol(round)
+        self.next_wakeup = None  # The adversary may act in any round
         if round == 1 and self.sender_id == self.id:
             # Allow overriding previous output
             try:
-                for i, outval in enumerate(self.inconsistent_outputs):
-                    self.send(i, outval)
+                self.send_batch(enumerate(self.inconsistent_outputs))
             except AttributeError:
                 pass
         elif round == 2:
@@ -58,6 +65,8 @@ class InconsistentByzantineBroadcast(ByzantineBroadcast):
 
 
 class InvalidByzantineBroadcast(ByzantineBroadcast):
+    __slots__ = ('invalid_output',)
+
     def adversary_set_output(self, output: str) -> None:
         """
         The adversary can call this method to set a common output for all parties.
@@ -69,6 +78,7 @@ class InvalidByzantineBroadcast(ByzantineBroadcast):
 
     def protocol(self, round: int) -> bool:
         retval = super().protocol(round)
+        self.next_wakeup = None  # The adversary may act in any round
         if round == 1:
             # Allow overriding previous output
             try:
@@ -77,9 +87,9 @@ class InvalidByzantineBroadcast(ByzantineBroadcast):
                 pass
         elif round == 2:
             # Check if there was an override message
-            received = self.get_allmessages_contents(1)
+            received = self.get_view(1).contents()
             # We will output the first message received.
             if len(received) == 1:
-                self.outval = received.pop()
+                self.outval = next(iter(received))
 
         return retval
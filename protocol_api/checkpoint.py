@@ -0,0 +1,477 @@
+import copy
+import hashlib
+import heapq
+import io as io_module
+import os
+import pickle
+import struct
+from typing import List, Set, Dict, Tuple, Iterable, Iterator, Any, Optional, NamedTuple
+
+from .net import Network, PendingStore, IO, SingleInputIO
+from .protocol import Node
+from .instrument import Profiler
+from .mempool import Mempool, ExactFilter
+
+# A checkpoint file is a sequence of records, each one a little-endian 8-byte length followed by a pickle of
+# (kind, round, payload). Records are only ever appended:
+#   ('rounds', r, {round: {instance: bucket}})  messages of rounds that can no longer change, written once
+#   ('nodes', r, {index: bytes})                pickles of the nodes that changed since the previous checkpoint
+#                                               (without their IO clients and mempools, which are in the 'io'
+#                                               and 'mempools' records)
+#   ('io', r, {index: (ioclass, inputs, outputs)})
+#                                               the new inputs and outputs of every node's IO client
+#   ('mempools', r, {index: [(state, items, seen)]})
+#                                               the changes of the mempools of every node, in pickling order:
+#                                               a pickle of their state if it changed (else None), and deltas of
+#                                               their pending items and of the items of their ``ExactFilter``
+#   ('state', r, (netclass, netstate, current, retained, terminated, nnodes))
+#                                               closes the checkpoint taken at the end of round r; netstate only
+#                                               has the changes of the network's attributes
+#
+# Deltas (of dicts, sets, IO histories and pending stores) are (full, changed, removed) tuples: if ``full`` is true,
+# ``changed`` replaces the previous value, otherwise it's updated with ``changed`` and the ``removed`` keys.
+RECORD_HEADER = struct.Struct('<Q')
+
+# IO clients whose whole state is their input and output histories, which are saved as deltas
+DELTA_IO_TYPES = (IO, SingleInputIO)
+
+# Attributes of a ``PartiallySynchronousNetwork`` that are views of its pending store (rebuilt on restore)
+PENDING_VIEWS = {'pending_msgs': 'byround', 'pending_msgs_byid': 'byid'}
+
+
+class Checkpoint(NamedTuple):
+    round: int  # The last round that was executed
+    net: Network
+    nodes: List[Node]
+    terminated: Set[int]
+
+
+class NodePickler(pickle.Pickler):
+    """
+    Pickles nodes without the network they share (it's saved separately), without profilers,
+    and without the IO client ``io`` (if given), which is saved separately as well.
+    If ``mempools`` is given, the mempools are left out too, and appended to it (in pickling order).
+    """
+    def __init__(self, file, net: Network, io: Optional[IO] = None, mempools: Optional[List[Mempool]] = None):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.net = net
+        self.io = io
+        self.mempools = mempools
+
+    def persistent_id(self, obj):
+        if obj is self.net:
+            return 'net'
+        if obj is self.io and obj is not None:
+            return 'io'
+        if isinstance(obj, Profiler):
+            return 'profiler'
+        if self.mempools is not None and isinstance(obj, Mempool):
+            for (k, mempool) in enumerate(self.mempools):
+                if mempool is obj:
+                    return ('mempool', k)
+            self.mempools.append(obj)
+            return ('mempool', len(self.mempools) - 1)
+        return None
+
+
+class NodeUnpickler(pickle.Unpickler):
+    def __init__(self, file, net: Network, io: Optional[IO] = None, mempools: Optional[List[Mempool]] = None):
+        super().__init__(file)
+        self.net = net
+        self.io = io
+        self.mempools = mempools
+
+    def persistent_load(self, pid):
+        if pid == 'net':
+            return self.net
+        if pid == 'io' and self.io is not None:
+            return self.io
+        if pid == 'profiler':
+            return None
+        if type(pid) is tuple and pid[0] == 'mempool' and self.mempools is not None and pid[1] < len(self.mempools):
+            return self.mempools[pid[1]]
+        raise pickle.UnpicklingError("Unknown persistent id {}".format(pid))
+
+
+def pickle_node(node: Node, net: Network, io: Optional[IO] = None, mempools: Optional[List[Mempool]] = None) -> bytes:
+    buf = io_module.BytesIO()
+    NodePickler(buf, net, io, mempools).dump(node)
+    return buf.getvalue()
+
+
+def unpickle_node(data: bytes, net: Network, io: Optional[IO] = None, mempools: Optional[List[Mempool]] = None) -> Node:
+    return NodeUnpickler(io_module.BytesIO(data), net, io, mempools).load()
+
+
+class DictDelta:
+    """
+    Tracks the changes of a dict from one checkpoint to the next.
+    With ``immutable``, the values of existing keys are assumed to never change (e.g., input histories),
+    so only the keys are remembered; otherwise values are compared with a copy of the last saved value.
+    """
+    def __init__(self, immutable: bool = False):
+        self.immutable = immutable
+        self.saved: Optional[dict] = None  # Saved keys (mapped to a copy of their value, unless immutable)
+
+    def delta(self, d: dict) -> Tuple[bool, dict, list]:
+        if self.saved is None:
+            self.saved = dict.fromkeys(d) if self.immutable else copy.deepcopy(d)
+            return (True, dict(d), [])
+        saved = self.saved
+        changed = {}
+        for (key, value) in d.items():
+            if key not in saved:
+                changed[key] = value
+            elif not self.immutable and saved[key] != value:
+                changed[key] = value
+            else:
+                continue
+            saved[key] = None if self.immutable else copy.deepcopy(value)
+        # Every key of d is saved now, so keys were removed iff there are more saved keys
+        removed = [key for key in saved if key not in d] if len(saved) > len(d) else []
+        for key in removed:
+            del saved[key]
+        return (False, changed, removed)
+
+
+def apply_delta(d: dict, delta: Tuple[bool, dict, list]) -> None:
+    (full, changed, removed) = delta
+    if full:
+        d.clear()
+    d.update(changed)
+    for key in removed:
+        d.pop(key, None)
+
+
+class SetDelta:
+    """
+    Tracks the changes of a set from one checkpoint to the next.
+    """
+    def __init__(self):
+        self.saved: Optional[set] = None
+
+    def delta(self, s: set) -> Tuple[bool, set, list]:
+        if self.saved is None:
+            self.saved = set(s)
+            return (True, set(s), [])
+        added = s - self.saved
+        self.saved |= added
+        # Every item of s is saved now, so items were removed iff there are more saved items
+        removed = list(self.saved - s) if len(self.saved) > len(s) else []
+        self.saved.difference_update(removed)
+        return (False, added, removed)
+
+
+def apply_set_delta(s: set, delta: Tuple[bool, set, list]) -> None:
+    (full, added, removed) = delta
+    if full:
+        s.clear()
+    s |= added
+    s.difference_update(removed)
+
+
+class IODelta:
+    """
+    Tracks the new inputs and outputs of an IO client, whose histories are append-only
+    (outputs may also be cleared by ``read_outputs``).
+    """
+    def __init__(self):
+        self.inputs = DictDelta(immutable=True)
+        self.out: Optional[list] = None  # The saved output list, and its saved length
+        self.nout = 0
+
+    def delta(self, io: IO) -> tuple:
+        if io.out is self.out and len(io.out) >= self.nout:
+            outputs = (False, io.out[self.nout:], [])
+        else:
+            outputs = (True, list(io.out), [])
+        self.out = io.out
+        self.nout = len(io.out)
+        return (type(io), self.inputs.delta(io.inp), outputs)
+
+
+def apply_io_delta(io: Optional[IO], delta: tuple) -> IO:
+    (ioclass, inputs, (full, outputs, removed)) = delta
+    if io is None or type(io) is not ioclass:
+        io = ioclass.__new__(ioclass)
+        io.inp = {}
+        io.out = []
+    apply_delta(io.inp, inputs)
+    if full:
+        io.out = list(outputs)
+    else:
+        io.out.extend(outputs)
+    return io
+
+
+class MempoolDelta:
+    """
+    Tracks the changes of a ``Mempool``: its pending items and the items of its ``ExactFilter`` (which grows
+    with every output) are saved as deltas, and the rest of its state (e.g., a ``RotatingBloomFilter``,
+    whose size is fixed) is pickled again when it changed.
+    """
+    def __init__(self, net: Network):
+        self.net = net
+        self.mempool: Optional[Mempool] = None
+        self.digest: Optional[bytes] = None
+        self.items = DictDelta()
+        self.seen = SetDelta()
+
+    def delta(self, mempool: Mempool) -> tuple:
+        if mempool is not self.mempool:
+            self.__init__(self.net)
+            self.mempool = mempool
+        exact = type(mempool.seen) is ExactFilter
+        # The heap is rebuilt from the pending items
+        state = {key: value for (key, value) in mempool.__dict__.items()
+                 if key not in ('items', 'heap') and not (exact and key == 'seen')}
+        data = pickle_node((type(mempool), state), self.net)
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest == self.digest:
+            data = None
+        self.digest = digest
+        return (data, self.items.delta(mempool.items), self.seen.delta(mempool.seen.items) if exact else None)
+
+
+def apply_mempool_delta(saved: Optional[list], delta: tuple) -> list:
+    """
+    :param saved: the [state, items, seen] of a mempool, as updated by the previous deltas (None: none yet)
+    """
+    (data, items, seen) = delta
+    if saved is None:
+        saved = [None, {}, None]
+    if data is not None:
+        saved[0] = data
+    apply_delta(saved[1], items)
+    if seen is None:
+        saved[2] = None
+    else:
+        if saved[2] is None:
+            saved[2] = set()
+        apply_set_delta(saved[2], seen)
+    return saved
+
+
+def rebuild_mempool(saved: list, net: Network) -> Mempool:
+    (data, items, seen) = saved
+    (mempoolclass, state) = unpickle_node(data, net)
+    mempool = mempoolclass.__new__(mempoolclass)
+    mempool.__dict__.update(state)
+    # Items were inserted in the order of their sequence numbers
+    mempool.items = dict(sorted(items.items(), key=lambda entry: entry[1]))
+    mempool.heap = []
+    if mempool.priority is not None:
+        mempool.heap = [(mempool.priority(item), seq, item) for (item, seq) in mempool.items.items()]
+        heapq.heapify(mempool.heap)
+    if seen is not None:
+        mempool.seen = ExactFilter()
+        mempool.seen.items = set(seen)
+    return mempool
+
+
+def pending_delta(tracker: DictDelta, pending: PendingStore) -> tuple:
+    return (tracker.delta(pending.byid), pending.lastid)
+
+
+def apply_pending_delta(byid: dict, delta: tuple) -> int:
+    (byid_delta, lastid) = delta
+    apply_delta(byid, byid_delta)
+    return lastid
+
+
+def rebuild_pending(byid: dict, lastid: int) -> PendingStore:
+    pending = PendingStore()
+    for id in sorted(byid):
+        (src, target, msg, instance, round) = byid[id]
+        pending.lastid = id
+        pending.add(instance, src, target, msg, round)
+    pending.lastid = lastid
+    return pending
+
+
+def read_records(path: str) -> Iterator[Tuple[str, int, Any]]:
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            (length,) = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return  # A checkpoint that was interrupted while being written
+            yield pickle.loads(data)
+
+
+class Checkpointer:
+    """
+    Saves the state of a simulation every ``every`` rounds to an append-only file.
+    Only what changed since the previous checkpoint is written: messages of past rounds are written once,
+    a node is only written again if its state (excluding its IO client and mempools) changed, and the IO
+    histories, the mempools and the network's state are written as deltas.
+    An instance can be passed as the ``round_assertion`` of ``simulate_protocol``, and a run resumed with
+    ``simulate_protocol(..., start_round=checkpoint.round + 1, terminated=checkpoint.terminated)``.
+    """
+    def __init__(self, path: str, net: Network, every: int = 1):
+        self.path = path
+        self.net = net
+        self.every = every
+
+        self.written_upto = -1  # All message rounds up to this one are in the file
+        self.digests: Dict[int, bytes] = {}  # Digest of the last pickle written for each node
+        self.ios: Dict[int, IODelta] = {}  # Changes of the IO client of each node
+        self.mempools: Dict[int, List[MempoolDelta]] = {}  # Changes of the mempools of each node
+        self.netdicts: Dict[str, DictDelta] = {}  # Changes of the network's dict attributes
+        self.pending = DictDelta(immutable=True)  # Changes of the pending messages (pending messages never change)
+        if os.path.exists(path):
+            # Continue an existing (e.g., forked) file; nodes are fully written at the next checkpoint.
+            for (kind, r, payload) in read_records(path):
+                if kind == 'state':
+                    self.written_upto = r - 1
+
+    def __call__(self, r: int, nodes: Iterable[Node], terminated: Set[int]) -> None:
+        if (r + 1) % self.every == 0:
+            self.save(r, nodes, terminated)
+
+    def save(self, r: int, nodes: Iterable[Node], terminated: Set[int]) -> None:
+        """
+        Save a checkpoint of the simulation at the end of round ``r``.
+        """
+        net = self.net
+        nodes = list(nodes)
+        with open(self.path, 'ab') as f:
+            # Rounds before r are final: later deliveries are always stored in the current round or later.
+            final = {round: dict(net.msgs[round]) for round in range(self.written_upto + 1, r) if round in net.msgs}
+            if final:
+                self.write(f, ('rounds', r, final))
+            self.written_upto = r - 1
+
+            changed = {}
+            ios = {}
+            mempools = {}
+            for idx, node in enumerate(nodes):
+                io = node.io if type(node.io) in DELTA_IO_TYPES else None
+                if io is not None:
+                    ios[idx] = self.ios.setdefault(idx, IODelta()).delta(io)
+                node_mempools: List[Mempool] = []
+                data = pickle_node(node, net, io, node_mempools)
+                if node_mempools:
+                    trackers = self.mempools.setdefault(idx, [])
+                    trackers.extend(MempoolDelta(net) for _ in range(len(node_mempools) - len(trackers)))
+                    mempools[idx] = [tracker.delta(mempool) for (tracker, mempool) in zip(trackers, node_mempools)]
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                if self.digests.get(idx) != digest:
+                    changed[idx] = data
+                    self.digests[idx] = digest
+            if ios:
+                self.write(f, ('io', r, ios))
+            if mempools:
+                self.write(f, ('mempools', r, mempools))
+            if changed:
+                self.write(f, ('nodes', r, changed))
+
+            netstate = {}
+            for (key, value) in net.__dict__.items():
+                if key in ('msgs', 'observers', 'arrivals', 'views') or key in PENDING_VIEWS:
+                    continue
+                if type(value) is dict:
+                    netstate[key] = ('dict', self.netdicts.setdefault(key, DictDelta()).delta(value))
+                elif type(value) is PendingStore:
+                    netstate[key] = ('pending', (self.pending.delta(value.byid), value.lastid))
+                else:
+                    netstate[key] = ('value', value)
+            current = dict(net.msgs.get(r, {}))
+            retained = {round: list(buckets) for (round, buckets) in net.msgs.items()}
+            self.write(f, ('state', r, (type(net), netstate, current, retained, set(terminated), len(nodes))))
+
+    def write(self, f, record: Tuple[str, int, Any]) -> None:
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        f.write(RECORD_HEADER.pack(len(data)))
+        f.write(data)
+
+
+def list_checkpoints(path: str) -> List[int]:
+    """
+    Return the rounds at which checkpoints were saved in ``path``.
+    """
+    return [r for (kind, r, payload) in read_records(path) if kind == 'state']
+
+
+def restore(path: str, round: Optional[int] = None) -> Checkpoint:
+    """
+    Load a checkpoint (by default, the last one). Every call returns new objects,
+    so a checkpoint can be restored several times to explore different continuations.
+    """
+    msgs: Dict[int, dict] = {}
+    nodes: Dict[int, bytes] = {}
+    ios: Dict[int, IO] = {}
+    mempools: Dict[int, List[list]] = {}  # The saved [state, items, seen] of the mempools of every node
+    netattrs: Dict[str, Any] = {}
+    pending: Dict[str, Tuple[dict, int]] = {}  # Pending messages by id, and last id, of every pending store
+    state = None
+    for (kind, r, payload) in read_records(path):
+        if kind == 'rounds':
+            msgs.update(payload)
+        elif kind == 'nodes':
+            nodes.update(payload)
+        elif kind == 'io':
+            for (idx, delta) in payload.items():
+                ios[idx] = apply_io_delta(ios.get(idx), delta)
+        elif kind == 'mempools':
+            for (idx, deltas) in payload.items():
+                saved = mempools.setdefault(idx, [])
+                saved.extend([None] * (len(deltas) - len(saved)))
+                for (k, delta) in enumerate(deltas):
+                    saved[k] = apply_mempool_delta(saved[k], delta)
+        elif kind == 'state':
+            state = (r, payload)
+            for (key, (how, value)) in payload[1].items():
+                if how == 'dict':
+                    apply_delta(netattrs.setdefault(key, {}), value)
+                elif how == 'pending':
+                    byid = pending[key][0] if key in pending else {}
+                    apply_delta(byid, value[0])
+                    pending[key] = (byid, value[1])
+                else:
+                    netattrs[key] = value
+            if r == round:
+                break
+    if state is None or (round is not None and state[0] != round):
+        raise KeyError("No checkpoint for round {} in {}".format(round, path))
+
+    (r, (netclass, netstate, current, retained, terminated, nnodes)) = state
+    msgs[r] = current
+
+    net = netclass.__new__(netclass)
+    for key in netstate:
+        net.__dict__[key] = rebuild_pending(*pending[key]) if key in pending else netattrs[key]
+    for (view, index) in PENDING_VIEWS.items():
+        if 'pending' in net.__dict__:
+            net.__dict__[view] = getattr(net.pending, index)
+    net.msgs = {round: {instance: msgs[round][instance] for instance in instances}
+                for (round, instances) in retained.items()}
+    net.observers = []
+    net.arrivals = None
+    net.views = {}
+
+    return Checkpoint(r, net, [unpickle_node(nodes[idx], net, ios.get(idx),
+                                             [rebuild_mempool(saved, net) for saved in mempools.get(idx, [])])
+                               for idx in range(nnodes)], terminated)
+
+
+def fork(path: str, round: int, new_path: str) -> None:
+    """
+    Copy the checkpoint file ``path`` up to (and including) the checkpoint of ``round`` to ``new_path``,
+    so that a run restored from that checkpoint can keep saving checkpoints to ``new_path``.
+    """
+    with open(path, 'rb') as src, open(new_path, 'wb') as dst:
+        while True:
+            header = src.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                raise KeyError("No checkpoint for round {} in {}".format(round, path))
+            (length,) = RECORD_HEADER.unpack(header)
+            data = src.read(length)
+            dst.write(header)
+            dst.write(data)
+            (kind, r, payload) = pickle.loads(data)
+            if kind == 'state' and r == round:
+                return
@@ -0,0 +1,240 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import List, Set, Dict, Tuple, Iterable, Callable, Any, Deque, Optional
+from .protocol import Node
+from .streamio import StreamingIO
+
+
+def check_output_consistency(r: int, honest_nodes: List[Node]) -> Tuple[bool, str]:
+    output = ''
+    outputnode = -1
+    for node in honest_nodes:
+        nodeout = "|".join(node.io.out)
+        if nodeout.startswith(output):
+            output = nodeout
+            outputnode = node.id
+        elif not output.startswith(nodeout):
+            return (False,
+                    "At round {}, node {}'s output {} is inconsistent with node {}'s output {}".format(r, outputnode,
+                                                                                                       output, node.id,
+                                                                                                       nodeout))
+    return (True, "Consistent at round {}".format(r))
+
+
+def check_output_liveness(T: int, r: int, honest_nodes: List[Node]) -> Tuple[bool, str]:
+    """
+    Check T-liveness at round r.
+    :param T: liveness parameter
+    :param r: current round
+    :param honest_nodes:
+    :return:
+    """
+
+    if r < T:
+        # Can't violate liveness if we haven't had T rounds yet.
+        return (True, "Trivially {}-live at round {}".format(T,r))
+
+    honest_inputs = set()
+    # input_rounds = [] # For each round store the set of inputs that were received at that round.
+
+    for i in range(r - T + 1):
+        for node in honest_nodes:
+            node_input = node.io.get_input(i)
+            if node_input:
+                honest_inputs.update(node_input)
+
+    # Compute output intersection.
+    outputs = honest_inputs.copy()
+    for node in honest_nodes:
+        outputs.intersection_update(node.io.out)
+
+    notlive = honest_inputs.difference(outputs)
+    if len(notlive) > 0:
+        return (False,
+                ("Not {}-live: Inputs were received by some honest party before round {} "+
+                "but not output by all honest parties by round {}: {}").format(T, r - T + 1, r, notlive))
+    else:
+        return (True, "{}-Live at round {}".format(T, r))
+
+
+class IncrementalChecker(ABC):
+    """
+    Base class for checkers that consume only the new inputs and outputs of every round.
+    A checker instance can be passed directly as the ``round_assertion`` of ``simulate_protocol``;
+    it then raises an AssertionError at the first violation.
+    Alternatively, honest nodes with a ``streamio.StreamingIO`` can feed the checker directly (see ``stream``);
+    otherwise, their IO must keep at least the outputs of a round.
+    """
+    def __init__(self, corrupted_ids: Iterable[int] = ()):
+        self.corrupted_ids = set(corrupted_ids)
+        self.next_input_round = 0  # First round whose inputs were not consumed yet
+        self.outputs_seen: Dict[int, int] = {}  # Number of outputs already consumed for each node
+        self.streamed: List[int] = []  # Honest nodes that feed the checker through ``stream``
+
+    def update(self, r: int, honest_nodes: Iterable[Node]) -> None:
+        """
+        Consume the inputs received up to round ``r`` and the outputs produced since the last update.
+        """
+        honest_nodes = list(honest_nodes)
+        for i in range(self.next_input_round, r + 1):
+            for node in honest_nodes:
+                node_input = node.io.get_input(i)
+                if node_input:
+                    self.add_inputs(i, node.id, node_input)
+        self.next_input_round = max(self.next_input_round, r + 1)
+
+        for node in honest_nodes:
+            out = node.io.get_outputs()
+            seen = self.outputs_seen.get(node.id, 0)
+            # A StreamingIO only keeps its last outputs: the new ones are at the end
+            total = node.io.count if isinstance(node.io, StreamingIO) else len(out)
+            if total - seen > len(out):
+                raise ValueError("Node {} has {} new outputs but its IO only kept {}: feed the checker with stream()"
+                                 .format(node.id, total - seen, len(out)))
+            if total > seen:
+                self.add_outputs(r, node.id, out[len(out) - (total - seen):])
+        self.end_round(r, [node.id for node in honest_nodes])
+
+    def stream(self, node_id: int) -> Tuple[Callable[[int, Any], None], Callable[[int, Any], None]]:
+        """
+        Feed the checker from the ``StreamingIO`` of an honest node, instead of reading the node's IO in ``update``.
+        Every honest node must be registered before the simulation starts.
+        :return: the ``(on_input, on_output)`` callbacks to pass to the node's ``StreamingIO``
+        """
+        self.streamed.append(node_id)
+        return (lambda r, inputs: self.add_inputs(r, node_id, inputs),
+                lambda r, output: self.add_outputs(r, node_id, [output]))
+
+    def end_round(self, r: int, honest_ids: List[int]) -> None:
+        """
+        Called once all the inputs and outputs of round ``r`` were consumed.
+        """
+        pass
+
+    def add_inputs(self, r: int, node_id: int, inputs: Iterable) -> None:
+        pass
+
+    def add_outputs(self, r: int, node_id: int, outputs: Iterable) -> None:
+        """
+        Subclasses must call this to advance the count of consumed outputs.
+        """
+        self.outputs_seen[node_id] = self.outputs_seen.get(node_id, 0) + len(outputs)
+
+    @abstractmethod
+    def check(self, r: int) -> Tuple[bool, str]:
+        pass
+
+    def __call__(self, r: int, nodes: Iterable[Node], terminated: Set[int]) -> None:
+        if self.streamed:
+            self.end_round(r, self.streamed)
+        else:
+            self.update(r, [node for node in nodes if node.id not in self.corrupted_ids])
+        res, msg = self.check(r)
+        if not res:
+            raise AssertionError(msg)
+
+
+class ConsistencyChecker(IncrementalChecker):
+    """
+    Incremental version of ``check_output_consistency``: honest outputs must be prefixes of each other.
+    Outputs are compared item by item, and only the part of the longest output that some honest node
+    hasn't output yet is kept.
+    """
+    def __init__(self, corrupted_ids: Iterable[int] = ()):
+        super().__init__(corrupted_ids)
+        self.tail: Deque[Tuple[Any, int]] = deque()  # (output, node that output it first), starting at ``offset``
+        self.offset = 0
+        self.violation: Optional[str] = None
+
+    def add_outputs(self, r: int, node_id: int, outputs: List) -> None:
+        pos = self.outputs_seen.get(node_id, 0)
+        for out in outputs:
+            if pos - self.offset < len(self.tail):
+                (expected, expected_node) = self.tail[pos - self.offset]
+                if out != expected and self.violation is None:
+                    self.violation = "At round {}, node {}'s output #{} {} is inconsistent with node {}'s output #{} {}".format(
+                        r, expected_node, pos, expected, node_id, pos, out)
+            else:
+                self.tail.append((out, node_id))
+            pos += 1
+        super().add_outputs(r, node_id, outputs)
+
+    def end_round(self, r: int, honest_ids: List[int]) -> None:
+        # Forget the prefix that every honest node has already output.
+        common = min((self.outputs_seen.get(id, 0) for id in honest_ids), default=0)
+        while self.offset < common:
+            self.tail.popleft()
+            self.offset += 1
+
+    def check(self, r: int) -> Tuple[bool, str]:
+        if self.violation is not None:
+            return (False, self.violation)
+        return (True, "Consistent at round {}".format(r))
+
+
+class LivenessChecker(IncrementalChecker):
+    """
+    Incremental version of ``check_output_liveness``: every input received by an honest node at round i
+    must be output by all honest nodes by round i + T.
+    """
+    def __init__(self, T: int, corrupted_ids: Iterable[int] = ()):
+        super().__init__(corrupted_ids)
+        self.T = T
+        self.nhonest = 0
+
+        # Inputs that weren't output by every honest node yet, mapped to the round they were first seen at.
+        self.first_seen: Dict[Any, int] = {}
+        # The same inputs in the order they were seen, as (round, input). May contain inputs that were output since.
+        self.queue: Deque[Tuple[int, Any]] = deque()
+        # Honest nodes that output each item that wasn't output by all of them yet.
+        self.outputters: Dict[Any, Set[int]] = {}
+        # Items output by every honest node.
+        self.done: Set = set()
+
+    def update(self, r: int, honest_nodes: Iterable[Node]) -> None:
+        honest_nodes = list(honest_nodes)
+        self.nhonest = len(honest_nodes)
+        super().update(r, honest_nodes)
+
+    def stream(self, node_id: int) -> Tuple[Callable[[int, Any], None], Callable[[int, Any], None]]:
+        callbacks = super().stream(node_id)
+        self.nhonest = len(self.streamed)
+        return callbacks
+
+    def add_inputs(self, r: int, node_id: int, inputs: Iterable) -> None:
+        for item in inputs:
+            if item not in self.done and item not in self.first_seen:
+                self.first_seen[item] = r
+                self.queue.append((r, item))
+
+    def add_outputs(self, r: int, node_id: int, outputs: List) -> None:
+        for item in outputs:
+            if item in self.done:
+                continue
+            outputters = self.outputters.setdefault(item, set())
+            outputters.add(node_id)
+            if len(outputters) >= self.nhonest:
+                self.done.add(item)
+                del self.outputters[item]
+                self.first_seen.pop(item, None)
+        super().add_outputs(r, node_id, outputs)
+
+    def check(self, r: int) -> Tuple[bool, str]:
+        T = self.T
+        if r < T:
+            # Can't violate liveness if we haven't had T rounds yet.
+            return (True, "Trivially {}-live at round {}".format(T, r))
+
+        while self.queue and self.queue[0][1] not in self.first_seen:
+            self.queue.popleft()
+        if self.queue and self.queue[0][0] <= r - T:
+            notlive = set()
+            for (i, item) in self.queue:
+                if i > r - T:
+                    break
+                if item in self.first_seen:
+                    notlive.add(item)
+            return (False,
+                    ("Not {}-live: Inputs were received by some honest party before round {} "+
+                    "but not output by all honest parties by round {}: {}").format(T, r - T + 1, r, notlive))
+        return (True, "{}-Live at round {}".format(T, r))
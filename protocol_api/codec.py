@@ -0,0 +1,153 @@
+from abc import ABC, abstractmethod
+from typing import List, Tuple, Iterable, Iterator, Any, Optional
+
+
+class BatchCodec(ABC):
+    """
+    Serializes a batch of blockchain inputs into a single BB payload, and back.
+    """
+    def __init__(self, max_size: Optional[int] = None):
+        """
+        :param max_size: maximal size of an encoded batch (None: unlimited).
+            Items that don't fit are left for a later batch.
+        """
+        self.max_size = max_size
+
+    @abstractmethod
+    def encode(self, items: Iterable) -> Any:
+        pass
+
+    @abstractmethod
+    def decode(self, payload) -> List:
+        """
+        Decode a payload. This must never raise, since the payload may come from a corrupt node.
+        """
+        pass
+
+    @abstractmethod
+    def item_size(self, item) -> int:
+        """
+        The number of bytes ``item`` adds to an encoded batch.
+        """
+        pass
+
+    def take_batch(self, items: Iterable) -> List:
+        """
+        Return the longest prefix of ``items`` that fits in ``max_size``
+        (a single item that is too large on its own is still returned, alone).
+        """
+        if self.max_size is None:
+            return list(items)
+
+        batch = []
+        size = 0
+        for item in items:
+            size += self.item_size(item)
+            if size > self.max_size and batch:
+                break
+            batch.append(item)
+        return batch
+
+
+class PipeBatchCodec(BatchCodec):
+    """
+    The original format: string items joined with "|". Items must not contain "|".
+    """
+    def encode(self, items: Iterable) -> str:
+        return "|".join(items)
+
+    def decode(self, payload) -> List:
+        return str(payload).split("|")
+
+    def item_size(self, item) -> int:
+        return len(item) + 1
+
+
+class LengthPrefixedBatchCodec(BatchCodec):
+    """
+    A compact binary format for arbitrary str and bytes items.
+    Each item is encoded as a type tag byte, its length as a varint, and its data
+    (UTF-8 for strings, the raw bytes for bytes).
+    """
+    BYTES = 0
+    STR = 1
+
+    def encode(self, items: Iterable) -> bytes:
+        out = bytearray()
+        for item in items:
+            tag, data = self.serialize(item)
+            out.append(tag)
+            self.write_varint(out, len(data))
+            out += data
+        return bytes(out)
+
+    def decode(self, payload) -> List:
+        if not isinstance(payload, (bytes, bytearray, memoryview)):
+            # Not one of our payloads (e.g., a default BB output); treat it as a single opaque item.
+            return [payload]
+        try:
+            return [self.deserialize(tag, data) for (tag, data) in self.iter_slices(payload)]
+        except ValueError:  # Includes UnicodeDecodeError
+            return [payload]
+
+    def iter_slices(self, payload) -> Iterator[Tuple[int, memoryview]]:
+        """
+        Iterate over the items of a payload without copying them.
+        :return: an iterator of (tag, data) pairs, where data is a memoryview slice of the payload.
+        """
+        view = memoryview(payload)
+        pos = 0
+        while pos < len(view):
+            tag = view[pos]
+            length, pos = self.read_varint(view, pos + 1)
+            if pos + length > len(view):
+                raise ValueError("Truncated batch payload")
+            yield (tag, view[pos:pos + length])
+            pos += length
+
+    def item_size(self, item) -> int:
+        length = len(self.serialize(item)[1])
+        return 1 + self.varint_size(length) + length
+
+    def serialize(self, item) -> Tuple[int, bytes]:
+        if isinstance(item, str):
+            return (self.STR, item.encode('utf-8'))
+        elif isinstance(item, (bytes, bytearray)):
+            return (self.BYTES, bytes(item))
+        raise TypeError("Can only encode str and bytes items, not {}".format(type(item).__name__))
+
+    def deserialize(self, tag: int, data: memoryview):
+        if tag == self.STR:
+            return str(data, 'utf-8')
+        elif tag == self.BYTES:
+            return data.tobytes()
+        raise ValueError("Unknown item tag {}".format(tag))
+
+    @staticmethod
+    def write_varint(out: bytearray, value: int) -> None:
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    @staticmethod
+    def read_varint(view: memoryview, pos: int) -> Tuple[int, int]:
+        value = 0
+        shift = 0
+        while True:
+            if pos >= len(view):
+                raise ValueError("Truncated varint")
+            byte = view[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return (value, pos)
+            shift += 7
+
+    @staticmethod
+    def varint_size(value: int) -> int:
+        size = 1
+        while value >= 0x80:
+            value >>= 7
+            size += 1
+        return size
@@ -0,0 +1,266 @@
+import multiprocessing
+import random
+from typing import List, Set, Dict, Tuple, Type, Iterable, Sequence, Callable, Any, Optional, NamedTuple
+
+from .net import Network, PartiallySynchronousNetwork, NetworkClient, IO
+from .protocol import Node, SimulationSession
+from .checks import ConsistencyChecker, LivenessChecker
+from .schedulers import RandomDelay
+
+ADVERSARY_METHODS = ('adversary_set_output', 'adversary_set_outputs')
+
+
+class FuzzCase(NamedTuple):
+    """
+    A fully scripted scenario: running it twice gives the same result.
+    Like ``sweep.Scenario``, it must be picklable (classes defined at module level).
+    """
+    honest_class: Type[Node]
+    n: int
+    rounds: int
+    corrupted_ids: Tuple[int, ...]
+    inputs: Tuple[Tuple[int, int, Any], ...]  # (round, node id, input item)
+    # (round, corrupted node id, method, argument): after the node ran the round, call ``method(argument)``
+    # on the node or on the subprotocol it just started (see ``apply_action``)
+    actions: Tuple[Tuple[int, int, str, Any], ...] = ()
+    corrupted_class: Optional[Type[Node]] = None  # Class of the corrupted nodes (default: ``honest_class``)
+    T: Optional[int] = None  # Liveness parameter (None: don't check liveness)
+    Delta: Optional[int] = None  # If set, run on a PartiallySynchronousNetwork with this Delta
+    delivery_seed: Optional[int] = None  # With Delta, deliver messages with a ``RandomDelay`` with this seed
+
+
+class FuzzResult(NamedTuple):
+    case: FuzzCase
+    kind: Optional[str]  # 'consistency', 'liveness' or 'error' (an exception in a node); None if no violation
+    round: Optional[int]  # Round of the violation
+    message: str
+
+
+class FuzzSpace(NamedTuple):
+    """
+    The distribution that random ``FuzzCase``s are drawn from.
+    """
+    honest_class: Type[Node]
+    n: Sequence[int] = (3, 4, 5)
+    rounds: int = 40
+    max_corrupted: int = 1
+    input_rate: float = 0.3  # Probability that a node gets an input item in a round
+    action_rate: float = 0.2  # Probability that a corrupted node makes an adversary call in a round
+    methods: Sequence[str] = ADVERSARY_METHODS
+    values: Sequence[Any] = ('', 'evil', 'evil|twin')  # Arguments of the adversary calls (besides input items)
+    corrupted_class: Optional[Type[Node]] = None
+    T: Optional[int] = None
+    Deltas: Sequence[Optional[int]] = (None,)
+
+
+class FuzzViolation(AssertionError):
+    def __init__(self, kind: str, round: int, message: str):
+        super().__init__(message)
+        self.kind = kind
+        self.round = round
+
+
+def random_case(space: FuzzSpace, seed: int) -> FuzzCase:
+    """
+    Draw a case from ``space``; the same seed always gives the same case.
+    """
+    rng = random.Random(seed)
+    n = rng.choice(list(space.n))
+    corrupted_ids = tuple(sorted(rng.sample(range(n), rng.randint(1, min(space.max_corrupted, n - 1)))))
+
+    inputs = []
+    for r in range(space.rounds):
+        for id in range(n):
+            if rng.random() < space.input_rate:
+                inputs.append((r, id, "tx{}-{}-{}".format(seed, r, id)))
+
+    values = list(space.values) + [item for (r, id, item) in inputs[:8]]
+    actions = []
+    for r in range(space.rounds):
+        for id in corrupted_ids:
+            if rng.random() < space.action_rate:
+                method = rng.choice(list(space.methods))
+                if method == 'adversary_set_outputs':
+                    argument = [rng.choice(values) for _ in range(n)]
+                else:
+                    argument = rng.choice(values)
+                actions.append((r, id, method, argument))
+
+    Delta = rng.choice(list(space.Deltas))
+    return FuzzCase(space.honest_class, n, space.rounds, corrupted_ids, tuple(inputs), tuple(actions),
+                    space.corrupted_class, space.T, Delta, rng.randrange(2 ** 32) if Delta is not None else None)
+
+
+def apply_action(node: Node, round: int, method: str, argument) -> bool:
+    """
+    Make an adversary call on a corrupted node: on the node itself if it has the method, otherwise on the
+    subprotocol instance it started in ``round`` (e.g., the current BB instance of a blockchain).
+    :return: true iff some node had the method
+    """
+    targets = [node, getattr(node, 'bbnode', None)]
+    in_flight = getattr(node, 'in_flight', None)
+    if in_flight and round in in_flight:
+        targets.append(in_flight[round][0])
+    for target in targets:
+        if target is not None and hasattr(target, method):
+            getattr(target, method)(argument)
+            return True
+    return False
+
+
+def run_case(case: FuzzCase) -> FuzzResult:
+    """
+    Run a case on a fresh network, stopping at the first violation.
+    """
+    n = case.n
+    if case.Delta is None:
+        net = Network()
+    else:
+        net = PartiallySynchronousNetwork(case.Delta, RandomDelay(case.delivery_seed)
+                                          if case.delivery_seed is not None else None)
+    corrupted: Set[int] = set(case.corrupted_ids)
+    corrupted_class = case.corrupted_class or case.honest_class
+    nodes: List[Node] = [(corrupted_class if i in corrupted else case.honest_class)('test1', i, None, n,
+                                                                                     NetworkClient(i, n, net), IO())
+                         for i in range(n)]
+    honest_nodes = [node for node in nodes if node.id not in corrupted]
+
+    schedule: Dict[Tuple[int, int], List] = {}
+    for (r, id, item) in case.inputs:
+        schedule.setdefault((id, r), []).append(item)
+    actions: Dict[Tuple[int, int], List[Tuple[str, Any]]] = {}
+    for (r, id, method, argument) in case.actions:
+        actions.setdefault((r, id), []).append((method, argument))
+
+    checkers = [('consistency', ConsistencyChecker(corrupted))]
+    if case.T is not None:
+        checkers.append(('liveness', LivenessChecker(case.T, corrupted)))
+
+    def run_actions(r: int, node: Node, terminated: Set[int]):
+        for (method, argument) in actions.get((r, node.id), ()):
+            apply_action(node, r, method, argument)
+
+    def check_round(r: int, nodes: Iterable[Node], terminated: Set[int]):
+        for (kind, checker) in checkers:
+            checker.update(r, honest_nodes)
+            res, msg = checker.check(r)
+            if not res:
+                raise FuzzViolation(kind, r, msg)
+
+    rounds_run = [0]
+    def get_inputs(id: int, r: int):
+        rounds_run[0] = r
+        return schedule.get((id, r))
+
+    try:
+        with SimulationSession(net) as session:
+            session.simulate(case.rounds, nodes, get_inputs, check_round, run_actions if actions else None)
+    except FuzzViolation as violation:
+        return FuzzResult(case, violation.kind, violation.round, str(violation))
+    except Exception as e:
+        return FuzzResult(case, 'error', rounds_run[0], "{}: {}".format(type(e).__name__, e))
+    return FuzzResult(case, None, None, "No violation in {} rounds".format(case.rounds))
+
+
+def run_seed(args: Tuple[FuzzSpace, int]) -> FuzzResult:
+    space, seed = args
+    return run_case(random_case(space, seed))
+
+
+def ddmin(items: Sequence, fails: Callable[[List], bool]) -> List:
+    """
+    Delta debugging: find a small subsequence of ``items`` for which ``fails`` still holds
+    (it is 1-minimal: removing any single item makes ``fails`` false).
+    :param fails: a test that is true for ``items``
+    """
+    items = list(items)
+    if items and fails([]):
+        return []
+    granularity = 2
+    while len(items) >= 2:
+        size = -(-len(items) // granularity)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        for i, chunk in enumerate(chunks):
+            if fails(chunk):
+                items, granularity = chunk, 2
+                break
+            complement = [item for other in chunks[:i] + chunks[i + 1:] for item in other]
+            if granularity > 2 and fails(complement):
+                items, granularity = complement, max(granularity - 1, 2)
+                break
+        else:
+            if granularity >= len(items):
+                break
+            granularity = min(2 * granularity, len(items))
+    return items
+
+
+def shrink(result: FuzzResult) -> FuzzResult:
+    """
+    Shrink a failing case to a minimal reproduction with the same kind of violation: cut the rounds after
+    the violation, use synchronous delivery if possible, and minimize the adversary calls, the inputs and
+    the corrupted nodes.
+    """
+    kind = result.kind
+    best = [result]
+
+    def fails(case: FuzzCase) -> bool:
+        candidate = run_case(case)
+        if candidate.kind != kind:
+            return False
+        best[0] = candidate
+        return True
+
+    case = result.case
+    if result.round is not None and result.round + 1 < case.rounds:
+        shorter = case._replace(rounds=result.round + 1,
+                                inputs=tuple(i for i in case.inputs if i[0] <= result.round),
+                                actions=tuple(a for a in case.actions if a[0] <= result.round))
+        if fails(shorter):
+            case = shorter
+    if case.Delta is not None and fails(case._replace(Delta=None, delivery_seed=None)):
+        case = case._replace(Delta=None, delivery_seed=None)
+
+    case = case._replace(actions=tuple(ddmin(case.actions, lambda actions: fails(case._replace(actions=tuple(actions))))))
+    case = case._replace(inputs=tuple(ddmin(case.inputs, lambda inputs: fails(case._replace(inputs=tuple(inputs))))))
+
+    def with_corrupted(ids: List[int]) -> FuzzCase:
+        return case._replace(corrupted_ids=tuple(ids), actions=tuple(a for a in case.actions if a[1] in ids))
+    if len(case.corrupted_ids) > 1:
+        ids = ddmin(case.corrupted_ids, lambda ids: bool(ids) and fails(with_corrupted(ids)))
+        case = with_corrupted(ids)
+
+    # The last successful test isn't necessarily the final case: run it once more.
+    final = run_case(case)
+    return final if final.kind == kind else best[0]
+
+
+def fuzz(space: FuzzSpace, cases: int = 1000, seed: int = 0, processes: Optional[int] = None,
+         max_failures: Optional[int] = 1, shrink_failures: bool = True) -> List[FuzzResult]:
+    """
+    Run random cases from ``space`` until ``max_failures`` violations are found.
+    :param cases: number of cases to run; case i is ``random_case(space, seed + i)``
+    :param processes: number of worker processes (default: number of cores). With 1, runs in the current process.
+    :param max_failures: stop after this many failing cases (None: run all the cases)
+    :param shrink_failures: shrink every failing case to a minimal reproduction (in the current process)
+    :return: the failing cases (shrunk), in seed order
+    """
+    seeds = ((space, s) for s in range(seed, seed + cases))
+    failures: List[FuzzResult] = []
+
+    def collect(results: Iterable[FuzzResult]):
+        for result in results:
+            if result.kind is not None:
+                failures.append(result)
+                if max_failures is not None and len(failures) >= max_failures:
+                    return
+
+    if processes == 1:
+        collect(map(run_seed, seeds))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            collect(pool.imap(run_seed, seeds, chunksize=16))
+
+    if shrink_failures:
+        failures = [shrink(failure) for failure in failures]
+    return failures
@@ -0,0 +1,169 @@
+import time
+from collections import deque
+from typing import List, Dict, Iterable, Any, Optional, Deque
+
+
+def message_size(msg) -> int:
+    """
+    Approximate size of a message in bytes.
+    """
+    if isinstance(msg, (str, bytes, bytearray)):
+        return len(msg)
+    return len(repr(msg))
+
+
+class RoundProfile:
+    """
+    Statistics of a single round.
+    """
+    def __init__(self, round: int):
+        self.round = round
+        self.node_time: Dict[int, float] = {}  # Wall time of ``node.protocol`` for every node id (in seconds)
+        self.instance_time: Dict[str, float] = {}  # Wall time of every instance, including its subinstances
+        self.sent: Dict[str, int] = {}  # Messages sent on every instance (one per target)
+        self.received: Dict[str, int] = {}  # Messages delivered on every instance
+        self.queued_bytes = 0  # Bytes pending in a PartiallySynchronousNetwork at the end of the round
+
+
+class Profiler:
+    """
+    Collects per-round statistics of a simulation. Pass it as the ``profiler`` of ``simulate_protocol``.
+    """
+    def __init__(self, history: Optional[int] = None):
+        """
+        :param history: number of most recent rounds to keep in ``rounds`` (None: all of them).
+            Totals are kept for the whole run.
+        """
+        self.rounds: Deque[RoundProfile] = deque(maxlen=history)
+        self.current: Optional[RoundProfile] = None
+        self.delivers_on_send = True
+
+        # Running totals of the messages pending in a PartiallySynchronousNetwork (its ``PendingStore``),
+        # kept up to date by the observer hooks.
+        self.pending = None
+        self.queued = 0
+        self.queued_bytes = 0
+
+        # Totals over the whole run
+        self.instance_time: Dict[str, float] = {}
+        self.sent: Dict[str, int] = {}
+        self.received: Dict[str, int] = {}
+
+    # Hooks called by the simulation
+    def attach(self, net, nodes: Iterable) -> None:
+        self.delivers_on_send = net.delivers_on_send
+        self.pending = getattr(net, 'pending', None)
+        self.count_queued()
+        net.observers.append(self)
+        for node in nodes:
+            node.profiler = self
+
+    def detach(self, net, nodes: Iterable) -> None:
+        net.observers.remove(self)
+        for node in nodes:
+            node.profiler = None
+
+    def start_round(self, round: int) -> None:
+        self.current = RoundProfile(round)
+        self.rounds.append(self.current)
+
+    def end_round(self, net) -> None:
+        if self.pending is not None:
+            if self.queued != len(self.pending):
+                # Messages were removed without being delivered (e.g., those of a reclaimed instance)
+                self.count_queued()
+            self.current.queued_bytes = self.queued_bytes
+
+    def count_queued(self) -> None:
+        """
+        Recompute the totals of the pending messages from the store.
+        """
+        if self.pending is None:
+            self.queued = self.queued_bytes = 0
+        else:
+            self.queued = len(self.pending)
+            self.queued_bytes = sum(message_size(entry[2]) for entry in self.pending.byid.values())
+
+    def run_node(self, node, round: int) -> bool:
+        """
+        Execute a round of a top-level node and record its wall time.
+        """
+        start = time.perf_counter()
+        retval = node.protocol(round)
+        elapsed = time.perf_counter() - start
+        self.current.node_time[node.id] = self.current.node_time.get(node.id, 0.0) + elapsed
+        self.add_instance_time(node.instance, elapsed)
+        return retval
+
+    def run_subprotocol(self, subnode, round: int) -> bool:
+        start = time.perf_counter()
+        retval = subnode.protocol(round)
+        self.add_instance_time(subnode.instance, time.perf_counter() - start)
+        return retval
+
+    def add_instance_time(self, instance: str, seconds: float) -> None:
+        self.current.instance_time[instance] = self.current.instance_time.get(instance, 0.0) + seconds
+        self.instance_time[instance] = self.instance_time.get(instance, 0.0) + seconds
+
+    # Network observer
+    def on_send(self, round: int, instance: str, src: int, targets, msg) -> None:
+        count = len(targets)
+        if self.current is not None:
+            self.current.sent[instance] = self.current.sent.get(instance, 0) + count
+        self.sent[instance] = self.sent.get(instance, 0) + count
+        if self.delivers_on_send:
+            self.count_received(instance, count)
+        elif self.pending is not None:
+            self.queued += count
+            self.queued_bytes += count * message_size(msg)
+
+    def on_deliver(self, round: int, instance: str, src: int, target: int, msg) -> None:
+        self.count_received(instance, 1)
+        if self.pending is not None:
+            self.queued -= 1
+            self.queued_bytes -= message_size(msg)
+
+    def count_received(self, instance: str, count: int) -> None:
+        if self.current is not None:
+            self.current.received[instance] = self.current.received.get(instance, 0) + count
+        self.received[instance] = self.received.get(instance, 0) + count
+
+    # Reports
+    def folded(self, merge_indices: bool = True) -> List[str]:
+        """
+        Return the time spent in every instance in the "folded stacks" format used by flame graph tools:
+        one line per instance, with the nesting of subinstance names (``test1-BB3`` becomes ``test1;BB3``)
+        and its self time (excluding subinstances) in microseconds.
+        :param merge_indices: strip trailing numbers from subinstance names, so that e.g. all BB instances
+            are merged into a single ``BB`` frame.
+        """
+        self_time: Dict[str, float] = dict(self.instance_time)
+        for instance, seconds in self.instance_time.items():
+            sep = instance.rfind("-")
+            if sep >= 0 and instance[:sep] in self_time:
+                self_time[instance[:sep]] -= seconds
+
+        stacks: Dict[str, float] = {}
+        for instance, seconds in self_time.items():
+            frames = instance.split("-")
+            if merge_indices:
+                frames = frames[:1] + [frame.rstrip("0123456789") or frame for frame in frames[1:]]
+            stack = ";".join(frames)
+            stacks[stack] = stacks.get(stack, 0.0) + max(seconds, 0.0)
+        return ["{} {}".format(stack, int(seconds * 1e6)) for stack, seconds in sorted(stacks.items())]
+
+    def breakdown(self, depth: int = 1, merge_indices: bool = True) -> Dict[str, float]:
+        """
+        Total time (including subinstances) of the instances at nesting depth ``depth``:
+        1 for top-level instances such as ``test1``, 2 for their subinstances such as ``test1-BB3``, etc.
+        :param merge_indices: strip trailing numbers from subinstance names, as in ``folded``.
+        """
+        totals: Dict[str, float] = {}
+        for instance, seconds in self.instance_time.items():
+            frames = instance.split("-")
+            if len(frames) == depth:
+                if merge_indices:
+                    frames = frames[:1] + [frame.rstrip("0123456789") or frame for frame in frames[1:]]
+                name = "-".join(frames)
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
@@ -0,0 +1,227 @@
+import hashlib
+import heapq
+import math
+from collections.abc import MutableSet
+from typing import List, Dict, Tuple, Iterable, Iterator, Callable, Any, Optional
+
+
+class ExactFilter:
+    """
+    Remembers every item it was given (the blockchains' original behavior; memory grows with the number of items).
+    """
+    def __init__(self):
+        self.items = set()
+
+    def add(self, item) -> None:
+        self.items.add(item)
+
+    def __contains__(self, item) -> bool:
+        return item in self.items
+
+
+class RotatingBloomFilter:
+    """
+    A space-efficient filter for items that were already seen, with two Bloom filter generations:
+    when the current generation is full, it replaces the previous one and a new generation is started.
+    An item is remembered for at least ``capacity`` subsequent additions; there are no false negatives
+    in that window, and false positives happen with probability about ``fp_rate``.
+    As the ``seen`` filter of a ``Mempool``, a false positive means a new input is dropped as already output
+    (such inputs are counted in ``Mempool.already_output``).
+    Memory is fixed at about ``-2 * capacity * ln(fp_rate / 2) / ln(2)^2`` bits.
+    """
+    def __init__(self, capacity: int, fp_rate: float = 0.001):
+        self.capacity = capacity
+        # Both generations are queried, so each one gets half of the false positive rate.
+        self.nbits = max(8, int(math.ceil(-capacity * math.log(fp_rate / 2) / math.log(2) ** 2)))
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self.current = bytearray((self.nbits + 7) // 8)
+        self.previous = bytearray((self.nbits + 7) // 8)
+        self.count = 0  # Items added to the current generation
+
+    def indices(self, item) -> Iterator[int]:
+        if isinstance(item, str):
+            data = item.encode('utf-8')
+        elif isinstance(item, bytes):
+            data = item
+        else:
+            data = repr(item).encode('utf-8')
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, item) -> None:
+        if self.count >= self.capacity:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.count = 0
+        for index in self.indices(item):
+            self.current[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, item) -> bool:
+        indices = list(self.indices(item))
+        return (all(self.current[index >> 3] & (1 << (index & 7)) for index in indices) or
+                all(self.previous[index >> 3] & (1 << (index & 7)) for index in indices))
+
+
+class Mempool:
+    """
+    The inputs a blockchain node received but didn't output yet, in a deterministic order:
+    FIFO by default, or by increasing ``priority(item)`` (ties in FIFO order).
+    Items that were already output are remembered by the ``seen`` filter, and are not added again.
+    """
+    def __init__(self, capacity: Optional[int] = None, priority: Optional[Callable[[Any], Any]] = None,
+                 seen=None):
+        """
+        :param capacity: maximal number of pending items (None: unlimited). New items are dropped when it's full.
+        :param priority: a key function; items with the smallest key come first (None: FIFO)
+        :param seen: filter of the items that were output (default: an ``ExactFilter``);
+            use a ``RotatingBloomFilter`` to bound memory.
+        """
+        self.capacity = capacity
+        self.priority = priority
+        self.seen = seen if seen is not None else ExactFilter()
+        self.items: Dict[Any, int] = {}  # Pending items (in insertion order), mapped to their sequence number
+        self.heap: List[Tuple[Any, int, Any]] = []  # (priority, sequence number, item), with removed items
+        self.nextseq = 0  # Sequence number of the next item
+        self.dropped = 0  # Number of items dropped because the mempool was full
+        # Number of items not added because the ``seen`` filter reported them as output. With a probabilistic
+        # filter, some of them may be false positives: new items that are silently lost.
+        self.already_output = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item) -> bool:
+        return item in self.items
+
+    def __iter__(self) -> Iterator:
+        """
+        Iterate over the pending items, in order. The mempool must not be modified during the iteration.
+        """
+        if self.priority is None:
+            return iter(self.items)
+        return self.iter_heap()
+
+    def iter_heap(self) -> Iterator:
+        heap = list(self.heap)
+        while heap:
+            (key, seq, item) = heapq.heappop(heap)
+            if self.items.get(item) == seq:
+                yield item
+
+    def add(self, item) -> bool:
+        """
+        Add an item, unless it's pending, was already output, or the mempool is full.
+        :return: true iff the item was added
+        """
+        if item in self.items:
+            return False
+        if item in self.seen:
+            self.already_output += 1
+            return False
+        if self.capacity is not None and len(self.items) >= self.capacity:
+            self.dropped += 1
+            return False
+        seq = self.nextseq
+        self.nextseq += 1
+        self.items[item] = seq
+        if self.priority is not None:
+            heapq.heappush(self.heap, (self.priority(item), seq, item))
+        return True
+
+    def update(self, items: Iterable) -> None:
+        for item in items:
+            self.add(item)
+
+    def discard(self, item) -> None:
+        """
+        Remove a pending item (without marking it as output).
+        """
+        self.items.pop(item, None)
+
+    def mark_output(self, items: Iterable) -> None:
+        """
+        Remove output items from the pending items, and remember them so they aren't added again.
+        """
+        for item in items:
+            self.items.pop(item, None)
+            self.seen.add(item)
+        if self.heap and len(self.heap) > 2 * len(self.items) + 16:
+            # Drop the entries of removed items
+            self.heap = [entry for entry in self.heap if self.items.get(entry[2]) == entry[1]]
+            heapq.heapify(self.heap)
+
+    def is_output(self, item) -> bool:
+        return item in self.seen
+
+
+class PendingInputs(MutableSet):
+    """
+    The pending items of a mempool as a mutable set: the ``pending_inputs`` attribute of the blockchains,
+    which used to be a plain set. Adding an item that was already output has no effect.
+    """
+    def __init__(self, mempool: Mempool):
+        self.mempool = mempool
+
+    def __contains__(self, item) -> bool:
+        return item in self.mempool
+
+    def __iter__(self) -> Iterator:
+        return iter(self.mempool)
+
+    def __len__(self):
+        return len(self.mempool)
+
+    def add(self, item) -> None:
+        self.mempool.add(item)
+
+    def discard(self, item) -> None:
+        self.mempool.discard(item)
+
+    def clear(self) -> None:
+        self.mempool.items.clear()  # Entries of removed items in the heap are skipped
+
+    def update(self, items: Iterable) -> None:
+        self.mempool.update(items)
+
+    def difference_update(self, items: Iterable) -> None:
+        for item in items:
+            self.mempool.discard(item)
+
+
+class OutputItems(MutableSet):
+    """
+    The items a mempool marked as output, as a mutable set: the ``outputs`` attribute of the blockchains,
+    which used to be a plain set. With a ``RotatingBloomFilter``, only membership tests and additions work.
+    """
+    def __init__(self, mempool: Mempool):
+        self.mempool = mempool
+
+    def exact(self) -> set:
+        if not isinstance(self.mempool.seen, ExactFilter):
+            raise TypeError("The outputs of a mempool with a {} can't be enumerated".format(
+                type(self.mempool.seen).__name__))
+        return self.mempool.seen.items
+
+    def __contains__(self, item) -> bool:
+        return self.mempool.is_output(item)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.exact())
+
+    def __len__(self):
+        return len(self.exact())
+
+    def add(self, item) -> None:
+        self.mempool.mark_output([item])
+
+    def discard(self, item) -> None:
+        self.exact().discard(item)
+
+    def clear(self) -> None:
+        self.exact().clear()
+
+    def update(self, items: Iterable) -> None:
+        self.mempool.mark_output(items)
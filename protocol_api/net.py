@@ -1,23 +1,179 @@
-from typing import Set, List, Iterable, Union, Callable, Any
+from types import MappingProxyType
+from typing import Set, List, Dict, Tuple, Iterable, Mapping, Union, Callable, Any, Optional
 from enum import Enum
 
+from .schedulers import Scheduler, MaxDelay
+
+
+class RoundEvictedError(RuntimeError):
+    """
+    Raised when reading a round whose messages were already garbage-collected by the network.
+    """
+    pass
+
+
+class NetworkTargets(Enum):
+    ALL = 'all'
+
+
+class MessageView:
+    """
+    A read-only view of the messages a target received in one round of an instance (see ``Network.get_view``).
+    Derived data is computed on first use and cached in the view; the network drops its cached views
+    of a round when messages are written to it.
+    """
+    __slots__ = ('bysrc', 'cached_contents', 'cached_counts')
+
+    def __init__(self, bysrc: Dict[int, List]):
+        self.bysrc = bysrc
+        self.cached_contents: Optional[frozenset] = None
+        self.cached_counts: Optional[Dict] = None
+
+    def __len__(self):
+        return sum(len(msgs) for msgs in self.bysrc.values())
+
+    def senders(self) -> List[int]:
+        return list(self.bysrc)
+
+    def messages(self, src: int) -> Tuple:
+        return tuple(self.bysrc.get(src, ()))
+
+    def contents(self) -> frozenset:
+        """
+        The distinct messages received.
+        """
+        if self.cached_contents is None:
+            contents = set()
+            for msgs in self.bysrc.values():
+                contents.update(msgs)
+            self.cached_contents = frozenset(contents)
+        return self.cached_contents
+
+    def count_senders(self) -> Mapping[Any, int]:
+        """
+        The number of distinct nodes that sent each message value.
+        """
+        if self.cached_counts is None:
+            counts: Dict[Any, int] = {}
+            for msgs in self.bysrc.values():
+                for msg in (msgs if len(msgs) == 1 else set(msgs)):
+                    counts[msg] = counts.get(msg, 0) + 1
+            self.cached_counts = counts
+        return MappingProxyType(self.cached_counts)
+
+    def values_with_senders(self, k: int) -> List:
+        """
+        The message values sent by at least ``k`` distinct nodes (e.g., to check a quorum).
+        """
+        return [msg for (msg, count) in self.count_senders().items() if count >= k]
+
+
 class Network:
+    # True if messages can be read as soon as they are sent; otherwise they are delivered later by ``put``.
+    delivers_on_send = True
+
     # Internal API
-    def __init__(self):
-        self.msgs: List[dict] = [] # list of messages for each round.
+    def __init__(self, horizon: Optional[int] = None, shared_broadcasts: bool = False):
+        """
+        :param horizon: number of past rounds an instance may read, for instances that don't declare their own.
+            Messages older than that are evicted. If None, the rounds of those instances are kept forever
+            (instances that declare a horizon or a lifetime are still garbage-collected).
+        :param shared_broadcasts: if True, a message sent to all nodes is stored once (under ``NetworkTargets.ALL``)
+            instead of once per target, and merged with the point-to-point messages when read.
+            Use it for large n: broadcasts then take O(1) time and memory instead of O(n), which is most of the
+            traffic of the blockchains. A dense n x n store of message offsets was measured slower in pure Python,
+            since every read goes through Python-level index arithmetic.
+        """
+        self.msgs: Dict[int, dict] = {} # messages for each (retained) round, indexed by round.
         self.baserounds: dict = {} # Base round for every instance
+        self.horizon = horizon
+        self.shared_broadcasts = shared_broadcasts
+
+        # (instance, src) pairs that sent point-to-point messages in the current round.
+        self.unicast_senders: Set[Tuple[str, int]] = set()
+
+        # If not None, every (instance, target) that a message is delivered to is added to this set
+        # (target is ``NetworkTargets.ALL`` for shared broadcasts). Used by the event-driven simulation.
+        self.arrivals: Optional[Set[Tuple[str, Any]]] = None
+
+        # Observers are notified of every message with ``on_send(round, instance, src, targets, msg)``
+        # (``targets`` is ``range(n)`` for a message sent to all the nodes)
+        # and, if the network doesn't deliver on send, ``on_deliver(round, instance, src, target, msg)``.
+        self.observers: List[Any] = []
+
+        # Cached ``MessageView``s of the last two rounds: maps (round, instance) to {target: view}
+        self.views: Dict[Tuple[int, str], Dict[Any, MessageView]] = {}
+
+        # Retention bookkeeping (only used when ``horizon`` is set).
+        self.horizons: Dict[str, int] = {} # Horizon declared by each instance
+        self.expiry: Dict[int, List[Tuple[int, str]]] = {} # maps a round to the (round, instance) messages evicted at that round
+        self.deaths: Dict[int, List[str]] = {} # maps a round to the instances that are reclaimed at that round
+
         self.round = -1
         self.setround(0)
 
-    def newinstance(self, instance: str):
+    def newinstance(self, instance: str, horizon: Optional[int] = None, lifetime: Optional[int] = None):
+        """
+        Register a new instance, whose round 0 is the current round.
+        :param instance: channel name
+        :param horizon: how many rounds back the instance reads messages (None: use the network default)
+        :param lifetime: number of rounds the instance is alive; after that all its state is reclaimed
+                         (None: the instance lives forever)
+        """
         if instance not in self.baserounds:
             self.baserounds[instance] = self.round
+            if horizon is not None:
+                self.horizons[instance] = horizon
+            if lifetime is not None:
+                self.deaths.setdefault(self.round + lifetime, []).append(instance)
 
     def setround(self, round: int):
+        for r in range(self.round + 1, round + 1):
+            self.collect(r)
+        if round != self.round:
+            self.unicast_senders = set()
+            if self.views:
+                # Protocols mostly read the previous round, so only the views of the last two rounds are kept
+                self.views = {key: views for (key, views) in self.views.items() if key[0] >= round - 1}
         self.round = round
-        if len(self.msgs) <= round:
-            for r in range(round + 1 - len(self.msgs)):
-                self.msgs.append({}) # In each round, the messages are indexed by instance.
+
+    def collect(self, round: int):
+        """
+        Evict the messages (and dead instances) that can no longer be read from ``round`` on.
+        """
+        for instance in self.deaths.pop(round, []):
+            self.reclaim_instance(instance)
+
+        for (r, instance) in self.expiry.pop(round, []):
+            self.evict(r, instance)
+
+    def evict(self, round: int, instance: str):
+        self.invalidate(round, instance)
+        if round in self.msgs:
+            self.msgs[round].pop(instance, None)
+            if not self.msgs[round]:
+                del self.msgs[round]
+
+    def reclaim_instance(self, instance: str):
+        """
+        Forget everything about a dead instance.
+        """
+        base = self.baserounds.pop(instance)
+        self.horizons.pop(instance, None)
+        for r in range(base, self.round + 1):
+            self.evict(r, instance)
+
+    def get_horizon(self, instance: str) -> Optional[int]:
+        return self.horizons.get(instance, self.horizon)
+
+    def get_round(self, instance: str, instance_round: int) -> int:
+        """
+        Convert a round of ``instance`` (relative to its base) to an absolute round number.
+        """
+        base = self.baserounds.get(instance)
+        if base is None:
+            raise RoundEvictedError("Instance {} was reclaimed (or never used)".format(instance))
+        return instance_round + base
 
     # External API
     def send(self, instance: str, src: int, targets: Iterable[int], msg) -> None:
@@ -28,16 +184,173 @@ class Network:
         :param targets: ids of nodes that will receive the message
         :param msg: the message itself
         """
-        if instance not in self.msgs[self.round]:
-            self.msgs[self.round][instance] = {}
+        if self.observers:
+            if not isinstance(targets, range):  # Ranges (from broadcasts) can be iterated again
+                targets = list(targets)
+            for observer in self.observers:
+                observer.on_send(self.round, instance, src, targets, msg)
+
+        bucket = self.get_bucket(instance)
+        if self.shared_broadcasts:
+            self.unicast_senders.add((instance, src))
 
         for target in targets:
-            if target not in self.msgs[self.round][instance]:
-                self.msgs[self.round][instance][target] = {}
-            if src not in self.msgs[self.round][instance][target]:
-                self.msgs[self.round][instance][target][src] = []
+            if target not in bucket:
+                bucket[target] = {}
+            if src not in bucket[target]:
+                bucket[target][src] = []
+
+            bucket[target][src].append(msg)
+            if self.arrivals is not None:
+                self.arrivals.add((instance, target))
+
+    def send_batch(self, src: int, n: int, outbox: Iterable[Tuple[str, Any, Any]]) -> None:
+        """
+        Send, in order, many messages of a node (see ``NetworkClient.send_batch``).
+        The result is the same as sending them one by one, but buckets are looked up once per instance.
+        :param src: id of node that is sending the messages
+        :param n: number of nodes
+        :param outbox: (instance, target, msg) tuples, where target is a node id, an iterable of node ids,
+            or ``NetworkTargets.ALL`` for all the nodes 0..n-1
+        """
+        if self.observers or self.shared_broadcasts:
+            self.send_outbox(src, n, outbox)
+            return
+
+        arrivals = self.arrivals
+        buckets: Dict[str, dict] = {}
+        for (instance, target, msg) in outbox:
+            bucket = buckets.get(instance)
+            if bucket is None:
+                bucket = buckets[instance] = self.get_bucket(instance)
+            if isinstance(target, int):
+                targets = (target,)
+            elif target is NetworkTargets.ALL:
+                targets = range(n)
+            else:
+                targets = target
+            for target in targets:
+                bysrc = bucket.get(target)
+                if bysrc is None:
+                    bucket[target] = {src: [msg]}
+                elif src in bysrc:
+                    bysrc[src].append(msg)
+                else:
+                    bysrc[src] = [msg]
+                if arrivals is not None:
+                    arrivals.add((instance, target))
+
+    def send_outbox(self, src: int, n: int, outbox: Iterable[Tuple[str, Any, Any]]) -> None:
+        """
+        Send the messages of an outbox one by one, with ``send`` and ``broadcast``.
+        """
+        for (instance, target, msg) in outbox:
+            if isinstance(target, int):
+                self.send(instance, src, (target,), msg)
+            elif target is NetworkTargets.ALL:
+                self.broadcast(instance, src, n, msg)
+            else:
+                self.send(instance, src, target, msg)
+
+    def put(self, instance: str, src: int, target: int, msg) -> None:
+        """
+        Deliver a single message to ``target``: it is stored in the current round.
+        """
+        for observer in self.observers:
+            observer.on_deliver(self.round, instance, src, target, msg)
+
+        bucket = self.get_bucket(instance)
+        if target not in bucket:
+            bucket[target] = {}
+        if src not in bucket[target]:
+            bucket[target][src] = []
+
+        bucket[target][src].append(msg)
+        if self.arrivals is not None:
+            self.arrivals.add((instance, target))
 
-            self.msgs[self.round][instance][target][src].append(msg)
+    def broadcast(self, instance: str, src: int, n: int, msg) -> None:
+        """
+        Send a message on channel ``instance`` to all the nodes 0..n-1.
+        With ``shared_broadcasts`` the message is stored only once.
+        :param instance: channel name
+        :param src: id of node that is sending the message
+        :param n: number of nodes
+        :param msg: the message itself
+        """
+        if not self.shared_broadcasts or (instance, src) in self.unicast_senders:
+            # Once src sent point-to-point messages in this round, its broadcasts are copied to every target,
+            # so that reading (shared messages first, then point-to-point) preserves the order src sent them in.
+            self.send(instance, src, range(n), msg)
+            return
+
+        for observer in self.observers:
+            observer.on_send(self.round, instance, src, range(n), msg)
+
+        bucket = self.get_bucket(instance)
+        if NetworkTargets.ALL not in bucket:
+            bucket[NetworkTargets.ALL] = {}
+        if src not in bucket[NetworkTargets.ALL]:
+            bucket[NetworkTargets.ALL][src] = []
+
+        bucket[NetworkTargets.ALL][src].append(msg)
+        if self.arrivals is not None:
+            self.arrivals.add((instance, NetworkTargets.ALL))
+
+    def get_bucket(self, instance: str, round: Optional[int] = None) -> dict:
+        """
+        Return the messages of ``instance`` in ``round`` (an absolute round number, by default the current round),
+        creating the bucket if needed. A past round must not have been evicted yet (see ``is_evicted``).
+        Buckets are created by ``new_bucket``; here they are dicts mapping target to {src: [msgs]}.
+        It's only used to write messages, so the cached views of the bucket are dropped.
+        """
+        if round is None:
+            round = self.round
+        if self.views:
+            self.invalidate(round, instance)
+        if instance not in self.baserounds:
+            self.baserounds[instance] = 0  # Instances used without ``newinstance`` start at round 0
+        if round not in self.msgs:
+            self.msgs[round] = {}
+        if instance not in self.msgs[round]:
+            self.msgs[round][instance] = self.new_bucket()
+            horizon = self.get_horizon(instance)
+            if horizon is not None:
+                self.expiry.setdefault(round + horizon + 1, []).append((round, instance))
+        return self.msgs[round][instance]
+
+    def is_evicted(self, instance: str, round: int) -> bool:
+        """
+        True if the messages of ``instance`` in ``round`` (an absolute round number) can no longer be read:
+        the instance was reclaimed, or the round is beyond its horizon.
+        """
+        if instance not in self.baserounds:
+            return True
+        horizon = self.get_horizon(instance)
+        return horizon is not None and round + horizon < self.round
+
+    def new_bucket(self):
+        return {}
+
+    def read_bucket(self, instance: str, instance_round: int):
+        """
+        Return the messages of ``instance`` at a given round (relative to the instance base),
+        or None if there are none.
+        """
+        round = self.get_round(instance, instance_round)
+        if round > self.round:
+            raise RuntimeError("We haven't reached round {} yet for instance {}".format(instance_round, instance))
+
+        horizon = self.get_horizon(instance)
+        if horizon is not None and round < self.round - horizon:
+            raise RoundEvictedError("Round {} of instance {} was evicted (horizon is {} rounds)".format(instance_round,
+                                                                                                        instance,
+                                                                                                        horizon))
+
+        if round not in self.msgs:
+            return None
+        else:
+            return self.msgs[round].get(instance)
 
     def get_allmessages(self, instance: str, instance_round: int, target: int) -> dict:
         """
@@ -47,48 +360,245 @@ class Network:
         :param target:
         :return:
         """
-        round = instance_round + self.baserounds.get(instance, 0)
-        if round >= len(self.msgs):
-            raise RuntimeError("We haven't reached round {} yet for instance {}".format(instance_round, instance))
-
-        if instance not in self.msgs[round] or target not in self.msgs[round][instance]:
+        bucket = self.read_bucket(instance, instance_round)
+        if bucket is None:
             return {}
-        else:
-            return self.msgs[round][instance][target]
+        targetmsgs = bucket.get(target, {})
+        shared = bucket.get(NetworkTargets.ALL)
+        if not shared:
+            return targetmsgs
+        if not targetmsgs:
+            return shared
+
+        merged = dict(shared)
+        for src, msgs in targetmsgs.items():
+            merged[src] = merged[src] + msgs if src in merged else msgs
+        return merged
 
     def get_messages(self, instance: str, round: int, target: int, src: int) -> List:
-        targetmsgs = self.get_allmessages(instance, round, target)
-        if src not in targetmsgs:
+        bucket = self.read_bucket(instance, round)
+        if bucket is None:
             return []
-        else:
-            return targetmsgs[src]
+        targetmsgs = bucket.get(target, {}).get(src, [])
+        shared = bucket.get(NetworkTargets.ALL)
+        if not shared or src not in shared:
+            return targetmsgs
+        return shared[src] + targetmsgs if targetmsgs else shared[src]
+
+    def get_view(self, instance: str, instance_round: int, target: int) -> MessageView:
+        """
+        Return a cached read-only view of the messages sent to the target node at a given round
+        (relative to the instance base).
+        """
+        key = (self.get_round(instance, instance_round), instance)
+        views = self.views.get(key)
+        if views is not None and target in views:
+            return views[target]
+        view = MessageView(self.get_allmessages(instance, instance_round, target))
+        if views is None:
+            views = self.views[key] = {}
+        views[target] = view
+        return view
+
+    def invalidate(self, round: int, instance: str) -> None:
+        """
+        Drop the cached views of a round of ``instance`` (an absolute round number), after it was written to.
+        """
+        self.views.pop((round, instance), None)
+
+    def count_senders(self, instance: str, instance_round: int, target: int) -> Mapping[Any, int]:
+        """
+        Count, for every message value received by ``target``, the number of distinct nodes that sent it.
+        """
+        return self.get_view(instance, instance_round, target).count_senders()
+
+# The network of the clients created without one. It's only created when first used, so importing this module
+# is cheap; ``default_net`` (a module attribute computed on access) is kept for existing code.
+_default_net: Optional[Network] = None
+
+
+def get_default_net() -> Network:
+    """
+    Return the network used by clients created without one, creating it if needed.
+    """
+    global _default_net
+    if _default_net is None:
+        _default_net = Network()
+    return _default_net
+
+
+def set_default_net(net: Optional[Network]) -> Optional[Network]:
+    """
+    Replace the default network (None: a fresh one is created on next use).
+    :return: the previous default network, if it was created
+    """
+    global _default_net
+    previous, _default_net = _default_net, net
+    return previous
+
+
+def reset_default_net() -> None:
+    """
+    Drop the default network and all its messages, e.g., in a worker process between two runs.
+    Clients that were created before keep the old network.
+    """
+    set_default_net(None)
+
+
+def __getattr__(name: str):
+    if name == 'default_net':
+        return get_default_net()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+class EmptyIfMissing(dict):
+    """
+    A dict that reads missing keys as empty dicts, without storing them.
+    """
+    __slots__ = ()
+
+    def __missing__(self, key):
+        return EmptyIfMissing()
+
+
+class PendingStore:
+    """
+    Messages that were sent but not delivered yet, indexed by id, by send round, by instance and by target.
+    """
+    def __init__(self):
+        # This dict maps message id to a tuple (src,target,msg,instance,round)
+        self.byid: Dict[int, tuple] = {}
+
+        # This dict maps each round to a subdict; the subdict maps each instance to the messages that were sent
+        # at the round (as a dict mapping msgid to a tuple (src,target,msg)).
+        # Entries are dropped once empty, but reading a round or instance without pending messages
+        # gives an empty dict (as code written for ``pending_msgs``, which kept every round, expects).
+        self.byround: Dict[int, Dict[str, Dict[int, tuple]]] = EmptyIfMissing()
+
+        # These dicts map each instance (resp. target) to the ids of its pending messages, in sending order.
+        self.byinstance: Dict[str, Dict[int, None]] = {}
+        self.bytarget: Dict[int, Dict[int, None]] = {}
+
+        self.lastid = 0
+
+    def __len__(self):
+        return len(self.byid)
+
+    def __contains__(self, id):
+        return id in self.byid
+
+    def add(self, instance: str, src: int, target: int, msg, round: int) -> int:
+        id = self.lastid
+        self.lastid += 1
+
+        self.byid[id] = (src, target, msg, instance, round)
+        if round not in self.byround:
+            self.byround[round] = EmptyIfMissing()
+        if instance not in self.byround[round]:
+            self.byround[round][instance] = {}
+        self.byround[round][instance][id] = (src, target, msg)
+        if instance not in self.byinstance:
+            self.byinstance[instance] = {}
+        self.byinstance[instance][id] = None
+        if target not in self.bytarget:
+            self.bytarget[target] = {}
+        self.bytarget[target][id] = None
+        return id
+
+    def remove(self, id: int) -> tuple:
+        """
+        Remove a pending message from all the indices.
+        :return: the tuple (src,target,msg,instance,round) of the removed message
+        """
+        entry = self.byid.pop(id)
+        (src, target, msg, instance, round) = entry
+
+        roundmsgs = self.byround[round]
+        del roundmsgs[instance][id]
+        if not roundmsgs[instance]:
+            del roundmsgs[instance]
+            if not roundmsgs:
+                del self.byround[round]
+        del self.byinstance[instance][id]
+        if not self.byinstance[instance]:
+            del self.byinstance[instance]
+        del self.bytarget[target][id]
+        if not self.bytarget[target]:
+            del self.bytarget[target]
+        return entry
+
+    def ids_for_round(self, round: int) -> List[int]:
+        ids = []
+        for instmsgs in self.byround.get(round, {}).values():
+            ids.extend(instmsgs)
+        return ids
+
+    def ids_for_instance(self, instance: str) -> List[int]:
+        return list(self.byinstance.get(instance, ()))
+
+    def ids_for_target(self, target: int) -> List[int]:
+        return list(self.bytarget.get(target, ()))
 
-default_net = Network()
 
 class PartiallySynchronousNetwork(Network):
-    def __init__(self, Delta: int):
+    delivers_on_send = False
+
+    def __init__(self, Delta: int, scheduler: Optional[Scheduler] = None):
+        """
+        :param Delta: maximal delay of a message, in rounds
+        :param scheduler: decides when messages are delivered (default: ``MaxDelay``, i.e., after ``Delta`` rounds).
+            See ``schedulers`` for the built-in adversarial strategies.
+        """
         self.Delta = Delta
+        self.scheduler = scheduler if scheduler is not None else MaxDelay()
 
-        # Pending messages. This dict maps each round to a subdict; the subdict has
-        # maps each instance to the messages that were sent at the round
-        # (as a dict mapping msgid to a tuple (src,target,msg), where msgid is a unique message id. ).
-        self.pending_msgs = {}
+        self.pending = PendingStore()
 
-        # This dict maps message id to a tuple (src,target,msg,round,idx)
-        self.pending_msgs_byid = {}
-        self.lastid = 0
+        # Views of the store's indices, kept under their old names:
+        # ``pending_msgs`` maps round -> instance -> {msgid: (src,target,msg)} and
+        # ``pending_msgs_byid`` maps msgid -> (src,target,msg,instance,round).
+        self.pending_msgs = self.pending.byround
+        self.pending_msgs_byid = self.pending.byid
         super().__init__()
 
     def deliver_pending_msg(self, id) -> bool:
-        if id not in self.pending_msgs_byid:
+        if id not in self.pending:
             return False
 
-        (src, target, msg, instance, r) = self.pending_msgs_byid[id]
-        super().send(instance, src, [target], msg)
-        del self.pending_msgs_byid[id]
-        del self.pending_msgs[r][instance][id]
+        (src, target, msg, instance, r) = self.pending.remove(id)
+        self.put(instance, src, target, msg)
         return True
 
+    def deliver_pending_msgs(self, ids: Iterable[int]) -> int:
+        """
+        Deliver a batch of pending messages, in the given order. Ids that aren't pending are ignored.
+        :return: the number of messages delivered
+        """
+        delivered = 0
+        for id in ids:
+            if id in self.pending:
+                (src, target, msg, instance, r) = self.pending.remove(id)
+                self.put(instance, src, target, msg)
+                delivered += 1
+        return delivered
+
+    def deliver_round(self, round: int) -> int:
+        """
+        Deliver all the pending messages that were sent at ``round`` (an absolute round number).
+        """
+        return self.deliver_pending_msgs(self.pending.ids_for_round(round))
+
+    def deliver_instance(self, instance: str) -> int:
+        """
+        Deliver all the pending messages of ``instance``.
+        """
+        return self.deliver_pending_msgs(self.pending.ids_for_instance(instance))
+
+    def deliver_to_target(self, target: int) -> int:
+        """
+        Deliver all the pending messages addressed to ``target``.
+        """
+        return self.deliver_pending_msgs(self.pending.ids_for_target(target))
 
     def force_delta_deliveries(self):
         """
@@ -98,28 +608,44 @@ class PartiallySynchronousNetwork(Network):
         r = self.round - self.Delta + 1
         if r < 0:
             return
-        for instance in self.pending_msgs[r]:
-            msgs = list(self.pending_msgs[r][instance].keys())
-            for id in msgs:
-                self.deliver_pending_msg(id)
+        self.deliver_round(r)
+
+    def reclaim_instance(self, instance: str):
+        # Messages of a dead instance will never be read, so there is no point in delivering them.
+        for id in self.pending.ids_for_instance(instance):
+            self.pending.remove(id)
+        super().reclaim_instance(instance)
 
     def setround(self, round: int):
         for r in range(self.round + 1, round+1):
-            self.force_delta_deliveries()
+            self.scheduler.schedule(self)
             super().setround(r)
 
-        self.pending_msgs[round] = {}
-
     def send(self, instance: str, src: int, targets: Iterable[int], msg) -> None:
-        # Send only adds the messages to the pending_msgs
+        # Send only adds the messages to the pending store
         # Messages must be *delivered* in order to be read.
-        if instance not in self.pending_msgs[self.round]:
-            self.pending_msgs[self.round][instance] = {}
+        if self.observers:
+            if not isinstance(targets, range):  # Ranges (from broadcasts) can be iterated again
+                targets = list(targets)
+            for observer in self.observers:
+                observer.on_send(self.round, instance, src, targets, msg)
 
         for target in targets:
-            self.pending_msgs[self.round][instance][self.lastid] = (src, target, msg)
-            self.pending_msgs_byid[self.lastid] = (src, target, msg, instance, self.round)
-            self.lastid += 1
+            self.pending.add(instance, src, target, msg, self.round)
+
+    def send_batch(self, src: int, n: int, outbox: Iterable[Tuple[str, Any, Any]]) -> None:
+        if self.observers:
+            self.send_outbox(src, n, outbox)
+            return
+
+        add = self.pending.add
+        round = self.round
+        for (instance, target, msg) in outbox:
+            if isinstance(target, int):
+                add(instance, src, target, msg, round)
+            else:
+                for target in (range(n) if target is NetworkTargets.ALL else target):
+                    add(instance, src, target, msg, round)
 
     # Adversarial interface
     def get_pendingmessages(self, instance: str):
@@ -133,34 +659,49 @@ class PartiallySynchronousNetwork(Network):
         """
         if instance not in self.baserounds:
             return []
-        return [(id, r - self.baserounds[instance], src, target, msg) for (id, (src, target, msg, inst, r)) in self.pending_msgs_byid.items() if inst == instance]
-
-
-
-class NetworkTargets(Enum):
-    ALL = 'all'
+        base = self.baserounds[instance]
+        byid = self.pending.byid
+        return [(id, byid[id][4] - base) + byid[id][:3] for id in self.pending.byinstance.get(instance, ())]
 
 
 class NetworkClient:
+    # The ``__dict__`` slot keeps arbitrary attributes working (it's only allocated when one is set).
+    __slots__ = ('id', 'n', 'net', '__dict__')
     ALL = object()
 
-    def __init__(self, id: int, n: int, shared_net: Network = default_net):
+    def __init__(self, id: int, n: int, shared_net: Optional[Network] = None):
+        """
+        :param shared_net: the network of the simulation (default: the default network, see ``get_default_net``)
+        """
         self.id = id
         self.n = n
-        self.net = shared_net
+        self.net = shared_net if shared_net is not None else get_default_net()
 
-    def newinstance(self, instance: str):
-        self.net.newinstance(instance)
+    def newinstance(self, instance: str, horizon: Optional[int] = None, lifetime: Optional[int] = None):
+        self.net.newinstance(instance, horizon, lifetime)
 
     def send(self, instance: str, target: Union[int,Iterable[int],object], msg) -> None:
         if isinstance(target, int):
             targets = [target]
         elif target is NetworkClient.ALL:
-            targets = range(self.n)
+            self.net.broadcast(instance, self.id, self.n, msg)
+            return
         else:
             targets = target
         self.net.send(instance, self.id, targets, msg)
 
+    def send_batch(self, instance: str, sends: Iterable[Tuple[Union[int,Iterable[int],object], Any]]) -> None:
+        """
+        Send many messages at once, in order (the same as sending them one by one with ``send``).
+        :param sends: (target, msg) pairs, where target is as in ``send``
+        """
+        outbox = []
+        for (target, msg) in sends:
+            if target is NetworkClient.ALL:
+                target = NetworkTargets.ALL
+            outbox.append((instance, target, msg))
+        self.net.send_batch(self.id, self.n, outbox)
+
     def get_messages(self, instance: str, round: int, src: int) -> List:
         return self.net.get_messages(instance, round, self.id, src)
 
@@ -177,17 +718,21 @@ class NetworkClient:
     def get_allmessages_contents(self, instance: str, round: int) -> set:
         """
         Return the *contents* of all messages, as a set.
+        The set is a copy, which the caller may modify; use ``get_view`` to avoid copying.
         :param instance:
         :param round:
         :return:
         """
-        msgs: Set[str] = set()
-        for msglist in self.get_allmessages(instance, round).values():
-            msgs.update(msglist)
-        return msgs
+        return set(self.get_view(instance, round).contents())
+
+    def get_view(self, instance: str, round: int) -> MessageView:
+        return self.net.get_view(instance, round, self.id)
 
 
 class IO:
+    # The ``__dict__`` slot keeps arbitrary attributes working (it's only allocated when one is set).
+    __slots__ = ('out', 'inp', '__dict__')
+
     def __init__(self):
         self.out  = []
         self.inp  = {}
@@ -220,6 +765,14 @@ class SingleInputIO(IO):
     """
     A helper IO class that supports a single input in round 0
     """
+    __slots__ = ()
+
     def __init__(self, inp):
         super().__init__()
         self.set_input(0, inp)
+
+    def reset(self, inp) -> None:
+        """
+        Reuse the IO client for a new instance.
+        """
+        self.__init__(inp)
@@ -1,7 +1,33 @@
-from typing import List, Set, Union, Tuple, Type, Iterable, Callable, Any
-from .net import Network, NetworkClient, IO
+import sys
+from functools import lru_cache
+from typing import List, Set, Dict, Union, Tuple, Type, Iterable, Callable, Any, Optional, NamedTuple
+from .net import Network, NetworkClient, NetworkTargets, IO, MessageView, set_default_net
+
+
+class Wakeup(NamedTuple):
+    """
+    The events that wake up a sleeping node (whichever comes first).
+    """
+    round: Optional[int]  # Wake up at this round
+    on_message: bool  # Wake up when a message arrives for the node's instance (or one of its subinstances)
+    on_input: bool  # Wake up when the node gets an input
+
+
+@lru_cache(maxsize=4096)
+def subinstance_name(instance: str, subinstance: str) -> str:
+    """
+    The name of a subinstance of ``instance``. All the nodes starting the same subinstance get the same
+    (interned) string, so it's only built once.
+    """
+    return sys.intern(instance + "-" + subinstance)
+
 
 class Node:
+    # The common attributes are slots; others (including those of subclasses without ``__slots__``) go in the
+    # ``__dict__``, which is only allocated when one is set.
+    __slots__ = ('instance', 'id', 'sk', 'n', 'net', 'io', 'has_terminated', 'next_wakeup', 'event_driven', 'profiler',
+                 '__dict__')
+
     def __init__(self, instance: str, id: int, sk, n: int, net: NetworkClient, io: IO):
         """
             :param instance: a unique identifier for the protocol instance.
@@ -17,16 +43,80 @@ class Node:
         self.net = net
         self.io = io
         self.has_terminated = False
-        self.net.newinstance(instance)
+        self.next_wakeup: Optional[Wakeup] = None
+        self.event_driven = False  # Set while an event-driven simulation runs (see ``set_wakeup``)
+        self.profiler = None  # Set while a profiled simulation runs
+        self.net.newinstance(instance, self.get_horizon(), self.get_maxrounds())
 
-    def start_subprotocol(self, nodetype: Type['Node'], subinstance: str, subio: IO, *args, **kwargs) -> 'Node':
-        subnode = nodetype(self.instance + "-" + subinstance, self.id, self.sk, self.n, self.net, subio, *args, **kwargs)
+    @classmethod
+    def get_maxrounds(cls) -> Optional[int]:
+        """
+        The number of rounds the protocol runs for, or None if it never terminates.
+        The network reclaims the instance once this many rounds have passed.
+        """
+        return None
+
+    @classmethod
+    def get_horizon(cls) -> Optional[int]:
+        """
+        How many rounds back the protocol reads messages (None: use the network's default horizon).
+        Older rounds may be evicted by the network.
+        """
+        return cls.get_maxrounds()
+
+    def start_subprotocol(self, nodetype: Union[Type['Node'], 'NodePool'], subinstance: str, subio: IO,
+                          *args, **kwargs) -> 'Node':
+        """
+        Create a node for a subinstance of this instance.
+        :param nodetype: the class of the subprotocol, or a ``NodePool`` to recycle terminated subprotocol nodes
+        """
+        subnode = nodetype(subinstance_name(self.instance, subinstance), self.id, self.sk, self.n, self.net, subio, *args, **kwargs)
+        subnode.event_driven = self.event_driven
+        subnode.profiler = self.profiler
         return subnode
 
+    def run_subprotocol(self, subnode: 'Node', round: int) -> bool:
+        """
+        Execute a round of a subprotocol, unless it has already terminated.
+        :param subnode: a node created by ``start_subprotocol``
+        :param round: the round number, relative to the subprotocol's start
+        :return: true iff the subprotocol has terminated.
+        """
+        if subnode.has_terminated:
+            return True
+        subnode.next_wakeup = None
+        if self.profiler is None:
+            retval = subnode.protocol(round)
+        else:
+            retval = self.profiler.run_subprotocol(subnode, round)
+        if retval:
+            subnode.has_terminated = True
+        return subnode.has_terminated
+
+    def set_wakeup(self, round: Optional[int] = None, on_message: bool = False, on_input: bool = False):
+        """
+        Declare that the protocol has nothing to do until the given round, until a message arrives
+        for this instance (or a subinstance), or until an input arrives, whichever comes first.
+        The declaration only covers the next wakeup, and is only used by ``simulate_protocol(..., event_driven=True)``,
+        which sets ``self.event_driven`` (otherwise this does nothing, and protocols can skip computing the wakeup);
+        a node that doesn't declare anything is executed every round.
+        A node sleeping without ``on_input`` doesn't get the inputs of the rounds it sleeps through.
+        For a subprotocol, ``round`` is relative to its start: the parent reads ``next_wakeup`` after running it
+        (see ``run_subprotocol``) and may declare a wakeup of its own accordingly.
+        """
+        if self.event_driven:
+            self.next_wakeup = Wakeup(round, on_message, on_input)
+
     ## Network functions
     def send(self, target: Union[int,Iterable[int],object], msg):
         self.net.send(self.instance, target, msg)
 
+    def send_batch(self, sends: Iterable[Tuple[Union[int,Iterable[int],object], Any]]):
+        """
+        Send many (target, msg) pairs at once (e.g., all-to-all messages).
+        """
+        self.net.send_batch(self.instance, sends)
+
     def get_messages(self, round: int, src: int) -> List:
         return self.net.get_messages(self.instance, round, src)
 
@@ -36,6 +126,9 @@ class Node:
     def get_allmessages_contents(self, round: int) -> set:
         return self.net.get_allmessages_contents(self.instance, round)
 
+    def get_view(self, round: int) -> MessageView:
+        return self.net.get_view(self.instance, round)
+
     ## IO functions
     def output(self, msg):
         self.io.output(msg)
@@ -59,22 +152,223 @@ class Node:
 
 
 
+class NodePool:
+    """
+    Recycles the nodes of a subprotocol that terminated, instead of allocating a new node for every instance.
+    Pass the pool instead of the class to ``Node.start_subprotocol``, and ``release`` a node once it terminated
+    and isn't referenced anymore.
+    """
+    def __init__(self, nodetype: Type[Node], maxsize: int = 64):
+        self.nodetype = nodetype
+        self.maxsize = maxsize
+        self.free: List[Node] = []
+
+    def __call__(self, *args, **kwargs) -> Node:
+        if not self.free:
+            return self.nodetype(*args, **kwargs)
+        node = self.free.pop()
+        self.clear(node)
+        node.__init__(*args, **kwargs)
+        return node
+
+    def release(self, node: Node) -> None:
+        if node.has_terminated and type(node) is self.nodetype and len(self.free) < self.maxsize:
+            self.free.append(node)
+
+    @staticmethod
+    def clear(node: Node) -> None:
+        """
+        Remove all the attributes of a node, so nothing leaks from its previous instance.
+        """
+        for cls in type(node).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            for name in ([slots] if isinstance(slots, str) else slots):
+                if name not in ('__dict__', '__weakref__') and hasattr(node, name):
+                    delattr(node, name)
+        if hasattr(node, '__dict__'):
+            node.__dict__.clear()
+
+
 def simulate_protocol(rounds: int, nodes: Iterable[Node], net: Network, get_inputs: Callable[[int,int],Any],
                       round_assertion: Callable[[int,Iterable[Node],Set[int]],None] = None,
-                      node_assertion: Callable[[int,Node,Set[int]],None] = None) -> Set[int]:
-    terminated = set()
-    for r in range(rounds):
-        net.setround(r)
-        for node in nodes:
-            if node.id not in terminated:
-                inputs = get_inputs(node.id, r)
-                node.io.set_input(r, inputs)
-                if node.protocol(r):
+                      node_assertion: Callable[[int,Node,Set[int]],None] = None,
+                      event_driven: bool = False, profiler: 'Profiler' = None,
+                      start_round: int = 0, terminated: Set[int] = None) -> Set[int]:
+    """
+    Run the nodes for ``rounds`` rounds.
+    :param start_round: the first round to execute, and ``terminated`` the ids of the nodes that already terminated,
+        to resume a simulation (e.g., from a ``checkpoint.Checkpoint``).
+    :param event_driven: if True, nodes that declared a wakeup with ``Node.set_wakeup`` are only executed once
+        the wakeup fires (and ``node_assertion`` is only called for the nodes that were executed).
+    :param profiler: if given, an ``instrument.Profiler`` that records per-round statistics
+    :return: the ids of the nodes that terminated
+    """
+    if profiler is not None:
+        nodes = list(nodes)
+        profiler.attach(net, nodes)
+
+    try:
+        if event_driven:
+            return simulate_events(rounds, nodes, net, get_inputs, round_assertion, node_assertion, profiler,
+                                   start_round, terminated)
+
+        terminated = set() if terminated is None else set(terminated)
+        for r in range(start_round, rounds):
+            net.setround(r)
+            if profiler is not None:
+                profiler.start_round(r)
+            for node in nodes:
+                if node.id not in terminated:
+                    inputs = get_inputs(node.id, r)
+                    node.io.set_input(r, inputs)
+                    if node.protocol(r) if profiler is None else profiler.run_node(node, r):
+                        terminated.add(node.id)
+                        node.has_terminated = True
+                    if node_assertion:
+                        node_assertion(r, node, terminated)
+            if profiler is not None:
+                profiler.end_round(net)
+            if round_assertion:
+                round_assertion(r, nodes, terminated)
+
+        return terminated
+    finally:
+        if profiler is not None:
+            profiler.detach(net, nodes)
+
+
+def simulate_events(rounds: int, nodes: Iterable[Node], net: Network, get_inputs: Callable[[int,int],Any],
+                    round_assertion: Callable[[int,Iterable[Node],Set[int]],None] = None,
+                    node_assertion: Callable[[int,Node,Set[int]],None] = None,
+                    profiler: 'Profiler' = None, start_round: int = 0, terminated: Set[int] = None) -> Set[int]:
+    """
+    Event-driven version of ``simulate_protocol``: a node is only executed in rounds where it has work,
+    according to its ``Node.set_wakeup`` declarations. ``get_inputs`` is called for the nodes that run in a round
+    and for those that wait for an input, but not for the other sleeping nodes.
+    """
+    nodes = list(nodes)
+    terminated = set() if terminated is None else set(terminated)
+    for node in nodes:
+        node.event_driven = True
+
+    awake: Set[int] = set(range(len(nodes)))  # Indices of the nodes to execute in the next round
+    sleeping: Dict[int, Wakeup] = {}  # Wakeup declaration of each sleeping node
+    timers: Dict[int, Set[int]] = {}  # Nodes to wake up at each round
+    msg_waiters: Dict[str, Dict[int, int]] = {}  # For each instance, maps node id to the index of a waiting node
+    input_waiters: Set[int] = set()
+
+    def wake(idx: int):
+        wakeup = sleeping.pop(idx, None)
+        if wakeup is not None:
+            awake.add(idx)
+            if wakeup.round is not None:
+                timers.get(wakeup.round, set()).discard(idx)
+            if wakeup.on_message:
+                del msg_waiters[nodes[idx].instance][nodes[idx].id]
+            if wakeup.on_input:
+                input_waiters.discard(idx)
+
+    net.arrivals = set()
+    try:
+        for r in range(start_round, rounds):
+            net.setround(r)
+            if profiler is not None:
+                profiler.start_round(r)
+
+            for idx in timers.pop(r, ()):
+                wake(idx)
+
+            arrivals, net.arrivals = net.arrivals, set()
+            for (instance, target) in arrivals:
+                # Wake up the nodes of the instance and of every enclosing instance.
+                while True:
+                    waiters = msg_waiters.get(instance)
+                    if waiters:
+                        if target is NetworkTargets.ALL:
+                            for idx in list(waiters.values()):
+                                wake(idx)
+                        elif target in waiters:
+                            wake(waiters[target])
+                    sep = instance.rfind("-")
+                    if sep < 0:
+                        break
+                    instance = instance[:sep]
+
+            for idx, node in enumerate(nodes):
+                if node.id not in terminated and (idx in awake or idx in input_waiters):
+                    inputs = get_inputs(node.id, r)
+                    node.io.set_input(r, inputs)
+                    if inputs and idx in input_waiters:
+                        wake(idx)
+
+            running, awake = sorted(awake), set()
+            for idx in running:
+                node = nodes[idx]
+                if node.id in terminated:
+                    continue
+                node.next_wakeup = None
+                if node.protocol(r) if profiler is None else profiler.run_node(node, r):
                     terminated.add(node.id)
                     node.has_terminated = True
+                elif node.next_wakeup is None:
+                    awake.add(idx)
+                else:
+                    wakeup = node.next_wakeup
+                    if wakeup.round is not None:
+                        wakeup = wakeup._replace(round=max(wakeup.round, r + 1))
+                        timers.setdefault(wakeup.round, set()).add(idx)
+                    if wakeup.on_message:
+                        msg_waiters.setdefault(node.instance, {})[node.id] = idx
+                    if wakeup.on_input:
+                        input_waiters.add(idx)
+                    sleeping[idx] = wakeup
                 if node_assertion:
                     node_assertion(r, node, terminated)
-        if round_assertion:
-            round_assertion(r, nodes, terminated)
+            if profiler is not None:
+                profiler.end_round(net)
+            if round_assertion:
+                round_assertion(r, nodes, terminated)
+    finally:
+        net.arrivals = None
+        for node in nodes:
+            node.event_driven = False
+
+    return terminated
+
+
+class SimulationSession:
+    """
+    A simulation with its own network. While the session is open, its network is also the default network,
+    so clients created without one (``NetworkClient(id, n)``) don't share messages with other runs;
+    the previous default network is restored when the session is closed::
+
+        with SimulationSession(n=n) as session:
+            nodes = [TotallyNaiveBlockchain('test1', i, None, n, session.client(i), IO()) for i in range(n)]
+            session.simulate(rounds, nodes, get_inputs)
+    """
+    def __init__(self, net: Optional[Network] = None, n: Optional[int] = None):
+        """
+        :param net: the network of the session (default: a new ``Network``)
+        :param n: default number of nodes for ``client``
+        """
+        self.net = net if net is not None else Network()
+        self.n = n
+        self.previous: Optional[Network] = None
+
+    def __enter__(self) -> 'SimulationSession':
+        self.previous = set_default_net(self.net)
+        return self
+
+    def __exit__(self, *exc):
+        set_default_net(self.previous)
+        self.previous = None
 
-    return terminated
\ No newline at end of file
+    def client(self, id: int, n: Optional[int] = None) -> NetworkClient:
+        return NetworkClient(id, n if n is not None else self.n, self.net)
+
+    def simulate(self, rounds: int, nodes: Iterable[Node], get_inputs: Callable[[int,int],Any], *args,
+                 **kwargs) -> Set[int]:
+        """
+        Run ``simulate_protocol`` on the session's network (with the same other arguments).
+        """
+        return simulate_protocol(rounds, nodes, self.net, get_inputs, *args, **kwargs)
@@ -0,0 +1,98 @@
+from typing import Set, Dict, Tuple, Iterable, Callable, Any, Optional
+
+from .net import Network
+from .transcript import TranscriptWriter, Transcript, SEND, DELIVER, INPUT, START
+
+
+class Recorder:
+    """
+    Records a run to a transcript, so that it can be replayed later with ``ReplayNetwork``:
+    every input, and every message as it was delivered (including the adversarial delivery order
+    of a ``PartiallySynchronousNetwork``).
+    Create it before the simulation starts, and pass ``recorder.get_inputs`` to ``simulate_protocol``.
+    """
+    def __init__(self, path: str, net: Network, get_inputs: Callable[[int, int], Any]):
+        self.net = net
+        self.inputs = get_inputs
+        self.writer = TranscriptWriter(path)
+        self.writer.write(START, net.round, '', 0, 0, net.delivers_on_send)
+        self.writer.attach(net)
+
+    def get_inputs(self, id: int, round: int):
+        inputs = self.inputs(id, round)
+        if inputs is not None:
+            self.writer.write(INPUT, round, '', id, id, inputs)
+        return inputs
+
+    def close(self) -> None:
+        self.writer.detach(self.net)
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordedInputs:
+    """
+    A ``get_inputs`` function that returns the inputs of a recorded run.
+    """
+    def __init__(self, transcript: Transcript):
+        self.transcript = transcript
+        self.round: Optional[int] = None
+        self.inputs: Dict[int, Any] = {}  # Inputs of every node in ``round``
+
+    def __call__(self, id: int, round: int):
+        if round != self.round:
+            self.round = round
+            self.inputs = {record.src: record.msg for record in self.transcript.records(round=round, kind=INPUT)}
+        return self.inputs.get(id)
+
+
+class ReplayNetwork(Network):
+    """
+    Replays the messages of a recorded run to a subset of the nodes, so only those nodes need to be executed:
+    the other nodes (in particular, the corrupted ones) are not run at all.
+    The messages sent by the replayed nodes are dropped, since the recording already has them.
+
+    The messages of a round are injected when the round ends (before nodes read them in the next round),
+    so the replayed nodes must not read the messages of the current round.
+    """
+    def __init__(self, transcript: Transcript, replayed: Iterable[int], horizon: Optional[int] = None):
+        """
+        :param transcript: a transcript written by ``Recorder``
+        :param replayed: the ids of the nodes that will be executed
+        :param horizon: see ``Network``
+        """
+        self.transcript = transcript
+        self.replayed: Set[int] = set(replayed)
+
+        start = next(transcript.records(kind=START), None)
+        if start is None:
+            raise ValueError("The transcript was not written by a Recorder")
+        # On a network that delivers on send, a message is received when it's sent; otherwise when it's delivered.
+        self.kind = SEND if start.msg else DELIVER
+        super().__init__(horizon)
+
+    def setround(self, round: int):
+        for r in range(self.round, round):
+            if r >= 0:
+                self.inject(r)
+            super().setround(r + 1)
+
+    def inject(self, round: int):
+        for record in self.transcript.records(round=round, kind=self.kind):
+            for target in record.targets():
+                if target in self.replayed:
+                    self.put(record.instance, record.src, target, record.msg)
+
+    def send(self, instance: str, src: int, targets: Iterable[int], msg) -> None:
+        pass
+
+    def broadcast(self, instance: str, src: int, n: int, msg) -> None:
+        pass
+
+    def send_batch(self, src: int, n: int, outbox: Iterable[Tuple[str, Any, Any]]) -> None:
+        pass
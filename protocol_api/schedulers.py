@@ -0,0 +1,93 @@
+import random
+from abc import ABC, abstractmethod
+from typing import List, Set, Dict, Iterable, Optional
+
+
+class Scheduler(ABC):
+    """
+    Decides when the pending messages of a ``PartiallySynchronousNetwork`` are delivered.
+    ``schedule`` is called at the end of every round (``net.round`` is the round that ended);
+    messages delivered then can be read from the next round on.
+    Schedulers work on whole rounds of the pending store, so they only touch the messages they deliver.
+    """
+    @abstractmethod
+    def schedule(self, net: 'PartiallySynchronousNetwork') -> None:
+        pass
+
+
+class MaxDelay(Scheduler):
+    """
+    Deliver every message as late as possible: ``Delta`` rounds after it was sent (the default).
+    """
+    def schedule(self, net: 'PartiallySynchronousNetwork') -> None:
+        net.force_delta_deliveries()
+
+
+class Partition(Scheduler):
+    """
+    Cut the messages between ``nodes`` and the other nodes until the end of round ``until``
+    (so the network is only partially synchronous from then on); other messages are delivered after ``Delta`` rounds.
+    """
+    def __init__(self, nodes: Iterable[int], until: int):
+        self.nodes: Set[int] = set(nodes)
+        self.until = until
+        self.held: List[int] = []  # Send rounds that have held messages
+
+    def schedule(self, net: 'PartiallySynchronousNetwork') -> None:
+        due = net.round - net.Delta + 1
+        if net.round >= self.until:
+            for round in self.held:
+                net.deliver_round(round)
+            self.held = []
+            net.force_delta_deliveries()
+            return
+        if due < 0:
+            return
+
+        byid = net.pending.byid
+        ids = net.pending.ids_for_round(due)
+        crossing = [(byid[id][0] in self.nodes) != (byid[id][1] in self.nodes) for id in ids]
+        if any(crossing):
+            self.held.append(due)
+        net.deliver_pending_msgs([id for (id, cross) in zip(ids, crossing) if not cross])
+
+
+class RandomDelay(Scheduler):
+    """
+    Delay every message by a random number of rounds between 1 (the next round) and ``max_delay``.
+    """
+    def __init__(self, seed: Optional[int] = None, max_delay: Optional[int] = None):
+        """
+        :param max_delay: the maximal delay (default, and at most: ``Delta``)
+        """
+        self.random = random.Random(seed)
+        self.max_delay = max_delay
+        self.due: Dict[int, List[int]] = {}  # Ids of the messages to deliver at the end of each round
+
+    def schedule(self, net: 'PartiallySynchronousNetwork') -> None:
+        r = net.round
+        max_delay = net.Delta if self.max_delay is None else min(self.max_delay, net.Delta)
+        for id in net.pending.ids_for_round(r):
+            self.due.setdefault(r + self.random.randint(1, max_delay) - 1, []).append(id)
+        net.deliver_pending_msgs(self.due.pop(r, ()))
+        net.force_delta_deliveries()
+
+
+class ReorderWindow(Scheduler):
+    """
+    Deliver the messages in batches of ``window`` rounds, each batch in a random order
+    (so messages from the same sender can overtake each other). ``window`` should be at most ``Delta``.
+    """
+    def __init__(self, window: int, seed: Optional[int] = None):
+        self.window = window
+        self.random = random.Random(seed)
+
+    def schedule(self, net: 'PartiallySynchronousNetwork') -> None:
+        r = net.round
+        if (r + 1) % self.window == 0:
+            ids = []
+            for round in range(r - self.window + 1, r + 1):
+                ids.extend(net.pending.ids_for_round(round))
+            self.random.shuffle(ids)
+            net.deliver_pending_msgs(ids)
+        net.force_delta_deliveries()
@@ -0,0 +1,183 @@
+import heapq
+import multiprocessing
+import pickle
+import traceback
+from operator import itemgetter
+from typing import List, Set, Dict, Tuple, Iterable, Callable, Union, Any, Optional
+
+from .net import Network
+from .protocol import Node, simulate_protocol
+
+
+class ShardNetwork(Network):
+    """
+    The part of a ``Network`` owned by one shard of a sharded simulation: it only stores the messages
+    sent to the shard's own nodes. Nodes are split into ``shards`` contiguous ranges of ids.
+
+    Messages sent during a round are kept in per-shard outboxes and only stored once all the shards exchanged
+    their outboxes at the end of the round, in shard order (which is the order the nodes run in sequentially).
+    So, as with all protocols here, nodes must not read the messages of the current round.
+    Broadcasts to all the nodes are kept in a single list, which is pickled once for all the other shards.
+    """
+    def __init__(self, n: int, shards: int, index: int, horizon: Optional[int] = None):
+        self.n = n
+        self.shards = shards
+        self.index = index
+        self.ids = [id for id in range(n) if self.shard_of(id) == index]
+
+        # Messages for every shard: (seq, instance, src, targets, msg), where seq is the position in the round
+        self.outbox: List[List[tuple]] = [[] for _ in range(shards)]
+        # Messages for all the nodes: (seq, instance, src, msg)
+        self.broadcasts: List[tuple] = []
+        self.seq = 0
+        # Instances created in this round: (instance, horizon, lifetime)
+        self.new_instances: List[tuple] = []
+        super().__init__(horizon)
+
+    def shard_of(self, id: int) -> int:
+        return id * self.shards // self.n
+
+    def newinstance(self, instance: str, horizon: Optional[int] = None, lifetime: Optional[int] = None):
+        # Other shards need it too: the base round of an instance is the round in which any node created it.
+        if instance not in self.baserounds:
+            self.new_instances.append((instance, horizon, lifetime))
+        super().newinstance(instance, horizon, lifetime)
+
+    def send(self, instance: str, src: int, targets: Iterable[int], msg) -> None:
+        if self.observers:
+            if not isinstance(targets, range):
+                targets = list(targets)
+            for observer in self.observers:
+                observer.on_send(self.round, instance, src, targets, msg)
+
+        byshard: Dict[int, List[int]] = {}
+        for target in targets:
+            byshard.setdefault(self.shard_of(target), []).append(target)
+        for shard, shard_targets in byshard.items():
+            self.outbox[shard].append((self.seq, instance, src, shard_targets, msg))
+        self.seq += 1
+
+    def broadcast(self, instance: str, src: int, n: int, msg) -> None:
+        if n != self.n:
+            self.send(instance, src, range(n), msg)
+            return
+        for observer in self.observers:
+            observer.on_send(self.round, instance, src, range(n), msg)
+        self.broadcasts.append((self.seq, instance, src, msg))
+        self.seq += 1
+
+    def send_batch(self, src: int, n: int, outbox: Iterable[Tuple[str, Any, Any]]) -> None:
+        self.send_outbox(src, n, outbox)
+
+    def take_batches(self) -> List[tuple]:
+        """
+        Return the (new instances, messages, broadcasts) batch of every shard for the current round,
+        and empty the outboxes. The broadcasts are pickled once, and shared by the batches of the other shards.
+        """
+        shared = pickle.dumps(self.broadcasts, pickle.HIGHEST_PROTOCOL) if self.shards > 1 else None
+        batches = [(self.new_instances, batch, self.broadcasts if shard == self.index else shared)
+                   for (shard, batch) in enumerate(self.outbox)]
+        self.outbox = [[] for _ in range(self.shards)]
+        self.broadcasts = []
+        self.seq = 0
+        self.new_instances = []
+        return batches
+
+    def apply_batch(self, instances: List[tuple], msgs: List[tuple], broadcasts: Union[bytes, List[tuple]]) -> None:
+        """
+        Store a batch that another shard (or this one) sent to this shard in the current round.
+        Messages and broadcasts are stored in the order they were sent.
+        """
+        for (instance, horizon, lifetime) in instances:
+            Network.newinstance(self, instance, horizon, lifetime)
+        if isinstance(broadcasts, bytes):
+            broadcasts = pickle.loads(broadcasts)
+        merged = heapq.merge(msgs, ((seq, instance, src, None, msg) for (seq, instance, src, msg) in broadcasts),
+                             key=itemgetter(0))
+        for (seq, instance, src, targets, msg) in merged:
+            bucket = self.get_bucket(instance)
+            for target in (self.ids if targets is None else targets):
+                if target not in bucket:
+                    bucket[target] = {}
+                if src not in bucket[target]:
+                    bucket[target][src] = []
+                bucket[target][src].append(msg)
+
+
+def run_shard(index: int, n: int, shards: int, rounds: int, node_factory: Callable[[int, int, Network], Node],
+              get_inputs: Callable[[int, int], Any], horizon: Optional[int], inboxes: List, results) -> None:
+    try:
+        net = ShardNetwork(n, shards, index, horizon)
+        nodes = [node_factory(id, n, net) for id in net.ids]
+        early: Dict[int, List[tuple]] = {}  # Batches of later rounds, from shards that are already ahead
+
+        def exchange(r: int, nodes: Iterable[Node], terminated: Set[int]):
+            batches = net.take_batches()
+            for shard, batch in enumerate(batches):
+                if shard != index:
+                    inboxes[shard].put((r, index, batch))
+
+            received = {index: batches[index]}
+            for (round, shard, batch) in early.pop(r, []):
+                received[shard] = batch
+            while len(received) < shards:
+                item = inboxes[index].get()
+                if item is None:
+                    raise RuntimeError("Another shard failed")
+                (round, shard, batch) = item
+                if round == r:
+                    received[shard] = batch
+                else:
+                    early.setdefault(round, []).append(item)
+
+            for shard in range(shards):
+                net.apply_batch(*received[shard])
+
+        terminated = simulate_protocol(rounds, nodes, net, get_inputs, exchange)
+        results.put((index, terminated, {node.id: node.io.get_outputs() for node in nodes}))
+    except Exception:
+        results.put((index, None, traceback.format_exc()))
+        for (shard, inbox) in enumerate(inboxes):
+            if shard != index:
+                inbox.put(None)
+
+
+def simulate_sharded(rounds: int, n: int, node_factory: Callable[[int, int, Network], Node],
+                     get_inputs: Callable[[int, int], Any], shards: Optional[int] = None,
+                     horizon: Optional[int] = None) -> Tuple[Set[int], List[List]]:
+    """
+    Run a simulation of a synchronous ``Network`` with the nodes split across worker processes.
+    The results are the same as those of ``simulate_protocol`` with the nodes in id order.
+    :param node_factory: creates node ``id`` of ``n``, given the network of its shard.
+        It must be picklable (e.g., a function defined at module level), as must ``get_inputs``.
+    :param shards: number of worker processes (default: number of cores)
+    :param horizon: see ``Network``
+    :return: the ids of the nodes that terminated, and the outputs of every node
+    """
+    shards = min(n, shards or multiprocessing.cpu_count())
+    inboxes = [multiprocessing.Queue() for _ in range(shards)]
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_shard, args=(index, n, shards, rounds, node_factory, get_inputs,
+                                                               horizon, inboxes, results))
+               for index in range(shards)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        terminated: Set[int] = set()
+        outputs: Dict[int, List] = {}
+        for _ in range(shards):
+            (index, shard_terminated, shard_outputs) = results.get()
+            if shard_terminated is None:
+                raise RuntimeError("Shard {} failed:\n{}".format(index, shard_outputs))
+            terminated.update(shard_terminated)
+            outputs.update(shard_outputs)
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+
+    return terminated, [outputs[id] for id in range(n)]
@@ -0,0 +1,111 @@
+from collections import deque
+from typing import List, Dict, Tuple, Iterable, Iterator, Callable, Any, Optional
+
+from .net import IO
+
+
+class StreamingIO(IO):
+    """
+    An IO client that doesn't keep the whole history: only the inputs of the last ``input_window`` rounds
+    are kept, and outputs go to a bounded ring buffer and/or a callback.
+    """
+    __slots__ = ('round', 'input_window', 'on_input', 'on_output', 'count')
+
+    def __init__(self, maxlen: Optional[int] = 1000, on_output: Callable[[int, Any], None] = None,
+                 on_input: Callable[[int, Any], None] = None, input_window: int = 1):
+        """
+        :param maxlen: number of most recent outputs kept in ``out`` (0: none, None: all of them)
+        :param on_output: called with (round, output) for every output
+        :param on_input: called with (round, inputs) for every input given to the node
+        :param input_window: number of rounds whose inputs can still be read with ``get_input``
+        """
+        super().__init__()
+        self.out = deque(maxlen=maxlen)
+        self.round = -1  # Round of the last input that was set
+        self.input_window = input_window
+        self.on_input = on_input
+        self.on_output = on_output
+        self.count = 0  # Total number of outputs
+
+    def output(self, msg):
+        self.out.append(msg)
+        self.count += 1
+        if self.on_output is not None:
+            self.on_output(self.round, msg)
+
+    def set_input(self, round: int, inp) -> None:
+        self.round = round
+        for old in [r for r in self.inp if r <= round - self.input_window]:
+            del self.inp[old]
+        if inp is not None:
+            self.inp[round] = inp
+            if self.on_input is not None:
+                self.on_input(round, inp)
+
+    def get_outputs(self) -> List:
+        """
+        The most recent outputs (at most ``maxlen``).
+        """
+        return list(self.out)
+
+    def read_outputs(self) -> List:
+        outputs = list(self.out)
+        self.out.clear()
+        return outputs
+
+
+class StreamInputs:
+    """
+    A ``get_inputs`` function that reads inputs from a stream of (round, node id, inputs) tuples,
+    sorted by round. Only the inputs of the current round are held in memory.
+    """
+    def __init__(self, source: Iterable[Tuple[int, int, Any]]):
+        self.source = iter(source)
+        self.round = -1
+        self.inputs: Dict[int, Any] = {}  # Inputs of every node in ``round``
+        self.next: Optional[Tuple[int, int, Any]] = next(self.source, None)  # First item of a later round
+
+    def __call__(self, id: int, round: int):
+        if round != self.round:
+            self.round = round
+            self.inputs = {}
+            # Skip the inputs of rounds that were never asked for
+            while self.next is not None and self.next[0] < round:
+                self.next = next(self.source, None)
+            while self.next is not None and self.next[0] == round:
+                (r, node_id, inputs) = self.next
+                self.inputs[node_id] = inputs
+                self.next = next(self.source, None)
+        return self.inputs.get(id)
+
+
+def rate_limited(items: Iterable, n: int, rate: int, start_round: int = 0) -> Iterator[Tuple[int, int, List]]:
+    """
+    Turn a stream of transactions into a stream of (round, node id, inputs) for ``StreamInputs``:
+    ``rate`` transactions per round, given to the nodes round-robin.
+    """
+    round = start_round
+    inputs: Dict[int, List] = {}
+    count = 0
+    for item in items:
+        inputs.setdefault(count % n, []).append(item)
+        count += 1
+        if count == rate:
+            for id in sorted(inputs):
+                yield (round, id, inputs[id])
+            round += 1
+            inputs = {}
+            count = 0
+    for id in sorted(inputs):
+        yield (round, id, inputs[id])
+
+
+def file_transactions(path: str) -> Iterator[str]:
+    """
+    Read transactions from a file, one per line (empty lines are skipped), without loading the whole file.
+    """
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                yield line
@@ -0,0 +1,95 @@
+import itertools
+import multiprocessing
+import random
+from typing import List, Set, Tuple, Type, Iterable, Callable, Any, Optional, NamedTuple
+
+from .net import Network, PartiallySynchronousNetwork, NetworkClient, IO
+from .protocol import Node, SimulationSession
+from .checks import ConsistencyChecker, LivenessChecker
+
+
+class Scenario(NamedTuple):
+    """
+    A single simulation run.
+    Everything in a scenario must be picklable (classes and ``get_inputs`` must be defined at module level),
+    since it is sent to a worker process.
+    """
+    honest_class: Type[Node]
+    n: int
+    rounds: int
+    get_inputs: Callable[[int, int], Any]
+    corrupted_class: Optional[Type[Node]] = None
+    corrupted_id: Optional[int] = None
+    seed: Optional[int] = None
+    T: Optional[int] = None  # Liveness parameter (None: don't check liveness)
+    Delta: Optional[int] = None  # If set, run on a PartiallySynchronousNetwork with this Delta
+
+
+class ScenarioResult(NamedTuple):
+    scenario: Scenario
+    terminated: Set[int]
+    outputs: List[List]  # outputs[i] is the output list of node i
+    consistency: Tuple[bool, str]  # First consistency violation, or the last successful check
+    liveness: Tuple[bool, str]  # First liveness violation, or the last successful check
+
+
+def scenario_grid(**axes) -> List[Scenario]:
+    """
+    Build the cartesian product of scenario parameters.
+    Each keyword is a ``Scenario`` field; its value is either a list of values to sweep over or a single value.
+    For example ``scenario_grid(honest_class=InvalidBroadcastBlockchain, n=[3, 5], rounds=40, ...)``.
+    """
+    names = list(axes.keys())
+    values = [v if isinstance(v, (list, tuple, range)) else [v] for v in axes.values()]
+    return [Scenario(**dict(zip(names, combination))) for combination in itertools.product(*values)]
+
+
+def run_scenario(scenario: Scenario) -> ScenarioResult:
+    """
+    Run a single scenario on a fresh network.
+    """
+    if scenario.seed is not None:
+        random.seed(scenario.seed)
+
+    net = Network() if scenario.Delta is None else PartiallySynchronousNetwork(scenario.Delta)
+    n = scenario.n
+    nodes: List[Node] = [scenario.honest_class('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+    if scenario.corrupted_class is not None:
+        nodes[scenario.corrupted_id] = scenario.corrupted_class('test1', scenario.corrupted_id, None, n,
+                                                                NetworkClient(scenario.corrupted_id, n, net), IO())
+    honest_nodes = [node for node in nodes if node.id != scenario.corrupted_id]
+
+    consistency = ConsistencyChecker()
+    liveness = LivenessChecker(scenario.T) if scenario.T is not None else None
+    verdicts = {'consistency': (True, "Consistent at round -1"),
+                'liveness': (True, "Liveness not checked")}
+
+    def check_round(r: int, nodes: Iterable[Node], terminated: Set[int]):
+        # Keep the first violation of each property.
+        if verdicts['consistency'][0]:
+            consistency.update(r, honest_nodes)
+            verdicts['consistency'] = consistency.check(r)
+        if liveness is not None and verdicts['liveness'][0]:
+            liveness.update(r, honest_nodes)
+            verdicts['liveness'] = liveness.check(r)
+
+    with SimulationSession(net) as session:
+        terminated = session.simulate(scenario.rounds, nodes, scenario.get_inputs, check_round)
+
+    return ScenarioResult(scenario, terminated, [node.io.get_outputs() for node in nodes],
+                          verdicts['consistency'], verdicts['liveness'])
+
+
+def run_scenarios(scenarios: Iterable[Scenario], processes: Optional[int] = None) -> List[ScenarioResult]:
+    """
+    Run scenarios in parallel, each in a worker process with its own network.
+    :param scenarios:
+    :param processes: number of worker processes (default: number of cores). With 1, runs in the current process.
+    :return: the results, in the same order as ``scenarios``
+    """
+    scenarios = list(scenarios)
+    if processes == 1:
+        return [run_scenario(scenario) for scenario in scenarios]
+
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(run_scenario, scenarios, chunksize=1)
@@ -0,0 +1,462 @@
+import heapq
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from typing import List, Dict, Tuple, Iterable, Iterator, Any, Optional, NamedTuple
+
+from .net import Network
+
+# A transcript is a sequence of records, each a fixed-size header followed by ``length`` bytes of data:
+#   kind (uint8), round (int64), instance (uint32 index in the string table), src (int32), target (int32),
+#   tag (uint8), length (uint32)
+# Instance names are written once, in an INSTANCE record (whose data is the name) before their first use.
+# A message sent to all the nodes 0..n-1 is a single record with target -n.
+HEADER = struct.Struct('<BqIiiBI')
+
+# The index of a transcript is written next to it, to ``path + INDEX_SUFFIX``: a header, followed by
+#   the offsets of the INSTANCE records, in string table order (uint64 each)
+#   the round runs: (round, start, end, count) of every maximal sequence of message records of the same round,
+#   in file order (int64, uint64, uint64, uint64); ``start`` and ``end`` delimit the records of the run
+#   the instance entries: (instance index, offset) of every message record, sorted (int64, int64)
+#   the node entries: (node, offset) for the src and the target (if different) of every message record, or
+#   (-1, offset) for a message sent to all the nodes, sorted (int64, int64)
+# The header has the size of the transcript the index was built from (an index that doesn't match the
+# transcript's size, e.g., if the writer was interrupted, is rebuilt), the end of its last complete record,
+# the number of message records, of instances, of runs and of node entries, and whether runs are sorted by round.
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'PTIX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<4sIQQQQQQI4x')
+RUN = struct.Struct('<qQQQ')
+ENTRY = struct.Struct('<qq')
+BROADCAST = -1  # Node of the node entries of messages sent to all the nodes
+
+SEND = 0
+DELIVER = 1
+INSTANCE = 2
+INPUT = 3  # Written by ``replay.Recorder``: src is the node id, and the message is its input
+START = 4  # Written by ``replay.Recorder``: the message is the ``delivers_on_send`` flag of the recorded network
+
+# How a message is encoded in the data of a record
+BYTES = 0
+STR = 1
+PICKLE = 2
+
+
+class Record(NamedTuple):
+    kind: int
+    round: int  # Absolute round number
+    instance: str
+    src: int
+    target: int  # Negative for a message sent to all of the nodes 0..-target-1
+    msg: Any
+
+    def targets(self) -> Iterable[int]:
+        return range(-self.target) if self.target < 0 else (self.target,)
+
+
+def encode_msg(msg) -> Tuple[int, bytes]:
+    if isinstance(msg, str):
+        return (STR, msg.encode('utf-8'))
+    elif isinstance(msg, bytes):
+        return (BYTES, msg)
+    return (PICKLE, pickle.dumps(msg, pickle.HIGHEST_PROTOCOL))
+
+
+def decode_msg(tag: int, data) -> Any:
+    if tag == STR:
+        return str(data, 'utf-8')
+    elif tag == BYTES:
+        return bytes(data)
+    return pickle.loads(data)
+
+
+def write_array(f, a: array) -> None:
+    if sys.byteorder == 'big':
+        a = array(a.typecode, a)
+        a.byteswap()
+    a.tofile(f)
+
+
+def read_entries(f) -> Iterator[Tuple[int, int]]:
+    while True:
+        chunk = f.read(ENTRY.size << 12)
+        if not chunk:
+            return
+        yield from ENTRY.iter_unpack(chunk)
+
+
+class EntrySorter:
+    """
+    Sorts (key, offset) entries, added in increasing offset order, with bounded memory: the offsets are grouped
+    by key in ``groups``, ``spill`` writes the buffered entries sorted to a temporary file, and the sorted runs
+    are merged at the end.
+    """
+    def __init__(self):
+        self.groups: Dict[int, array] = {}  # Offsets of the buffered entries, by key
+        self.runs: List[Any] = []  # Temporary files with sorted entries
+        self.count = 0  # Number of entries spilled
+
+    def buffered(self) -> int:
+        return sum(len(offsets) for offsets in self.groups.values())
+
+    def __len__(self):
+        return self.count + self.buffered()
+
+    def write_buffered(self, f) -> None:
+        for key in sorted(self.groups):
+            offsets = self.groups[key]
+            entries = array('q', bytes(16 * len(offsets)))
+            entries[0::2] = array('q', [key]) * len(offsets)
+            entries[1::2] = offsets
+            write_array(f, entries)
+
+    def spill(self) -> None:
+        run = tempfile.TemporaryFile()
+        self.write_buffered(run)
+        run.seek(0)
+        self.runs.append(run)
+        self.count += self.buffered()
+        self.groups.clear()
+
+    def write(self, f) -> None:
+        if not self.runs:
+            self.write_buffered(f)
+            return
+        if self.groups:
+            self.spill()
+        buf = array('q')
+        for entry in heapq.merge(*[read_entries(run) for run in self.runs]):
+            buf.extend(entry)
+            if len(buf) >= 1 << 16:
+                write_array(f, buf)
+                del buf[:]
+        write_array(f, buf)
+        for run in self.runs:
+            run.close()
+        self.runs = []
+
+
+class IndexBuilder:
+    """
+    Builds the index of a transcript (see ``INDEX_HEADER``) from its records, in memory that doesn't depend
+    on the transcript's length (besides 8 bytes per instance): at most ``chunk`` node entries, and as many
+    instance entries, are kept in memory (see ``EntrySorter``).
+    """
+    def __init__(self, chunk: int = 1 << 20):
+        self.instances = array('Q')  # Offset of every INSTANCE record
+        self.runs = tempfile.TemporaryFile()
+        self.nruns = 0
+        self.run: Optional[List[int]] = None  # The current run: [round, start, end, count]
+        self.runs_sorted = True
+        self.byinstance = EntrySorter()
+        self.bynode = EntrySorter()
+        self.chunk = chunk  # Number of node entries kept in memory before all the entries are spilled
+        self.buffered = 0  # Number of node entries in memory
+        self.count = 0  # Number of message records
+        self.end = 0  # End of the last record
+
+    def add(self, pos: int, kind: int, round: int, index: int, src: int, target: int, length: int) -> None:
+        """
+        Index the record at offset ``pos``.
+        """
+        self.end = pos + HEADER.size + length
+        if kind == INSTANCE:
+            self.instances.append(pos)
+            return
+        self.count += 1
+        run = self.run
+        if run is not None and run[0] == round:
+            run[2] = self.end
+            run[3] += 1
+        else:
+            if run is not None:
+                self.runs_sorted = self.runs_sorted and run[0] < round
+                self.flush_run()
+            self.run = [round, pos, self.end, 1]
+        groups = self.byinstance.groups
+        offsets = groups.get(index)
+        if offsets is None:
+            offsets = groups[index] = array('q')
+        offsets.append(pos)
+        groups = self.bynode.groups
+        for node in ((BROADCAST,) if target < 0 else (src,) if target == src else (src, target)):
+            offsets = groups.get(node)
+            if offsets is None:
+                offsets = groups[node] = array('q')
+            offsets.append(pos)
+            self.buffered += 1
+        if self.buffered >= self.chunk:  # There are at least as many node entries as instance entries
+            self.byinstance.spill()
+            self.bynode.spill()
+            self.buffered = 0
+
+    def flush_run(self) -> None:
+        if self.run is not None:
+            self.runs.write(RUN.pack(*self.run))
+            self.nruns += 1
+            self.run = None
+
+    def write(self, f, size: int) -> None:
+        """
+        Write the index of a transcript of ``size`` bytes to the file ``f``.
+        """
+        self.flush_run()
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, size, self.end, self.count, len(self.instances),
+                                  self.nruns, len(self.bynode), self.runs_sorted))
+        write_array(f, self.instances)
+        self.runs.seek(0)
+        shutil.copyfileobj(self.runs, f)
+        self.runs.close()
+        self.byinstance.write(f)
+        self.bynode.write(f)
+
+
+class TranscriptWriter:
+    """
+    A network observer that streams every message sent (and, on a ``PartiallySynchronousNetwork``,
+    every delivery) to an append-only binary log, instead of keeping it in memory.
+    Its index is written to ``path + INDEX_SUFFIX`` when the writer is closed.
+    Use it as a context manager, or ``attach`` it to a network and ``close`` it when done.
+    """
+    def __init__(self, path: str, buffering: int = 1 << 20, index_chunk: int = 1 << 20):
+        """
+        :param index_chunk: number of index entries (by node) kept in memory before they are spilled to a temporary
+            file (see ``IndexBuilder``)
+        """
+        self.path = path
+        if os.path.exists(path + INDEX_SUFFIX):
+            os.remove(path + INDEX_SUFFIX)
+        self.file = open(path, 'wb', buffering=buffering)
+        self.pos = 0  # Offset of the next record
+        self.instances: Dict[str, int] = {}  # String table: index of every instance name written so far
+        self.index = IndexBuilder(index_chunk)
+
+    def attach(self, net: Network) -> None:
+        net.observers.append(self)
+
+    def detach(self, net: Network) -> None:
+        net.observers.remove(self)
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.file.close()
+        with open(self.path + INDEX_SUFFIX, 'wb') as f:
+            self.index.write(f, self.pos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_record(self, kind: int, round: int, index: int, src: int, target: int, tag: int, data: bytes) -> None:
+        self.file.write(HEADER.pack(kind, round, index, src, target, tag, len(data)))
+        self.file.write(data)
+        self.index.add(self.pos, kind, round, index, src, target, len(data))
+        self.pos += HEADER.size + len(data)
+
+    def write(self, kind: int, round: int, instance: str, src: int, target: int, msg) -> None:
+        index = self.instances.get(instance)
+        if index is None:
+            index = self.instances[instance] = len(self.instances)
+            self.write_record(INSTANCE, round, index, 0, 0, STR, instance.encode('utf-8'))
+
+        tag, data = encode_msg(msg)
+        self.write_record(kind, round, index, src, target, tag, data)
+
+    # Network observer
+    def on_send(self, round: int, instance: str, src: int, targets, msg) -> None:
+        if isinstance(targets, range) and targets.start == 0 and targets.step == 1 and len(targets) > 0:
+            self.write(SEND, round, instance, src, -len(targets), msg)
+        else:
+            for target in targets:
+                self.write(SEND, round, instance, src, target, msg)
+
+    def on_deliver(self, round: int, instance: str, src: int, target: int, msg) -> None:
+        self.write(DELIVER, round, instance, src, target, msg)
+
+
+class Transcript:
+    """
+    Reads a transcript written by ``TranscriptWriter``. Both the file and its index are memory-mapped,
+    and lookups are binary searches in the index, so transcripts larger than RAM can be queried:
+    only the instance names are kept in memory. A missing or stale index (e.g., of an interrupted run)
+    is rebuilt, and saved next to the transcript, when it's opened.
+    Messages that aren't str or bytes are pickled, so only read transcripts you trust.
+    """
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            self.data = b''
+        self.index_file = self.open_index(path)
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, size, self.end, self.count, ninstances, self.nruns, self.nnode_entries,
+         self.runs_sorted) = INDEX_HEADER.unpack_from(self.index, 0)
+        # Offsets of the sections of the index
+        self.runs_pos = INDEX_HEADER.size + 8 * ninstances
+        self.byinstance_pos = self.runs_pos + RUN.size * self.nruns
+        self.bynode_pos = self.byinstance_pos + ENTRY.size * self.count
+
+        self.instances: List[str] = []  # The string table
+        for (pos,) in struct.iter_unpack('<Q', self.index[INDEX_HEADER.size:self.runs_pos]):
+            (kind, round, index, src, target, tag, length) = HEADER.unpack_from(self.data, pos)
+            self.instances.append(str(self.data[pos + HEADER.size:pos + HEADER.size + length], 'utf-8'))
+        self.instance_ids = {instance: index for (index, instance) in enumerate(self.instances)}
+
+    def open_index(self, path: str):
+        try:
+            f = open(path + INDEX_SUFFIX, 'rb')
+        except FileNotFoundError:
+            pass
+        else:
+            header = f.read(INDEX_HEADER.size)
+            if len(header) == INDEX_HEADER.size:
+                (magic, version, size) = INDEX_HEADER.unpack(header)[:3]
+                if magic == INDEX_MAGIC and version == INDEX_VERSION and size == len(self.data):
+                    return f
+            f.close()
+
+        builder = IndexBuilder()
+        data = self.data
+        pos = 0
+        while pos + HEADER.size <= len(data):
+            (kind, round, index, src, target, tag, length) = HEADER.unpack_from(data, pos)
+            if pos + HEADER.size + length > len(data):
+                break  # The last record was only partially written
+            builder.add(pos, kind, round, index, src, target, length)
+            pos += HEADER.size + length
+        try:
+            f = open(path + INDEX_SUFFIX, 'w+b')
+        except OSError:  # E.g., a read-only directory
+            f = tempfile.TemporaryFile()
+        builder.write(f, len(data))
+        f.flush()
+        return f
+
+    def scan(self, start: int = 0, end: Optional[int] = None) -> Iterator[int]:
+        """
+        The offsets of the message records between offsets ``start`` and ``end``, in file order
+        (read from the file rather than from the index).
+        """
+        data = self.data
+        pos = start
+        end = self.end if end is None else end
+        while pos < end:
+            (kind, round, index, src, target, tag, length) = HEADER.unpack_from(data, pos)
+            if kind != INSTANCE:
+                yield pos
+            pos += HEADER.size + length
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+        self.index.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def read(self, pos: int) -> Record:
+        (kind, round, index, src, target, tag, length) = HEADER.unpack_from(self.data, pos)
+        start = pos + HEADER.size
+        return Record(kind, round, self.instances[index], src, target, decode_msg(tag, self.data[start:start + length]))
+
+    def iter_runs(self) -> Iterator[Tuple[int, int, int, int]]:
+        for lo in range(0, self.nruns, 4096):
+            hi = min(lo + 4096, self.nruns)
+            yield from RUN.iter_unpack(self.index[self.runs_pos + lo * RUN.size:self.runs_pos + hi * RUN.size])
+
+    def round_runs(self, round: int) -> List[Tuple[int, int, int, int]]:
+        """
+        The runs of the records of ``round``.
+        """
+        if not self.runs_sorted:
+            return [run for run in self.iter_runs() if run[0] == round]
+        # Every round has at most one run
+        lo, hi = 0, self.nruns
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RUN.unpack_from(self.index, self.runs_pos + mid * RUN.size)[0] < round:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.nruns:
+            run = RUN.unpack_from(self.index, self.runs_pos + lo * RUN.size)
+            if run[0] == round:
+                return [run]
+        return []
+
+    def entry_range(self, base: int, count: int, key: int) -> Tuple[int, int]:
+        """
+        The range [lo, hi) of the entries with ``key`` in the sorted entries at ``base`` in the index.
+        """
+        bounds = []
+        for bound in (key, key + 1):
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if ENTRY.unpack_from(self.index, base + mid * ENTRY.size)[0] < bound:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            bounds.append(lo)
+        return (bounds[0], bounds[1])
+
+    def entries(self, base: int, lo: int, hi: int) -> Iterator[int]:
+        for start in range(lo, hi, 4096):
+            end = min(start + 4096, hi)
+            for (key, offset) in ENTRY.iter_unpack(self.index[base + start * ENTRY.size:base + end * ENTRY.size]):
+                yield offset
+
+    def rounds(self) -> List[int]:
+        return sorted({run[0] for run in self.iter_runs()})
+
+    def records(self, round: Optional[int] = None, instance: Optional[str] = None, node: Optional[int] = None,
+                kind: Optional[int] = None) -> Iterator[Record]:
+        """
+        Iterate over the records (in the order they were written) that match all of the given conditions.
+        :param round: absolute round number
+        :param instance: instance name
+        :param node: records sent by or to ``node`` (including messages sent to all nodes)
+        :param kind: ``SEND``, ``DELIVER``, ``INPUT`` or ``START``
+        """
+        # Scan the smallest of the matching indices: (size, offsets) pairs
+        candidates = [(self.count, self.scan())]
+        if round is not None:
+            runs = self.round_runs(round)
+            candidates.append((sum(run[3] for run in runs),
+                               (pos for (r, start, end, count) in runs for pos in self.scan(start, end))))
+        if instance is not None:
+            index = self.instance_ids.get(instance)
+            (lo, hi) = self.entry_range(self.byinstance_pos, self.count, index) if index is not None else (0, 0)
+            candidates.append((hi - lo, self.entries(self.byinstance_pos, lo, hi)))
+        if node is not None:
+            (lo, hi) = self.entry_range(self.bynode_pos, self.nnode_entries, node)
+            (blo, bhi) = self.entry_range(self.bynode_pos, self.nnode_entries, BROADCAST)
+            candidates.append((hi - lo + bhi - blo, heapq.merge(self.entries(self.bynode_pos, lo, hi),
+                                                                self.entries(self.bynode_pos, blo, bhi))))
+        (size, offsets) = min(candidates, key=lambda candidate: candidate[0])
+
+        for pos in offsets:
+            record = self.read(pos)
+            if ((round is None or record.round == round) and (instance is None or record.instance == instance)
+                    and (node is None or record.src == node or node in record.targets())
+                    and (kind is None or record.kind == kind)):
+                yield record
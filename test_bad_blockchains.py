@@ -3,6 +3,7 @@ from typing import List, Set, Dict
 from protocol_api.protocol import Node, simulate_protocol
 from protocol_api.blockchain import TotallyNaiveBlockchain, InconsistentBroadcastBlockchain, InvalidBroadcastBlockchain, InvalidByzantineBroadcast
 from protocol_api.net import NetworkClient, IO, default_net
+from protocol_api.checks import check_output_consistency, check_output_liveness
 
 try:
     # Student code should define:
@@ -24,58 +25,6 @@ def create_nodes(n: int, HonestCodeClass, CorruptedNodeClass):
     return nodes
 
 
-def check_output_consistency(r: int, honest_nodes: List[Node]):
-    output = ''
-    outputnode = -1
-    for node in honest_nodes:
-        nodeout = "|".join(node.io.out)
-        if nodeout.startswith(output):
-            output = nodeout
-            outputnode = node.id
-        elif not output.startswith(nodeout):
-            return (False,
-                    "At round {}, node {}'s output {} is inconsistent with node {}'s output {}".format(r, outputnode,
-                                                                                                       output, node.id,
-                                                                                                       nodeout))
-    return (True, "Consistent at round {}".format(r))
-
-
-def check_output_liveness(T: int, r: int, honest_nodes: List[Node]):
-    """
-    Check T-liveness at round r.
-    :param T: liveness parameter
-    :param r: current round
-    :param honest_nodes:
-    :return:
-    """
-
-    if r < T:
-        # Can't violate liveness if we haven't had T rounds yet.
-        return (True, "Trivially {}-live at round {}".format(T,r))
-
-    honest_inputs = set()
-    # input_rounds = [] # For each round store the set of inputs that were received at that round.
-
-    for i in range(r - T + 1):
-        for node in honest_nodes:
-            node_input = node.io.get_input(i)
-            if node_input:
-                honest_inputs.update(node_input)
-
-    # Compute output intersection.
-    outputs = honest_inputs.copy()
-    for node in honest_nodes:
-        outputs.intersection_update(node.io.out)
-
-    notlive = honest_inputs.difference(outputs)
-    if len(notlive) > 0:
-        return (False,
-                ("Not {}-live: Inputs were received by some honest party before round {} "+
-                "but not output by all honest parties by round {}: {}").format(T, r - T + 1, r, notlive))
-    else:
-        return (True, "{}-Live at round {}".format(T, r))
-
-
 # class TestTotallyNaiveBlockchain(unittest.TestCase):
 #     def assertOutputConsistent(self, r: int, honest_nodes: List[Node]):
 #         res, msg = check_output_consistency(r, honest_nodes)
@@ -0,0 +1,204 @@
+import sys
+import unittest
+from protocol_api.protocol import NodePool, simulate_protocol
+from protocol_api.blockchain import TotallyNaiveBlockchain, ByzantineBroadcastBlockchain, PipelinedBroadcastBlockchain
+from protocol_api.broadcast import ByzantineBroadcast, InvalidByzantineBroadcast
+from protocol_api.codec import BatchCodec, PipeBatchCodec, LengthPrefixedBatchCodec
+from protocol_api.mempool import Mempool, RotatingBloomFilter
+from protocol_api.net import Network, NetworkClient, IO, SingleInputIO
+from protocol_api.checks import ConsistencyChecker, LivenessChecker
+
+
+class TestBatchCodecs(unittest.TestCase):
+    def test_roundtrip(self):
+        codec = LengthPrefixedBatchCodec()
+        items = ["a|b", "", "é" * 200, b"\x00\xff"]
+        self.assertEqual(codec.decode(codec.encode(items)), items)
+        self.assertEqual(codec.decode(codec.encode([])), [])
+        self.assertEqual(codec.decode(0), [0])
+        self.assertEqual(codec.decode(b"\x01\x05ab"), [b"\x01\x05ab"])
+
+    def test_zero_copy_slices(self):
+        codec = LengthPrefixedBatchCodec()
+        payload = codec.encode([b"xyz", "w"])
+        slices = list(codec.iter_slices(payload))
+        self.assertEqual([(tag, data.tobytes()) for (tag, data) in slices], [(codec.BYTES, b"xyz"), (codec.STR, b"w")])
+        self.assertIs(slices[0][1].obj, payload)
+
+    def test_take_batch(self):
+        self.assertEqual(PipeBatchCodec(max_size=6).take_batch(["ab", "cd", "ef"]), ["ab", "cd"])
+        self.assertEqual(PipeBatchCodec(max_size=2).take_batch(["abcdef", "g"]), ["abcdef"])
+        self.assertEqual(PipeBatchCodec().take_batch(["abcdef", "g"]), ["abcdef", "g"])
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            BatchCodec()
+
+
+def pipe_inputs(id: int, round: int):
+    return ["tx|{}|{}".format(id, round)] if round % 4 == 0 else None
+
+
+class TestBlockchainCodec(unittest.TestCase):
+    def test_inputs_with_separator(self):
+        n = 3
+        net = Network()
+        codec = LengthPrefixedBatchCodec(max_size=40)
+        nodes = [ByzantineBroadcastBlockchain(ByzantineBroadcast, 'test1', i, None, n, NetworkClient(i, n, net), IO(),
+                                              codec=codec) for i in range(n)]
+        consistency = ConsistencyChecker()
+        liveness = LivenessChecker(60)
+        def check_round(r, nodes, terminated):
+            consistency(r, nodes, terminated)
+            liveness(r, nodes, terminated)
+
+        simulate_protocol(200, nodes, net, lambda id, r: pipe_inputs(id, r) if r < 100 else None, check_round)
+        self.assertIn("tx|1|4", nodes[0].io.out)
+        self.assertEqual(len(set(nodes[0].io.out)), 75)
+
+
+def every_round_inputs(id: int, round: int):
+    return ["tx{}-{}".format(id, round)] if round < 60 else None
+
+
+class TestPipelinedBlockchain(unittest.TestCase):
+    def run_blockchain(self, NodeClass, n: int = 4, rounds: int = 80):
+        net = Network()
+        nodes = [NodeClass(ByzantineBroadcast, 'test1', i, None, n, NetworkClient(i, n, net), IO(),
+                           codec=PipeBatchCodec(max_size=10)) for i in range(n)]
+        simulate_protocol(rounds, nodes, net, every_round_inputs, ConsistencyChecker())
+        return nodes
+
+    def test_throughput(self):
+        sequential = self.run_blockchain(ByzantineBroadcastBlockchain)
+        pipelined = self.run_blockchain(PipelinedBroadcastBlockchain)
+        R = ByzantineBroadcast.get_maxrounds()
+        self.assertEqual(len(pipelined[0].io.out), 80 - R + 1)
+        self.assertGreaterEqual(len(pipelined[0].io.out), (R - 1) * len(sequential[0].io.out))
+        self.assertEqual(len(set(pipelined[0].io.out)), len(pipelined[0].io.out))
+
+    def test_outputs_in_instance_order(self):
+        nodes = self.run_blockchain(PipelinedBroadcastBlockchain, n=3, rounds=20)
+        # Instance k is proposed by node k % n
+        self.assertEqual([out.split("-")[0] for out in nodes[0].io.out[:6]], ["tx0", "tx1", "tx2"] * 2)
+        self.assertFalse(nodes[0].in_flight.keys() - set(range(20 - 4 + 1, 20)))
+
+
+class StuffingNode(TotallyNaiveBlockchain):
+    """
+    Uses the sets of the blockchains from before the mempool.
+    """
+    def protocol(self, round: int) -> bool:
+        if round == 0:
+            self.pending_inputs = set()
+            self.outputs = set()
+        if round % self.n == self.id and "stuffed{}".format(self.id) not in self.outputs:
+            self.pending_inputs.add("stuffed{}".format(self.id))
+        return super().protocol(round)
+
+
+class TestMempool(unittest.TestCase):
+    def test_order(self):
+        mempool = Mempool()
+        mempool.update(["c", "a", "b", "a"])
+        self.assertEqual(list(mempool), ["c", "a", "b"])
+        mempool = Mempool(priority=len)
+        mempool.update(["ccc", "a", "bb", "d"])
+        self.assertEqual(list(mempool), ["a", "d", "bb", "ccc"])
+        mempool.mark_output(["a"])
+        self.assertEqual(list(mempool), ["d", "bb", "ccc"])
+
+    def test_capacity_and_seen(self):
+        mempool = Mempool(capacity=2)
+        self.assertTrue(mempool.add("a"))
+        self.assertTrue(mempool.add("b"))
+        self.assertFalse(mempool.add("c"))
+        self.assertEqual(mempool.dropped, 1)
+        mempool.mark_output(["a", "x"])
+        self.assertFalse(mempool.add("x"))
+        self.assertEqual(mempool.already_output, 1)
+        self.assertTrue(mempool.add("c"))
+        self.assertEqual(list(mempool), ["b", "c"])
+
+    def test_compatibility_sets(self):
+        n = 3
+        net = Network()
+        nodes = [StuffingNode('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        simulate_protocol(6, nodes, net, lambda id, r: ["tx{}".format(id)] if r == 0 else None)
+        self.assertEqual(nodes[1].io.out[:2], ["stuffed0", "tx0"])
+        self.assertIn("tx2", nodes[0].outputs)
+        self.assertEqual(set(nodes[0].outputs), set(nodes[0].io.out))
+        self.assertEqual(set(nodes[2].pending_inputs), set())
+        nodes[2].pending_inputs = {"a", "b"}
+        nodes[2].pending_inputs.difference_update(["a"])
+        self.assertEqual(list(nodes[2].mempool), ["b"])
+
+    def test_rotating_bloom_filter(self):
+        seen = RotatingBloomFilter(1000, fp_rate=0.01)
+        size = len(seen.current)
+        for i in range(10000):
+            seen.add("tx{}".format(i))
+        self.assertEqual(len(seen.current), size)
+        self.assertTrue(all("tx{}".format(i) in seen for i in range(9000, 10000)))
+        false_positives = sum("other{}".format(i) in seen for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_blockchain_with_bounded_mempool(self):
+        n = 3
+        net = Network()
+        nodes = [ByzantineBroadcastBlockchain(ByzantineBroadcast, 'test1', i, None, n, NetworkClient(i, n, net), IO(),
+                                              codec=LengthPrefixedBatchCodec(max_size=40),
+                                              mempool=Mempool(capacity=100, seen=RotatingBloomFilter(50)))
+                 for i in range(n)]
+        simulate_protocol(200, nodes, net, lambda id, r: pipe_inputs(id, r) if r < 100 else None,
+                          ConsistencyChecker())
+        self.assertEqual(len(set(nodes[0].io.out)), 75)
+
+
+class TestRecycling(unittest.TestCase):
+    def run_blockchain(self, NodeClass, recycle: bool):
+        n = 4
+        net = Network()
+        nodes = [NodeClass(ByzantineBroadcast, 'test1', i, None, n, NetworkClient(i, n, net), IO(), recycle=recycle)
+                 for i in range(n)]
+        simulate_protocol(40, nodes, net, every_round_inputs)
+        return nodes
+
+    def test_same_outputs(self):
+        for NodeClass in [ByzantineBroadcastBlockchain, PipelinedBroadcastBlockchain]:
+            self.assertEqual([node.io.out for node in self.run_blockchain(NodeClass, True)],
+                             [node.io.out for node in self.run_blockchain(NodeClass, False)])
+
+    def test_nodes_are_reused(self):
+        nodes = self.run_blockchain(ByzantineBroadcastBlockchain, True)
+        bbnode = nodes[0].bbnode
+        nodes[0].net.net.setround(40)
+        nodes[0].protocol(40)
+        self.assertIs(nodes[0].bbnode, bbnode)
+        self.assertIs(nodes[0].bbnode.instance, sys.intern("test1-BB10"))
+        self.assertEqual(vars(nodes[0].bbio), {})
+        self.assertEqual(vars(nodes[0].bbnode), {})
+
+    def test_arbitrary_attributes(self):
+        net = Network()
+        client = NetworkClient(0, 1, net)
+        io = SingleInputIO((0, None))
+        for obj in [client, io, ByzantineBroadcast('test1', 0, None, 1, client, io)]:
+            obj.extra = 1
+            self.assertEqual(obj.extra, 1)
+
+    def test_pool_clears_state(self):
+        net = Network()
+        pool = NodePool(InvalidByzantineBroadcast)
+        bbnode = pool('test1-BB0', 0, None, 1, NetworkClient(0, 1, net), SingleInputIO((0, None)))
+        bbnode.adversary_set_output("junk")
+        bbnode.has_terminated = True
+        pool.release(bbnode)
+        recycled = pool('test1-BB1', 0, None, 1, NetworkClient(0, 1, net), SingleInputIO((0, None)))
+        self.assertIs(recycled, bbnode)
+        self.assertFalse(hasattr(recycled, 'invalid_output'))
+        self.assertEqual(recycled.instance, 'test1-BB1')
+
+
+if __name__ == '__main__':
+    unittest.main()
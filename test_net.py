@@ -0,0 +1,417 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import List
+from protocol_api import net as netmodule
+from protocol_api.protocol import Node, simulate_protocol, SimulationSession
+from protocol_api.blockchain import TotallyNaiveBlockchain, ByzantineBroadcastBlockchain
+from protocol_api.broadcast import ByzantineBroadcast
+from protocol_api.aionet import AsyncNetwork, AsyncSimulation
+from protocol_api.net import Network, PartiallySynchronousNetwork, NetworkClient, IO, RoundEvictedError, \
+    reset_default_net
+from protocol_api.transcript import TranscriptWriter, Transcript, SEND, DELIVER, INDEX_SUFFIX
+from protocol_api.schedulers import Scheduler, MaxDelay, Partition, RandomDelay, ReorderWindow
+
+
+def create_nodes(n: int, net: Network, NodeClass, *args) -> List[Node]:
+    return [NodeClass(*args, 'test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+
+
+def get_inputs(id: int, round: int):
+    return ["tx{}-{}".format(id, round)] if round % 3 == 0 else None
+
+
+class TestRetention(unittest.TestCase):
+    def test_memory_stays_flat(self):
+        n = 4
+        net = Network(horizon=2)
+        nodes = create_nodes(n, net, ByzantineBroadcastBlockchain, ByzantineBroadcast)
+
+        msgs_sizes, instance_counts = [], []
+        def record_size(r, nodes, terminated):
+            msgs_sizes.append(len(net.msgs))
+            instance_counts.append(len(net.baserounds))
+
+        simulate_protocol(200, nodes, net, get_inputs, record_size)
+        self.assertLessEqual(max(msgs_sizes[20:]), max(msgs_sizes[:20]))
+        self.assertLessEqual(max(instance_counts[20:]), max(instance_counts[:20]))
+        self.assertLessEqual(len(net.baserounds), 2 + ByzantineBroadcast.get_maxrounds())
+
+    def test_evicted_round_raises(self):
+        n = 3
+        net = Network(horizon=2)
+        nodes = create_nodes(n, net, TotallyNaiveBlockchain)
+        simulate_protocol(10, nodes, net, get_inputs)
+
+        self.assertIsInstance(nodes[0].get_allmessages(8), dict)
+        with self.assertRaises(RoundEvictedError):
+            nodes[0].get_messages(2, 2)
+
+    def test_no_horizon_keeps_undeclared_instances(self):
+        net = Network()
+        client = NetworkClient(0, 2, net)
+        client.send('test1', 1, 'kept')
+        net.setround(100)
+        self.assertEqual(net.get_messages('test1', 0, 1, 0), ['kept'])
+
+    def test_declared_horizon_without_network_horizon(self):
+        n = 3
+        net = Network()
+        nodes = create_nodes(n, net, ByzantineBroadcastBlockchain, ByzantineBroadcast)
+        simulate_protocol(20, nodes, net, get_inputs)
+
+        self.assertLessEqual(len(net.msgs), ByzantineBroadcast.get_maxrounds() + 1)
+        # Reading a reclaimed instance doesn't fall back to base round 0
+        bbnode = nodes[0].bbnode
+        self.assertIsInstance(bbnode.get_allmessages(0), dict)
+        net.setround(20)
+        with self.assertRaises(RoundEvictedError):
+            bbnode.get_allmessages(0)
+        with self.assertRaises(RoundEvictedError):
+            nodes[0].net.get_messages('test1-BB0', 0, 0)
+
+
+class TestSharedBroadcasts(unittest.TestCase):
+    def run_blockchain(self, net: Network, NodeClass, *args):
+        nodes = create_nodes(4, net, NodeClass, *args)
+        simulate_protocol(30, nodes, net, get_inputs)
+        return [node.io.out for node in nodes]
+
+    def test_same_outputs(self):
+        for NodeClass, args in [(TotallyNaiveBlockchain, ()), (ByzantineBroadcastBlockchain, (ByzantineBroadcast,))]:
+            outputs = self.run_blockchain(Network(), NodeClass, *args)
+            self.assertEqual(outputs, self.run_blockchain(Network(shared_broadcasts=True), NodeClass, *args))
+            self.assertEqual(outputs, self.run_blockchain(Network(horizon=5, shared_broadcasts=True), NodeClass, *args))
+
+    def test_broadcast_stored_once(self):
+        net = Network(shared_broadcasts=True)
+        client = NetworkClient(0, 1000, net)
+        client.send('test1', NetworkClient.ALL, 'hello')
+        self.assertEqual(len(net.msgs[0]['test1']), 1)
+        net.setround(1)
+        self.assertEqual(net.get_messages('test1', 0, 999, 0), ['hello'])
+
+    def test_mixed_order(self):
+        for shared in [False, True]:
+            net = Network(shared_broadcasts=shared)
+            client = NetworkClient(0, 3, net)
+            client.send('test1', NetworkClient.ALL, 'a')
+            client.send('test1', 1, 'b')
+            client.send('test1', NetworkClient.ALL, 'c')
+            net.setround(1)
+            self.assertEqual(net.get_messages('test1', 0, 1, 0), ['a', 'b', 'c'])
+            self.assertEqual(net.get_allmessages('test1', 0, 2), {0: ['a', 'c']})
+
+
+class TestBatchSends(unittest.TestCase):
+    def test_same_as_send(self):
+        for make_net in [Network, lambda: Network(shared_broadcasts=True)]:
+            net = make_net()
+            client = NetworkClient(0, 3, net)
+            client.send('test1', [1, 2], 'a')
+            client.send_batch('test1', [(NetworkClient.ALL, 'b'), (2, 'c'), ((t for t in [0, 2]), 'd')])
+            net.setround(1)
+            self.assertEqual(net.get_messages('test1', 0, 2, 0), ['a', 'b', 'c', 'd'])
+            self.assertEqual(net.get_allmessages('test1', 0, 0), {0: ['b', 'd']})
+
+
+class TestDefaultNetwork(unittest.TestCase):
+    def tearDown(self):
+        reset_default_net()
+
+    def test_reset(self):
+        reset_default_net()
+        client = NetworkClient(0, 2)
+        self.assertIs(client.net, netmodule.default_net)
+        client.send('test1', 1, 'leak')
+
+        reset_default_net()
+        fresh = NetworkClient(1, 2)
+        self.assertIsNot(fresh.net, client.net)
+        fresh.net.setround(1)
+        self.assertNotIn('test1', fresh.net.baserounds)
+        with self.assertRaises(RoundEvictedError):
+            fresh.get_messages('test1', 0, 0)
+
+    def test_session(self):
+        outer = netmodule.default_net
+        with SimulationSession(n=3) as session:
+            self.assertIs(NetworkClient(0, 3).net, session.net)
+            with SimulationSession(PartiallySynchronousNetwork(2)) as inner:
+                self.assertIs(netmodule.default_net, inner.net)
+            nodes = [TotallyNaiveBlockchain('test1', i, None, 3, session.client(i), IO()) for i in range(3)]
+            session.simulate(10, nodes, get_inputs)
+            self.assertIs(netmodule.default_net, session.net)
+        self.assertIs(netmodule.default_net, outer)
+        self.assertEqual(nodes[0].io.out[:2], ['tx0-0', 'tx1-0'])
+
+
+class TestMessageViews(unittest.TestCase):
+    def test_cached_until_written(self):
+        for net in [Network(), Network(shared_broadcasts=True)]:
+            clients = [NetworkClient(i, 4, net) for i in range(4)]
+            for client in clients:
+                client.send('test1', NetworkClient.ALL, 'yes' if client.id < 3 else 'no')
+            clients[3].send('test1', 0, 'no')
+            clients[2].send('test1', 0, 'yes')
+
+            view = clients[0].get_view('test1', 0)
+            self.assertIs(clients[0].get_view('test1', 0), view)
+            self.assertEqual(view.contents(), {'yes', 'no'})
+            self.assertEqual(dict(view.count_senders()), {'yes': 3, 'no': 1})
+            self.assertEqual(view.values_with_senders(3), ['yes'])
+            self.assertEqual(view.messages(3), ('no', 'no'))
+
+            clients[3].send('test1', 0, 'yes')
+            view = clients[0].get_view('test1', 0)
+            self.assertEqual(view.values_with_senders(3), ['yes'])
+            self.assertEqual(dict(net.count_senders('test1', 0, 0)), {'yes': 4, 'no': 1})
+
+    def test_contents_is_a_copy(self):
+        net = Network()
+        client = NetworkClient(0, 1, net)
+        client.send('test1', 0, 'a')
+        contents = client.get_allmessages_contents('test1', 0)
+        contents.pop()
+        self.assertEqual(client.get_allmessages_contents('test1', 0), {'a'})
+
+    def test_evicted_views(self):
+        net = Network(horizon=1)
+        client = NetworkClient(0, 1, net)
+        client.send('test1', 0, 'a')
+        net.setround(1)
+        self.assertEqual(client.get_view('test1', 0).contents(), {'a'})
+        net.setround(3)
+        self.assertEqual(net.views, {})
+        with self.assertRaises(RoundEvictedError):
+            client.get_view('test1', 0)
+
+
+class TestAsyncNetwork(unittest.TestCase):
+    def run_async(self, delay: float, tick: float = 0.002):
+        net = AsyncNetwork(delay)
+        nodes = create_nodes(4, net, ByzantineBroadcastBlockchain, ByzantineBroadcast)
+        simulation = AsyncSimulation(nodes, net, get_inputs, tick)
+        simulation.run_sync(30)
+        return simulation, [node.io.out for node in nodes]
+
+    def test_same_outputs_as_lockstep(self):
+        net = Network()
+        nodes = create_nodes(4, net, ByzantineBroadcastBlockchain, ByzantineBroadcast)
+        simulate_protocol(30, nodes, net, get_inputs)
+
+        simulation, outputs = self.run_async(0.0)
+        self.assertEqual(outputs, [node.io.out for node in nodes])
+        stats = simulation.latency_stats()
+        self.assertEqual(stats['confirmed'], len(nodes[0].io.out))
+        self.assertGreater(stats['mean'], 0)
+
+    def test_late_messages_are_missed(self):
+        simulation, outputs = self.run_async(lambda src, target: 0.02 if src == 1 else 0.0)
+        self.assertNotIn("tx1-0", outputs[0])
+        self.assertIn("tx0-0", outputs[0])
+
+    def test_late_messages_are_evicted(self):
+        async def run():
+            net = AsyncNetwork(0.01, horizon=1)
+            net.newinstance('test1-BB0', lifetime=1)
+            clients = [NetworkClient(i, 2, net) for i in range(2)]
+            clients[0].send('test1-BB0', 1, 'reclaimed')
+            clients[0].send('test1', 1, 'evicted')
+            net.setround(1)
+            clients[1].send('test1', 0, 'kept')
+            net.setround(2)
+            await asyncio.sleep(0.05)
+            return net
+
+        net = asyncio.run(run())
+        self.assertEqual((net.in_flight, net.dropped), (0, 2))
+        self.assertEqual(net.msgs, {1: {'test1': {0: {1: ['kept']}}}})
+        self.assertEqual(net.expiry, {3: [(1, 'test1')]})
+        net.setround(3)
+        self.assertEqual(net.msgs, {})
+
+
+class TestPartiallySynchronousNetwork(unittest.TestCase):
+    def setUp(self):
+        self.net = PartiallySynchronousNetwork(3)
+        self.net.newinstance('test1')
+        self.clients = [NetworkClient(i, 3, self.net) for i in range(3)]
+        for client in self.clients:
+            client.send('test1', NetworkClient.ALL, 'm{}'.format(client.id))
+
+    def test_pending_queries(self):
+        pending = self.net.get_pendingmessages('test1')
+        self.assertEqual(len(pending), 9)
+        self.assertEqual(pending[0], (0, 0, 0, 0, 'm0'))
+        self.assertEqual(self.net.get_pendingmessages('other'), [])
+
+    def test_batch_deliveries(self):
+        self.assertEqual(self.net.deliver_to_target(1), 3)
+        self.assertEqual(self.net.deliver_pending_msgs([0, 3, 3, 100]), 2)
+        self.net.setround(1)
+        self.assertEqual(self.clients[1].get_allmessages_contents('test1', 0), {'m0', 'm1', 'm2'})
+        self.assertEqual(self.clients[0].get_allmessages('test1', 0), {0: ['m0'], 1: ['m1']})
+        self.assertEqual(len(self.net.get_pendingmessages('test1')), 4)
+
+    def test_delta_deliveries(self):
+        self.net.setround(2)
+        self.assertEqual(len(self.net.get_pendingmessages('test1')), 9)
+        self.net.setround(3)
+        self.assertEqual(self.net.get_pendingmessages('test1'), [])
+        self.assertEqual(len(self.net.pending), 0)
+        self.assertEqual(self.clients[2].get_messages('test1', 2, 1), ['m1'])
+        # Rounds and instances without pending messages read as empty, but aren't stored
+        self.assertEqual(self.net.pending_msgs[0], {})
+        self.assertEqual(self.net.pending_msgs[3]['test1'], {})
+        self.assertEqual(len(self.net.pending_msgs), 0)
+
+
+class DeliveryLog:
+    """
+    Network observer that records the round at which every message was delivered.
+    """
+    def __init__(self):
+        self.deliveries = []
+
+    def on_send(self, round, instance, src, targets, msg):
+        pass
+
+    def on_deliver(self, round, instance, src, target, msg):
+        self.deliveries.append((round, src, target, msg))
+
+
+class TestSchedulers(unittest.TestCase):
+    def run_network(self, scheduler, rounds: int = 12, Delta: int = 3):
+        net = PartiallySynchronousNetwork(Delta, scheduler)
+        log = DeliveryLog()
+        net.observers.append(log)
+        clients = [NetworkClient(i, 4, net) for i in range(4)]
+        for r in range(rounds):
+            net.setround(r)
+            if r < 4:
+                for client in clients:
+                    client.send('test1', NetworkClient.ALL, (client.id, r))
+        return net, log.deliveries
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            Scheduler()
+
+    def test_max_delay(self):
+        net, deliveries = self.run_network(None)
+        self.assertIsInstance(net.scheduler, MaxDelay)
+        self.assertEqual(len(deliveries), 4 * 16)
+        self.assertTrue(all(round == msg[1] + 2 for (round, src, target, msg) in deliveries))
+
+    def test_partition(self):
+        net, deliveries = self.run_network(Partition([0, 1], until=8))
+        for (round, src, target, msg) in deliveries:
+            if (src < 2) != (target < 2):
+                self.assertEqual(round, 8)
+            else:
+                self.assertEqual(round, msg[1] + 2)
+        self.assertEqual(len(deliveries), 4 * 16)
+
+    def test_random_delay(self):
+        net, deliveries = self.run_network(RandomDelay(seed=1))
+        self.assertEqual(deliveries, self.run_network(RandomDelay(seed=1))[1])
+        delays = {round - msg[1] for (round, src, target, msg) in deliveries}
+        self.assertEqual(delays, {0, 1, 2})
+        self.assertEqual(len(deliveries), 4 * 16)
+
+    def test_reorder_window(self):
+        net, deliveries = self.run_network(ReorderWindow(2, seed=1))
+        self.assertEqual({round for (round, src, target, msg) in deliveries}, {1, 3})
+        from_0_to_1 = [msg for (round, src, target, msg) in deliveries if src == 0 and target == 1]
+        self.assertEqual(sorted(from_0_to_1), [(0, r) for r in range(4)])
+        self.assertNotEqual(from_0_to_1, sorted(from_0_to_1))
+
+
+class TestTranscript(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'run.log')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookups(self):
+        net = Network(horizon=2)
+        with TranscriptWriter(self.path) as writer:
+            writer.attach(net)
+            clients = [NetworkClient(i, 3, net) for i in range(3)]
+            clients[0].send('test1', NetworkClient.ALL, 'a')
+            clients[1].send('test1', 2, b'b')
+            net.setround(1)
+            clients[2].send('test1-BB0', [0, 1], ('c', 1))
+
+        with Transcript(self.path) as transcript:
+            self.assertEqual(len(transcript), 4)
+            self.assertEqual(transcript.rounds(), [0, 1])
+            self.assertEqual([r.msg for r in transcript.records()], ['a', b'b', ('c', 1), ('c', 1)])
+            self.assertEqual([(r.src, list(r.targets()), r.msg) for r in transcript.records(round=0)],
+                             [(0, [0, 1, 2], 'a'), (1, [2], b'b')])
+            self.assertEqual([r.msg for r in transcript.records(instance='test1-BB0')], [('c', 1), ('c', 1)])
+            self.assertEqual([r.msg for r in transcript.records(node=2)], ['a', b'b', ('c', 1), ('c', 1)])
+            self.assertEqual([r.msg for r in transcript.records(node=0, round=1)], [('c', 1)])
+            self.assertEqual(list(transcript.records(instance='other')), [])
+
+    def test_index(self):
+        n = 4
+        net = Network(horizon=5)
+        nodes = [ByzantineBroadcastBlockchain(ByzantineBroadcast, 'test1', i, None, n, NetworkClient(i, n, net), IO())
+                 for i in range(n)]
+        # Tiny chunks, so that the index entries are sorted in many runs and merged
+        with TranscriptWriter(self.path, index_chunk=7) as writer:
+            writer.attach(net)
+            simulate_protocol(40, nodes, net, get_inputs)
+            writer.detach(net)
+        self.assertTrue(os.path.exists(self.path + INDEX_SUFFIX))
+
+        def check(transcript):
+            every = list(transcript.records())
+            self.assertEqual(len(every), len(transcript))
+            self.assertEqual(transcript.rounds(), sorted({r.round for r in every}))
+            for (round, instance, node) in [(5, None, None), (None, 'test1-BB3', None), (None, None, 2),
+                                            (7, 'test1-BB1', 1), (100, None, None), (None, 'other', 0)]:
+                self.assertEqual(list(transcript.records(round, instance, node)),
+                                 [r for r in every if (round is None or r.round == round) and
+                                  (instance is None or r.instance == instance) and
+                                  (node is None or r.src == node or node in r.targets())])
+            return every
+
+        with Transcript(self.path) as transcript:
+            every = check(transcript)
+            self.assertGreater(len(transcript.instances), 5)
+
+        # A stale index (here, of a run that was interrupted in the middle of a record) or a missing one is rebuilt
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * 10)
+        for remove in [False, False, True]:
+            if remove:
+                os.remove(self.path + INDEX_SUFFIX)
+            with Transcript(self.path) as transcript:
+                self.assertEqual(check(transcript), every)
+
+    def test_partially_synchronous_deliveries(self):
+        net = PartiallySynchronousNetwork(2)
+        nodes = create_nodes(3, net, TotallyNaiveBlockchain)
+        with TranscriptWriter(self.path) as writer:
+            writer.attach(net)
+            simulate_protocol(10, nodes, net, get_inputs)
+            writer.detach(net)
+
+        with Transcript(self.path) as transcript:
+            sent = list(transcript.records(kind=SEND))
+            delivered = list(transcript.records(kind=DELIVER))
+            self.assertEqual(sum(len(r.targets()) for r in sent), len(delivered) + len(net.pending))
+            self.assertEqual(sorted((r.src, r.target, r.msg) for r in delivered),
+                             sorted((r.src, target, r.msg) for r in sent if r.round < 8 for target in r.targets()))
+            self.assertEqual(sorted(r.msg for r in delivered if r.round == 9),
+                             sorted(msg for msgs in net.get_allmessages('test1', 9, 0).values() for msg in msgs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,448 @@
+import os
+import tempfile
+import unittest
+from protocol_api.protocol import simulate_protocol
+from protocol_api.blockchain import TotallyNaiveBlockchain, ByzantineBroadcastBlockchain, InvalidBroadcastBlockchain, \
+    InconsistentBroadcastBlockchain
+from protocol_api.broadcast import ByzantineBroadcast
+from protocol_api.net import Network, PartiallySynchronousNetwork, NetworkClient, IO
+from protocol_api.mempool import Mempool
+from protocol_api.instrument import Profiler, message_size
+from protocol_api.checkpoint import Checkpointer, list_checkpoints, restore, fork, read_records
+from protocol_api.replay import Recorder, RecordedInputs, ReplayNetwork
+from protocol_api.transcript import Transcript
+from protocol_api.checks import check_output_consistency, check_output_liveness, IncrementalChecker, \
+    ConsistencyChecker, LivenessChecker
+from protocol_api.sweep import Scenario, scenario_grid, run_scenario, run_scenarios
+from protocol_api.shard import simulate_sharded
+from protocol_api.streamio import StreamingIO, StreamInputs, rate_limited, file_transactions
+from protocol_api.fuzz import FuzzSpace, fuzz, run_case, ddmin
+
+
+def get_inputs(id: int, round: int):
+    return ["tx{}-{}".format(id, round)] if round % 3 == 0 else None
+
+
+class CensoringNode(InvalidBroadcastBlockchain):
+    """
+    Makes every BB instance output junk, so no input is ever output.
+    """
+    def protocol(self, round: int) -> bool:
+        retval = super().protocol(round)
+        if round % self.R == 0:
+            self.bbnode.adversary_set_output("junk")
+        return retval
+
+
+def create_bb_node(id: int, n: int, net: Network):
+    return ByzantineBroadcastBlockchain(ByzantineBroadcast, 'test1', id, None, n, NetworkClient(id, n, net), IO())
+
+
+def failing_inputs(id: int, round: int):
+    if round == 5:
+        raise ValueError("no inputs")
+    return None
+
+
+class ReorderingNode(TotallyNaiveBlockchain):
+    """
+    Delivers the pending messages sent to odd nodes as early as possible, in reverse order.
+    """
+    def protocol(self, round: int) -> bool:
+        retval = super().protocol(round)
+        net = self.net.net
+        net.deliver_pending_msgs(reversed([id for (id, r, src, target, msg) in net.get_pendingmessages(self.instance)
+                                           if target % 2 == 1]))
+        return retval
+
+
+class TestSweep(unittest.TestCase):
+    def test_grid(self):
+        scenarios = scenario_grid(honest_class=InvalidBroadcastBlockchain, n=[3, 4], rounds=40, get_inputs=get_inputs,
+                                  corrupted_class=[None, CensoringNode], corrupted_id=0, T=20)
+        self.assertEqual(len(scenarios), 4)
+        self.assertEqual(scenarios[1], Scenario(InvalidBroadcastBlockchain, 3, 40, get_inputs, CensoringNode, 0, T=20))
+
+    def test_parallel_matches_sequential(self):
+        scenarios = scenario_grid(honest_class=InvalidBroadcastBlockchain, n=3, rounds=40, get_inputs=get_inputs,
+                                  corrupted_class=[None, CensoringNode], corrupted_id=0, T=20)
+        results = run_scenarios(scenarios, processes=2)
+        self.assertEqual(results, [run_scenario(scenario) for scenario in scenarios])
+
+        honest, attacked = results
+        self.assertTrue(honest.consistency[0], honest.consistency[1])
+        self.assertTrue(honest.liveness[0], honest.liveness[1])
+        self.assertFalse(attacked.liveness[0])
+
+    def test_delta(self):
+        result = run_scenario(Scenario(TotallyNaiveBlockchain, 3, 10, get_inputs, Delta=1))
+        self.assertEqual(result.terminated, set())
+        self.assertTrue(result.consistency[0], result.consistency[1])
+
+
+class TestIncrementalCheckers(unittest.TestCase):
+    def compare_checkers(self, corrupted_class):
+        n, T = 3, 20
+        net = Network()
+        nodes = [InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        nodes[0] = corrupted_class('test1', 0, None, n, NetworkClient(0, n, net), IO())
+        honest_nodes = nodes[1:]
+        consistency = ConsistencyChecker([0])
+        liveness = LivenessChecker(T, [0])
+
+        verdicts = []
+        def check_round(r, nodes, terminated):
+            consistency.update(r, honest_nodes)
+            liveness.update(r, honest_nodes)
+            self.assertEqual(consistency.check(r)[0], check_output_consistency(r, honest_nodes)[0])
+            self.assertEqual(liveness.check(r)[0], check_output_liveness(T, r, honest_nodes)[0])
+            verdicts.append(liveness.check(r)[0])
+
+        simulate_protocol(50, nodes, net, get_inputs, check_round)
+        return verdicts
+
+    def test_honest_run(self):
+        self.assertTrue(all(self.compare_checkers(InvalidBroadcastBlockchain)))
+
+    def test_attacked_run(self):
+        self.assertFalse(all(self.compare_checkers(CensoringNode)))
+
+    def test_round_assertion(self):
+        n = 3
+        net = Network()
+        nodes = [InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        nodes[2] = CensoringNode('test1', 2, None, n, NetworkClient(2, n, net), IO())
+        with self.assertRaises(AssertionError):
+            simulate_protocol(50, nodes, net, get_inputs, LivenessChecker(20, [2]))
+
+    def test_inconsistent_outputs(self):
+        checker = ConsistencyChecker()
+        checker.add_outputs(0, 0, ["a", "b"])
+        checker.add_outputs(0, 1, ["a"])
+        self.assertTrue(checker.check(0)[0])
+        checker.add_outputs(1, 1, ["c"])
+        self.assertFalse(checker.check(1)[0])
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            IncrementalChecker()
+
+
+def sparse_inputs(id: int, round: int):
+    return ["tx{}-{}".format(id, round)] if round % 50 == id else None
+
+
+class TestEventDriven(unittest.TestCase):
+    def run_nodes(self, net, NodeClass, event_driven: bool, *args, get_inputs=sparse_inputs):
+        n = 5
+        nodes = [NodeClass(*args, 'test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        calls = []
+        simulate_protocol(200, nodes, net, get_inputs, node_assertion=lambda r, node, _: calls.append((r, node.id)),
+                          event_driven=event_driven)
+        return [node.io.out for node in nodes], len(calls)
+
+    def test_identical_outputs(self):
+        # ratio: the largest fraction of the node executions that the event-driven simulation may keep
+        for make_net in [Network, lambda: Network(shared_broadcasts=True), lambda: PartiallySynchronousNetwork(1)]:
+            for NodeClass, args, ratio in [(TotallyNaiveBlockchain, (), 0.5),
+                                           (ByzantineBroadcastBlockchain, (ByzantineBroadcast,), 0.8),
+                                           (InvalidBroadcastBlockchain, (), 1)]:
+                outputs, calls = self.run_nodes(make_net(), NodeClass, False, *args)
+                event_outputs, event_calls = self.run_nodes(make_net(), NodeClass, True, *args)
+                self.assertEqual(outputs, event_outputs)
+                self.assertGreater(len(outputs[0]), 0)
+                self.assertLessEqual(event_calls, calls * ratio)
+
+    def test_sleeping_nodes_are_not_polled(self):
+        polled = []
+        def get_inputs(id: int, round: int):
+            polled.append((round, id))
+            return (0, "tx") if round == 0 else None
+
+        outputs, calls = self.run_nodes(Network(), ByzantineBroadcast, True, get_inputs=get_inputs)
+        self.assertEqual(outputs, [["tx"]] * 5)
+        # Every node runs (and is polled) in rounds 0, 1 (the sender's message arrived) and 3 (the output round)
+        self.assertEqual(calls, 15)
+        self.assertEqual(sorted(polled), [(r, id) for r in (0, 1, 3) for id in range(5)])
+
+
+class TestProfiler(unittest.TestCase):
+    def test_profile(self):
+        n = 3
+        net = PartiallySynchronousNetwork(2)
+        nodes = [InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        profiler = Profiler(history=10)
+        simulate_protocol(40, nodes, net, get_inputs, profiler=profiler)
+
+        self.assertEqual(len(profiler.rounds), 10)
+        self.assertEqual(profiler.rounds[-1].round, 39)
+        self.assertEqual(set(profiler.rounds[-1].node_time), {0, 1, 2})
+        self.assertEqual(profiler.sent['test1-BB0'], n)
+        self.assertEqual(profiler.received['test1-BB0'], n)
+        self.assertTrue(any(round.queued_bytes > 0 for round in profiler.rounds))
+
+        stacks = dict(line.rsplit(" ", 1) for line in profiler.folded())
+        self.assertEqual(set(stacks), {"test1", "test1;BB"})
+        self.assertEqual(set(profiler.breakdown(2)), {"test1-BB"})
+        self.assertEqual(net.observers, [])
+        self.assertIsNone(nodes[0].profiler)
+
+    def test_queued_bytes(self):
+        n = 3
+        net = PartiallySynchronousNetwork(2)
+        nodes = [InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        profiler = Profiler()
+        dropped = []
+        def check_round(r, nodes, terminated):
+            self.assertEqual(profiler.rounds[-1].queued_bytes,
+                             sum(message_size(entry[2]) for entry in net.pending.byid.values()))
+            if r >= 10 and net.pending and not dropped:
+                dropped.append(net.pending.remove(next(iter(net.pending.byid))))  # Not delivered
+        simulate_protocol(20, nodes, net, get_inputs, check_round, profiler=profiler)
+        self.assertTrue(dropped)
+        self.assertGreater(max(round.queued_bytes for round in profiler.rounds), 0)
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'run.ckpt')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def create_run(self, net):
+        n = 3
+        return [InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+
+    def test_resume(self):
+        for make_net in [lambda: Network(horizon=4), lambda: PartiallySynchronousNetwork(2)]:
+            net = make_net()
+            nodes = self.create_run(net)
+            simulate_protocol(60, nodes, net, get_inputs)
+            expected = [node.io.out for node in nodes]
+
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            net = make_net()
+            nodes = self.create_run(net)
+            simulate_protocol(30, nodes, net, get_inputs, Checkpointer(self.path, net, every=10))
+            self.assertEqual(list_checkpoints(self.path), [9, 19, 29])
+
+            resumed = []
+            for round in [19, 19, None]:
+                checkpoint = restore(self.path, round)
+                simulate_protocol(60, checkpoint.nodes, checkpoint.net, get_inputs,
+                                  start_round=checkpoint.round + 1, terminated=checkpoint.terminated)
+                resumed.append([node.io.out for node in checkpoint.nodes])
+                self.assertEqual(resumed[-1], expected)
+
+    def test_incremental_and_fork(self):
+        net = Network()
+        nodes = self.create_run(net)
+        checkpointer = Checkpointer(self.path, net)
+        simulate_protocol(20, nodes, net, get_inputs, checkpointer)
+        size = os.path.getsize(self.path)
+        checkpointer.save(19, nodes, set())
+        self.assertLess(os.path.getsize(self.path) - size, size / 10)
+
+        forked = os.path.join(self.tmpdir.name, 'fork.ckpt')
+        fork(self.path, 9, forked)
+        self.assertEqual(list_checkpoints(forked), list(range(10)))
+        checkpoint = restore(forked)
+        simulate_protocol(20, checkpoint.nodes, checkpoint.net, get_inputs, Checkpointer(forked, checkpoint.net),
+                          start_round=10)
+        self.assertEqual(list_checkpoints(forked), list(range(20)))
+        self.assertEqual(restore(forked).nodes[0].io.out, nodes[0].io.out)
+
+    def test_only_changes_are_written(self):
+        n = 4
+        net = PartiallySynchronousNetwork(2)
+        nodes = [TotallyNaiveBlockchain('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        checkpointer = Checkpointer(self.path, net)
+        sizes = []
+        def save(r, nodes, terminated):
+            checkpointer(r, nodes, terminated)
+            sizes.append(os.path.getsize(self.path))
+
+        simulate_protocol(20, nodes, net, lambda id, round: None, save, event_driven=True)
+        # Only the sender of the round runs and changes its state (its wakeup),
+        # and the IO histories and network state are deltas
+        self.assertEqual([len(payload) for (kind, r, payload) in read_records(self.path) if kind == 'nodes'][1:],
+                         [1] * 19)
+        growth = [b - a for (a, b) in zip(sizes, sizes[1:])]
+        self.assertLessEqual(max(growth), 2 * min(growth))
+        self.assertLess(max(growth), sizes[0])
+
+    def test_mempools_are_deltas(self):
+        n = 4
+        net = Network(horizon=10)
+        nodes = [ByzantineBroadcastBlockchain(ByzantineBroadcast, 'test1', i, None, n, NetworkClient(i, n, net), IO(),
+                                              mempool=Mempool(priority=len)) for i in range(n)]
+        checkpointer = Checkpointer(self.path, net, every=10)
+        def get_many_inputs(id: int, round: int):
+            return ["tx{}-{}-{}".format(id, round, k) for k in range(round % 4)]
+
+        simulate_protocol(200, nodes, net, get_many_inputs, checkpointer)
+        self.assertGreater(len(nodes[0].mempool.seen.items), 1000)
+        # The items that were already output are only written once
+        sizes = [len(payload[0][0][2][1]) for (kind, r, payload) in read_records(self.path) if kind == 'mempools']
+        self.assertEqual(sum(sizes), len(nodes[0].mempool.seen.items))
+
+        checkpoint = restore(self.path, 99)
+        simulate_protocol(200, checkpoint.nodes, checkpoint.net, get_many_inputs, start_round=100)
+        for (node, restored) in zip(nodes, checkpoint.nodes):
+            self.assertEqual(restored.mempool.seen.items, node.mempool.seen.items)
+            self.assertEqual(list(restored.mempool), list(node.mempool))
+            self.assertEqual(restored.io.out, node.io.out)
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'run.log')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def record_and_replay(self, net, honest_class, corrupted_class, n, rounds, replayed):
+        nodes = [honest_class('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        nodes[0] = corrupted_class('test1', 0, None, n, NetworkClient(0, n, net), IO())
+        with Recorder(self.path, net, get_inputs) as recorder:
+            simulate_protocol(rounds, nodes, net, recorder.get_inputs)
+
+        with Transcript(self.path) as transcript:
+            replay_net = ReplayNetwork(transcript, replayed)
+            replay_nodes = [honest_class('test1', i, None, n, NetworkClient(i, n, replay_net), IO()) for i in replayed]
+            simulate_protocol(rounds, replay_nodes, replay_net, RecordedInputs(transcript))
+
+        self.assertEqual([node.io.out for node in replay_nodes], [nodes[i].io.out for i in replayed])
+        self.assertTrue(all(replay_node.io.out for replay_node in replay_nodes))
+
+    def test_synchronous(self):
+        self.record_and_replay(Network(), InvalidBroadcastBlockchain, CensoringNode, 4, 60, [2])
+
+    def test_adversarial_delivery_order(self):
+        self.record_and_replay(PartiallySynchronousNetwork(3), TotallyNaiveBlockchain, ReorderingNode, 4, 30, [1, 3])
+
+
+class TestSharded(unittest.TestCase):
+    def test_matches_sequential(self):
+        n, rounds = 7, 40
+        net = Network(horizon=5)
+        nodes = [create_bb_node(i, n, net) for i in range(n)]
+        terminated = simulate_protocol(rounds, nodes, net, get_inputs)
+        expected = [node.io.get_outputs() for node in nodes]
+        self.assertTrue(expected[0])
+
+        for shards in [1, 3]:
+            self.assertEqual(simulate_sharded(rounds, n, create_bb_node, get_inputs, shards, horizon=5),
+                             (terminated, expected))
+
+    def test_worker_error(self):
+        with self.assertRaisesRegex(RuntimeError, "no inputs"):
+            simulate_sharded(10, 4, create_bb_node, failing_inputs, 2)
+
+
+class TestStreamingIO(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'txs.txt')
+        with open(self.path, 'w') as f:
+            for i in range(300):
+                f.write("tx{}\n".format(i))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_inputs_from_file(self):
+        get_inputs = StreamInputs(rate_limited(file_transactions(self.path), 3, rate=4))
+        self.assertEqual(get_inputs(0, 0), ["tx0", "tx3"])
+        self.assertEqual(get_inputs(1, 0), ["tx1"])
+        self.assertIsNone(get_inputs(1, 1000))
+
+    def test_streamed_checkers(self):
+        n, rounds = 3, 160
+        net = Network()
+        consistency = ConsistencyChecker()
+        liveness = LivenessChecker(40)
+        nodes = []
+        for i in range(n):
+            (on_consistency_input, on_consistency_output) = consistency.stream(i)
+            (on_liveness_input, on_liveness_output) = liveness.stream(i)
+            def on_output(r, output, on_consistency_output=on_consistency_output,
+                          on_liveness_output=on_liveness_output):
+                on_consistency_output(r, output)
+                on_liveness_output(r, output)
+            io = StreamingIO(maxlen=10, on_output=on_output, on_input=on_liveness_input)
+            nodes.append(InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net), io))
+
+        def check_round(r, nodes, terminated):
+            consistency(r, nodes, terminated)
+            liveness(r, nodes, terminated)
+
+        get_inputs = StreamInputs(rate_limited(file_transactions(self.path), n, rate=3))
+        simulate_protocol(rounds, nodes, net, get_inputs, check_round)
+        net = Network()
+        plain = [InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net), IO()) for i in range(n)]
+        simulate_protocol(rounds, plain, net, StreamInputs(rate_limited(file_transactions(self.path), n, rate=3)))
+        self.assertEqual([node.io.count for node in nodes], [len(node.io.out) for node in plain])
+        self.assertEqual(nodes[0].io.get_outputs(), plain[0].io.out[-10:])
+        self.assertLessEqual(len(nodes[0].io.inp), 1)
+        self.assertEqual(len(consistency.tail), 0)
+        self.assertEqual(liveness.first_seen, {})
+
+    def test_streamed_checker_detects_violation(self):
+        n = 3
+        net = Network()
+        liveness = LivenessChecker(20, [0])
+        nodes = [CensoringNode('test1', 0, None, n, NetworkClient(0, n, net), IO())]
+        for i in range(1, n):
+            (on_input, on_output) = liveness.stream(i)
+            nodes.append(InvalidBroadcastBlockchain('test1', i, None, n, NetworkClient(i, n, net),
+                                                    StreamingIO(0, on_output, on_input)))
+        with self.assertRaises(AssertionError):
+            simulate_protocol(40, nodes, net, get_inputs, liveness)
+
+    def test_checker_reads_bounded_outputs(self):
+        n = 3
+        for (maxlen, raises) in [(5, False), (0, True)]:
+            net = Network()
+            nodes = [TotallyNaiveBlockchain('test1', i, None, n, NetworkClient(i, n, net), StreamingIO(maxlen))
+                     for i in range(n)]
+            liveness = LivenessChecker(10)
+            if raises:
+                with self.assertRaisesRegex(ValueError, "stream"):
+                    simulate_protocol(60, nodes, net, get_inputs, liveness)
+            else:
+                simulate_protocol(60, nodes, net, get_inputs, liveness)
+                self.assertEqual(liveness.outputs_seen[0], nodes[0].io.count)
+
+
+class TestFuzz(unittest.TestCase):
+    def test_finds_and_shrinks_inconsistency(self):
+        failures = fuzz(FuzzSpace(InconsistentBroadcastBlockchain), cases=50, processes=1)
+        self.assertEqual(len(failures), 1)
+        failure = failures[0]
+        self.assertEqual(failure.kind, 'consistency')
+        self.assertEqual(len(failure.case.actions), 1)
+        self.assertEqual(failure.case.inputs, ())
+        self.assertEqual(failure.case.rounds, failure.round + 1)
+        self.assertEqual(run_case(failure.case), failure)
+
+    def test_honest_protocol(self):
+        self.assertEqual(fuzz(FuzzSpace(TotallyNaiveBlockchain, T=10), cases=50, processes=1), [])
+
+    def test_parallel_matches_sequential(self):
+        space = FuzzSpace(InvalidBroadcastBlockchain, T=24)
+        failures = fuzz(space, cases=100, processes=1, max_failures=3, shrink_failures=False)
+        self.assertEqual(len(failures), 3)
+        self.assertEqual(failures, fuzz(space, cases=100, processes=2, max_failures=3, shrink_failures=False))
+
+    def test_ddmin(self):
+        self.assertEqual(ddmin(range(20), lambda items: 3 in items and 17 in items), [3, 17])
+        self.assertEqual(ddmin(range(5), lambda items: True), [])
+
+
+if __name__ == '__main__':
+    unittest.main()